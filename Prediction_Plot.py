@@ -15,6 +15,11 @@ And we make it look b-e-a-utiful.
 
 import logging
 import plot_grabber as grabr
+import profiling
+from np_hist import Hist
+from render_context import default_context
+from plot_export import default_exporter
+from file_utils import check_dir_exists
 import ROOT as r
 from itertools import product, izip
 import math
@@ -34,53 +39,22 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 
-## FOR NORMAL HADRONIC PLOTS
-signal_proc = "Had"
-# # MC processes that go into transfer factors
-processes_mc_ctrl = ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']
+from prediction_engine import (signal_proc, processes_mc_ctrl, processes_mc_signal_le1b,
+                               processes_mc_signal_ge2b, ctrl_regions,
+                               file_start, signal_processes, input_requests,
+                               rebin_hist, make_ht_string, PredictionEngine)
+from plot_plan import OUT_STEM, plot_dir, plot_outname
 
-processes_mc_signal_le1b = {"OneMuon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'SingleTop'],
-                            "DiMuon": ['Zinv']}
-
-processes_mc_signal_ge2b = {"OneMuon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'SingleTop', 'Zinv'],
-                            "DiMuon": []}  # for >= 2btags dimu region not used
-
-# # Control regions to get data shapes (+ proper titles for legend etc)
-ctrl_regions = {"OneMuon": "Single #mu BG", "DiMuon": "#mu#mu BG", "QCD": "QCD BG (MC)"}
-
-## FOR DIMUON FROM PHOTON
-# signal_proc = "DiMuon"
-# # MC processes that go into transfer factors
-# processes_mc_ctrl = ['MC']
-
-# processes_mc_signal_le1b = {"Photon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']}
-
-# processes_mc_signal_ge2b = {"Photon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']}
-
-# # Control regions to get data shapes (+ proper titles for legend etc)
-# ctrl_regions = {"Photon": "#mu#mu BG from #gamma"}
-
-# Sytematics on TF (as a %). Fn on njets & HT
-tf_systs = {
-    "le3j": {"200_275": 4, "275_325": 6, "325_375": 6, "375_475": 8, "475_575": 8, "575_675": 12, "675_775": 12, "775_875": 17, "875_975": 17, "975_1075": 19, "1075": 19},
-    "ge4j": {"200_275": 6, "275_325": 6, "325_375": 11, "375_475": 11, "475_575": 11, "575_675": 18, "675_775": 18, "775_875": 20, "875_975": 20, "975_1075": 26, "1075": 26}
-}
-
-
-def check_dir_exists(d):
-    opath = os.path.abspath(d)
-    if not os.path.isdir(opath):
-        os.makedirs(opath)
 
 class PredictionPlot():
     """
     Class to make plot from data, BG shapes from data, and a neat ratio plot below that.
     """
 
-    def __init__(self, ROOTdir, out_dir, var, njet, btag, htbins, rebin, log, title, qcd=False):
+    def __init__(self, ROOTdir, out_dir, var, njet, btag, htbins, rebin, log, title, qcd=False, engine=None, context=None, exporter=None):
         self.ROOTdir = ROOTdir
         self.fineJetMulti = "fineJetMulti" in ROOTdir # whether fine Jet Multiplciity or not
-        self.out_stem = "Prediction" # used for folder & plot names
+        self.out_stem = OUT_STEM # used for folder & plot names
         self.var = var
         self.njet = njet
         self.njet_string = grabr.jet_string_fine(njet) if self.fineJetMulti else grabr.jet_string_old(njet)
@@ -92,41 +66,38 @@ class PredictionPlot():
         self.log = log
         self.autorange_x = True  # to auto set x range for non-empty range
         self.autorange_y = True  # to auto set y range for sensible range
-        unique = self.njet_string+self.btag_string+self.htstring+self.var  # need unique names to stop segfault
-        unique = "" # but not when actually running...
-        self.c = r.gROOT.FindObject("c"+unique)
-        if not self.c:
-            self.c = r.TCanvas("c"+unique, "", 1200, 1000)
-        self.c.cd()  # this seems important to avoid segfaults
-        self.up = r.TPad("u"+unique, "", 0.01, 0.25, 0.99, 0.99)
-        self.dp = r.TPad("d"+unique, "", 0.01, 0.01, 0.99, 0.25)
-        self.dp.SetBottomMargin(1.3 * self.dp.GetBottomMargin())
+        # canvas, pads, legend etc are reused for all plots - see render_context.py
+        self.context = context or default_context()
+        self.c = self.context.canvas
+        self.exporter = exporter or default_exporter()  # writes files in the background
+        self.up = self.context.up
+        self.dp = self.context.dp
+        self.data_signal = None  # Hist of data in signal region
+        self.components = []  # Hists of BG estimates, one per control region (+QCD)
+        self.errors_stat = []  # Hists of cumulative stat errors on BG estimate
+        self.errors_stat_syst = []  # Hists of cumulative stat+syst errors on BG estimate
+        self.totals = []  # Hists of cumulative BG estimate (same as errors_stat, unless using toys)
         self.hist_data_signal = None
         self.component_hists = []
         self.transfer_factors = {}
-        self.shape_stack = r.THStack("shape_stack"+unique, "")
+        self.shape_stack = None  # made fresh by the context when we start drawing
         self.errors_all_hists = False  # set true if you want errors on all component hists as well
         self.error_hists_stat = None
         self.error_hists_stat_syst = None
         self.hist_ratio = None # For ratio plot data/MC points
         self.hist_ratio_stat = None # For ratio plot MC stat err bars
         self.hist_ratio_stat_syst = None # For ratio plot MC stat+syst err bars
-        self.stdtxt = self.make_standard_text()
-        self.cuttxt = self.make_bin_text(custom=title)
-        self.leg = self.make_legend()
-        self.plot_components = False  # plots ALL components, for debugging
-        self.outdir = "%s/%s_%s_%s" % (out_dir, njet, btag, self.htstring)  # dir for putting all plots
+        self.title = title
+        self.stdtxt = self.context.stdtxt
+        self.cuttxt = self.context.cuttxt
+        self.leg = self.context.leg
+        self.plot_components = False  # plots ALL components, for debugging - see make_component_plots()
+        self.engine = engine  # PredictionEngine to do the maths, can share between plots
+        self.outdir = plot_dir(out_dir, njet, btag, htbins)  # dir for putting all plots
         check_dir_exists(self.outdir)
         self.qcd = qcd  # whether to add in QCD MC in signal region. NOTE: *NOT* included in ratio plot
         # output file dir+name (without extension)
-        self.outname = "%s/%s_%s_%s_%s%s%s%s" % (self.outdir,
-                                                 self.out_stem,
-                                                 self.var,
-                                                 self.njet_string,
-                                                 self.btag_string,
-                                                 "_" if self.btag_string else "",
-                                                 self.htstring,
-                                                 "_QCD" if self.qcd else "")
+        self.outname = plot_outname(ROOTdir, out_dir, var, njet, btag, htbins, qcd)
 
 
     def make_plots(self):
@@ -134,19 +105,23 @@ class PredictionPlot():
         Main routine for this class to make the required hists,
         then style and plots them, then draw a ratio plot below.
         """
-        self.make_hists()
+        with profiling.timed("make_hists"):
+            self.make_hists()
+        if self.plot_components:
+            self.make_component_plots()
         # Now make plots
-        self.make_main_plot(self.up)
+        with profiling.timed("draw_main"):
+            self.context.reset(self.make_bin_text(custom=self.title))
+            self.shape_stack = self.context.stack
+            self.make_main_plot(self.up)
         self.c.cd()
 
         # Take out the QCD MC from the ratio plot
-        hist_mc_stat = self.error_hists_stat[:]
-        hist_mc_stat_syst = self.error_hists_stat_syst[:]
-        for h1,h2 in zip(hist_mc_stat,hist_mc_stat_syst):
-            if "QCD" in h1.GetName().upper():
-                hist_mc_stat.remove(h1)
-                hist_mc_stat_syst.remove(h2)
-        self.make_ratio_plot(self.dp, self.hist_data_signal, hist_mc_stat_syst[-1], hist_mc_stat[-1], hist_mc_stat_syst[-1])
+        hist_mc = [h for h in self.totals if "QCD" not in h.name.upper()]
+        hist_mc_stat = [h for h in self.errors_stat if "QCD" not in h.name.upper()]
+        hist_mc_stat_syst = [h for h in self.errors_stat_syst if "QCD" not in h.name.upper()]
+        with profiling.timed("draw_ratio"):
+            self.make_ratio_plot(self.dp, self.data_signal, hist_mc[-1], hist_mc_stat[-1], hist_mc_stat_syst[-1])
         self.c.cd()
 
 
@@ -154,30 +129,17 @@ class PredictionPlot():
         """
         Make string out of HT bin(s)
         """
-        # test if list or string
-        if hasattr(htbins, "__iter__"):
-            htstring = htbins[0].split("_")[0]
-            if (htbins[-1] != "1075"):
-                htstring += "_"+htbins[-1].split("_")[-1]
-            else:
-                # If doing inclusive, then want "_upwards"
-                # If just the 1075 - Inf bin, no "upwards"
-                if len(htbins) > 1:
-                    htstring += "_upwards"
-        else:
-            htstring = htbins
-        return htstring
+        return make_ht_string(htbins)
 
 
-    def save(self, odir=None, name=None):
+    def save(self, odir=None, name=None, on_done=None):
         """
-        Save the whole plot to file, using some auto directory structure if needed
+        Save the whole plot to file, using some auto directory structure if needed.
+        on_done() gets called once all the files are written (see plot_export)
         """
         self.c.cd()
         if not name:
-            self.c.SaveAs("%s.pdf" % self.outname)
-            self.c.SaveAs("%s.png" % self.outname)
-            self.c.SaveAs("%s.C" % self.outname)
+            self.exporter.export(self.c, self.outname, on_done=on_done)
         else:
             self.c.SaveAs("%s/%s" %(odir, name))
 
@@ -193,8 +155,8 @@ class PredictionPlot():
 
     def rebin_hist(self, hist, rebin=None):
         """
-        Rebin a histogram either by combining rebin bins together, or by
-        asking for a specific binning (pass list as rebin arg)
+        Rebin a histogram (TH1 or np_hist.Hist) either by combining rebin
+        bins together, or by asking for a specific binning (pass list as rebin arg)
 
         NOTE: if you're using a ROOT version earlier than 5.34/22, you're
         gonna have abad time if you try setting the upper bin beyond the current
@@ -202,18 +164,7 @@ class PredictionPlot():
 
         I don't want anyone else to waste a day of their life doing this.
         """
-        if not rebin:
-            rebin = self.rebin
-        if hasattr(rebin, "__len__"):
-            return hist.Rebin(len(rebin)-1, hist.GetName(), rebin)
-        else:
-            if (hist.GetNbinsX() % rebin != 0):
-                log.warning("WARNING: rebin factor not exact divisor of number of bins - not rebinning")
-                log.warning("Original: %d, Tried rebin factor: %d" % (hist.GetNbinsX(), rebin))
-                rebin = 1
-            if rebin != 1:
-                return hist.Rebin(int(rebin))
-            return hist
+        return rebin_hist(hist, rebin if rebin else self.rebin)
 
 
     def style_hist(self, hist, region):
@@ -297,96 +248,35 @@ class PredictionPlot():
         hist.SetTitleOffset(hist.GetTitleOffset("Y") * 1.2, "Y")
 
 
-    def make_legend(self):
-        """
-        Generate blank legend
-        """
-        leg = r.TLegend(0.7, 0.49, 0.88, 0.72)
-        # leg.SetFillColorAlpha(r.kWhite, 0.5)
-        leg.SetFillColor(0)
-    	leg.SetFillStyle(0)
-        # leg.SetCornerRadius(0.5)
-        leg.SetLineColor(0)
-        leg.SetLineStyle(0)
-        leg.SetLineWidth(0)
-        # leg.SetLineColorAlpha(0, 0)
-        return leg
-
-
-    def make_standard_text(self):
-        """
-        Generate standard boring text
-        """
-        t = r.TPaveText(0.66, 0.73, 0.87, 0.87, "NDC")
-        t.AddText("CMS 2012, #sqrt{s} = 8 TeV")
-        t.AddText("")
-        t.AddText("#int L dt = 18.493 fb^{-1}")
-        t.SetFillColor(0)
-        t.SetFillStyle(0)
-        t.SetLineColor(0)
-        t.SetLineStyle(0)
-        t.SetLineWidth(0)
-        return t
-
-
     def make_bin_text(self, custom=None):
         """
         Generate label of which bin
         """
-        t = r.TPaveText(0.1, 0.91, 0.9, 0.95, "NDC NB")
         b_str = grabr.btag_string(self.btag) if grabr.btag_string(self.btag) else "geq 0 btag"
         if custom:
-            tt = t.AddText("%s, %s, HT bin %s, %s" % (self.njet, b_str, self.htstring, custom))
+            return "%s, %s, HT bin %s, %s" % (self.njet, b_str, self.htstring, custom)
         else:
-            tt = t.AddText("%s, %s, HT bin %s" % (self.njet, b_str, self.htstring))
-        tt.SetTextAlign(12)
-        t.SetFillColor(0)
-        t.SetFillStyle(0)
-        t.SetLineColor(0)
-        t.SetLineStyle(0)
-        t.SetLineWidth(0)
-        return t
+            return "%s, %s, HT bin %s" % (self.njet, b_str, self.htstring)
 
 
     def autorange_xaxis(self, h_1, h_2):
         """
         Return x axis range such that only filled bins are shown,
-        for both h_1 and h_2.
+        for both h_1 and h_2 (TH1s or np_hist.Hists).
         Plus a bit of padding on the left, and a lot more on the right
         """
-        # Look for low edge
-        low_1 = -1000000.
-        low_2 = -1000000.
-        found_low_1 = False
-        found_low_2 = False
-
-        for i in range(1, 1 + h_1.GetNbinsX()):
-            if not found_low_1 and h_1.GetBinContent(i) > 0.:
-                low_1 = h_1.GetBinLowEdge(i)
-                found_low_1 = True
-            if not found_low_2 and h_2.GetBinContent(i) > 0.:
-                low_2 = h_2.GetBinLowEdge(i)
-                found_low_2 = True
-
-        # Look for high edge
-        high_1 = 1000000.
-        high_2 = 1000000.
-        found_high_1 = False
-        found_high_2 = False
-
-        for i in range(1 + h_1.GetNbinsX(), 1, -1):
-            if not found_high_1 and h_1.GetBinContent(i) > 0.:
-                high_1 = h_1.GetBinLowEdge(i+1)
-                found_high_1 = True
-            if not found_high_2 and h_2.GetBinContent(i) > 0.:
-                high_2 = h_2.GetBinLowEdge(i+1)
-                found_high_2 = True
-
-        xmin = low_1 if low_1 < low_2 else low_2
-        xmax = high_1 if high_1 > high_2 else high_2
+        ranges = []
+        for h in [h_1, h_2]:
+            if not isinstance(h, Hist):
+                h = Hist.from_th1(h)
+            ranges.append(h.filled_range() or (-1000000., 1000000.))
+
+        xmin = min(rng[0] for rng in ranges)
+        xmax = max(rng[1] for rng in ranges)
         # xmin -= (2*h_1.GetBinWidth(1))  # add little bit of padding to LHS
         xmax += 0.4 * (xmax-xmin)  # add some space to RHS
-        log.debug("xmin: %g, xmax: %g"% (xmin, xmax))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("xmin: %g, xmax: %g"% (xmin, xmax))
         return xmin, xmax
 
 
@@ -394,39 +284,22 @@ class PredictionPlot():
         """
         Plot h on a separate canvas
         """
-        # get a canvas - reuse the old one if it's available
-        cc = r.gROOT.FindObject("cc")
-        if not cc:
-            cc = r.TCanvas("cc","")
-            # cc = r.gRoot.FindObject("cc")
+        # separate canvas, reused for all components
+        cc = self.context.get_component_canvas()
+        self.context.set_bin_text(self.make_bin_text(custom=self.title))
         cc.cd()
         cc.SetLogy(self.log)
         cc.SetTicks()
         cc.SetGrid()
-        hh = h.Clone()
+        hh = self.rebin_hist(h.copy() if isinstance(h, Hist) else h.Clone())
+        if isinstance(hh, Hist):
+            hh = hh.to_th1()
         self.title_axes(hh, self.var, "Events")
-        self.rebin_hist(hh).Draw("HISTE")
+        hh.Draw("HISTE")
         self.cuttxt.Draw("")
         # make folder for this var
         odir = "%s/%s" % (self.outdir, self.var)
-        check_dir_exists(odir)
-        ext = "" if ".pdf" in name else ".pdf"
-        cc.SaveAs("%s/%s%s" % (odir, name, ext))
-
-
-    def set_syst_errors(self, h, htbin, njet):
-        """
-        Turns stat errors into stat+syst errors using LUT at top
-        """
-        for i in range(1, h.GetNbinsX() + 1):
-            try:
-                syst =  h.GetBinContent(i) * tf_systs[njet][htbin] / 100.
-            except KeyError:
-                syst = 0
-            if self.fineJetMulti:
-                syst = 0
-            err = np.hypot(h.GetBinError(i), syst)
-            h.SetBinError(i, err)
+        self.exporter.export(cc, "%s/%s" % (odir, name.replace(".pdf", "")), formats=["pdf"])
 
 
     def make_hists(self):
@@ -435,177 +308,71 @@ class PredictionPlot():
         list of histograms that are BG estimates from doing
         data_control * transfer factor.
         Each hist in the list corresponds to one control region.
-        Basically for each of the control regions, it gets data in
-        control region, MC in signal & control regions (for all SM processes),
-        and data in signal region. Then calculate transfer factor
-        (MC_signal / MC_control), and scale data_control by that factor.
-        """
-
-        for ctrl in ctrl_regions:
-
-            if "Muon" in ctrl:
-                ctrl_start = "Muon"
-            elif "Photon" in ctrl:
-                ctrl_start = "Photon"
-
-            sig_start = "Had"
-            if "Muon" in signal_proc:
-                sig_start = "Muon"
-            elif "Photon" in signal_proc:
-                sig_start = "Photon"
-
-
-            # Cumulative for this region
-            hist_total = None
-            hist_stat_total = None
-            hist_syst_total = None
-
-            # Processes for MC in signal region
-            # Check that there are actually processes to run over for this ctrl region...
-            if "0" in self.btag or "1" in self.btag:
-                processes = processes_mc_signal_le1b
-            else:
-                processes = processes_mc_signal_ge2b
-
-            if ctrl in processes:
-                if not processes[ctrl]:
-                        continue
-
-                log.debug("**** DOING %s" % ctrl)
-
-                for ht in self.htbins:
-
-                    # Data in control region:
-                    log.debug("Data in control region")
-                    hist_data_control = grabr.grab_plots(f_path="%s/%s_Data.root" % (self.ROOTdir, ctrl_start),
-                                                         sele=ctrl, h_title=self.var, njet=self.njet, btag=self.btag, ht_bins=ht)
-                    hist_data_control.SetName(ctrl)  # for styling later
-                    hist_data_control = self.rebin_hist(hist_data_control)
-                    if self.plot_components:
-                        self.plot_component(hist_data_control, "data_control_%s_%s" % (ctrl, self.make_ht_string(ht)))
-                    log.debug("Data in control reigon: %g" % hist_data_control.Integral())
-
-                    # MC in signal region
-                    log.debug("MC in signal region:")
-                    hist_mc_signal = None
-                    for p in processes[ctrl]:
-                        MC_signal_tmp = grabr.grab_plots(f_path="%s/%s_%s.root" % (self.ROOTdir, sig_start, p),
-                                                         sele=signal_proc, h_title=self.var, njet=self.njet, btag=self.btag, ht_bins=ht)
-                        log.debug("%s %g" % (p, MC_signal_tmp.Integral()))
-                        if not hist_mc_signal:
-                            hist_mc_signal = self.rebin_hist(MC_signal_tmp)
-                        else:
-                            hist_mc_signal.Add(self.rebin_hist(MC_signal_tmp))
-
-                    log.debug("Total MC signal region: %g" % hist_mc_signal.Integral())
-                    if self.plot_components:
-                        self.plot_component(hist_mc_signal, "hist_mc_signal_%s_%s" % (ctrl, self.make_ht_string(ht)))
-
-                    # MC in control region
-                    log.debug("MC in control region:")
-                    hist_mc_control = None
-                    for p in processes_mc_ctrl:
-                        MC_ctrl_tmp = grabr.grab_plots(f_path="%s/%s_%s.root" % (self.ROOTdir, ctrl_start, p),
-                                                       sele=ctrl, h_title=self.var, njet=self.njet, btag=self.btag, ht_bins=ht)
-                        log.debug("%s %g" % (p, MC_ctrl_tmp.Integral()))
-                        if not hist_mc_control:
-                            hist_mc_control = self.rebin_hist(MC_ctrl_tmp)
-                        else:
-                            hist_mc_control.Add(self.rebin_hist(MC_ctrl_tmp))
-
-                    log.debug("Total MC control region: %g" % hist_mc_control.Integral())
-                    if self.plot_components:
-                        self.plot_component(hist_mc_control, "hist_mc_control_%s_%s" % (ctrl, self.make_ht_string(ht)))
-
-                    hist_mc_signal.Divide(hist_mc_control)
-                    if self.plot_components:
-                        self.plot_component(hist_mc_signal, "mc_ratio_%s_%s" % (ctrl, self.make_ht_string(ht)))
-
-                    hist_data_control.Multiply(hist_mc_signal)
-                    if self.plot_components:
-                        self.plot_component(hist_data_control, "scaled_data_%s_%s" % (ctrl, self.make_ht_string(ht)))
-                    # hist_data_control = self.rebin_hist(hist_data_control) # This segfaults soometimes
-
-                    # Calculate syst error on TF for this bin
-                    h_syst = hist_data_control.Clone()
-                    self.set_syst_errors(h_syst, ht, self.njet)
-                    if not hist_total:
-                        hist_total = hist_data_control
-                        hist_stat_total = hist_data_control.Clone()
-                        hist_syst_total = h_syst
-                    else:
-                        hist_total.Add(hist_data_control)
-                        hist_stat_total.Add(hist_data_control.Clone())
-                        hist_syst_total.Add(h_syst)
 
-                    log.debug("%s Estimate: %g %g" % (ctrl, hist_data_control.Integral(), hist_data_control.GetNbinsX()))
+        The actual maths is done by a PredictionEngine (on np_hist.Hists),
+        which may be shared with other plots for the same var/njet/btag -
+        see make_root_hists() for turning them into TH1s for drawing.
+        """
+        results = self.get_engine().results(self.htbins)
+        self.components, self.errors_stat, self.errors_stat_syst, self.data_signal = results
+        self.totals = [h.copy() for h in self.errors_stat]
+        if self.engine.n_toys:
+            self.use_toy_errors()
+        if log.isEnabledFor(logging.DEBUG):
+            for h in self.components:
+                log.debug("%s Estimate: %g" % (h.name, h.integral()))
+            log.debug("Data SR: %g" % self.data_signal.integral())
 
-                # Add the prediction to a list
-                self.component_hists.append(hist_total)
 
-                # Do stat+syst err hists for this control region & store (NB cumulative)
-                self.style_hist_err1(hist_stat_total)
-                self.style_hist_err2(hist_syst_total)
+    def use_toy_errors(self):
+        """
+        Replace the stat error bands with the central 68% of the engine's toys.
+        Since that needn't be symmetric, the band hists get centred on the middle
+        of the interval, with half its width as the error. Syst errors get added
+        on in quadrature as before.
+        """
+        bands = self.engine.toy_bands(self.htbins)
+        for h_stat, h_syst, (low, high) in zip(self.errors_stat, self.errors_stat_syst, bands):
+            var_syst_only = h_syst.variances - h_stat.variances
+            h_stat.values = 0.5 * (low + high)
+            h_stat.variances = (0.5 * (high - low)) ** 2
+            h_syst.values = h_stat.values.copy()
+            h_syst.variances = h_stat.variances + var_syst_only
 
-                if not self.error_hists_stat:
-                    self.error_hists_stat = [hist_stat_total]
-                    self.error_hists_stat_syst = [hist_syst_total]
-                else:
-                    hist_stat_total.Add(self.error_hists_stat[-1])
-                    self.error_hists_stat.append(hist_stat_total)
-                    hist_syst_total.Add(self.error_hists_stat_syst[-1])
-                    self.error_hists_stat_syst.append(hist_syst_total)
 
-        # Add in QCD in signal region if desired
-        if self.qcd:
-            log.debug("**** DOING QCD")
-            hist_qcd = None
-            hist_qcd_stat = None
-            hist_qcd_syst = None
-            for ht in self.htbins:
-                h_qcd_tmp = grabr.grab_plots(f_path="%s/%s_%s.root" % (self.ROOTdir, "Had", "QCD"),
-                                             sele=signal_proc, h_title=self.var, njet=self.njet, btag=self.btag, ht_bins=ht)
-                log.debug("QCD (%s): %g" % (ht, h_qcd_tmp.Integral()))
-                h_qcd_tmp.SetName("QCD")  # for styling later
-                h_qcd_tmp = self.rebin_hist(h_qcd_tmp)
-                if not hist_qcd:
-                    hist_qcd = h_qcd_tmp
-                else:
-                    hist_qcd.Add(h_qcd_tmp)
-                # stat & syst error bars for this ht bin (as syst ht-specific)
-                h_qcd_stat = h_qcd_tmp.Clone()
-                h_qcd_syst = h_qcd_tmp.Clone()
-                self.set_syst_errors(h_qcd_syst, ht, self.njet)
-                if not hist_qcd_stat:
-                    hist_qcd_stat = h_qcd_stat
-                    hist_qcd_syst = h_qcd_syst
-                else:
-                    hist_qcd_stat.Add(h_qcd_stat)
-                    hist_qcd_syst.Add(h_qcd_syst)
-
-            self.component_hists.append(hist_qcd)
-            log.debug("Total QCD: %g" % hist_qcd.Integral())
-
-            # stat & syst error bars for QCD overall
-            self.style_hist_err1(hist_qcd_stat)
-            self.style_hist_err2(hist_qcd_syst)
-            hist_qcd_stat.Add(self.error_hists_stat[-1])
-            self.error_hists_stat.append(hist_qcd_stat)
-            hist_qcd_syst.Add(self.error_hists_stat_syst[-1])
-            self.error_hists_stat_syst.append(hist_qcd_syst)
-            log.debug(hist_qcd_stat.Integral())
-
-        # Get data hist
-        sig_start = "Had"
-        if "Muon" in signal_proc:
-            sig_start = "Muon"
-        elif "Photon" in signal_proc:
-            sig_start = "Photon"
-        self.hist_data_signal = grabr.grab_plots(f_path="%s/%s_Data.root" % (self.ROOTdir, sig_start),
-                                            sele=signal_proc, h_title=self.var, njet=self.njet, btag=self.btag, ht_bins=self.htbins)
-
-        self.hist_data_signal = self.rebin_hist(self.hist_data_signal)
-        log.debug("Data SR: %g" % self.hist_data_signal.Integral())
+    def get_engine(self):
+        """
+        Get the PredictionEngine, making one just for this plot if we weren't given one
+        """
+        if not self.engine:
+            self.engine = PredictionEngine(self.ROOTdir, self.var, self.njet, self.btag,
+                                           self.htbins, self.rebin, self.qcd)
+        return self.engine
+
+
+    def make_component_plots(self):
+        """
+        Plot all the steps of the prediction (data_control, MC signal & control,
+        MC ratio, scaled data) for each control region & HT bin, from what the
+        engine kept when it did the prediction - no need to read the inputs again.
+        """
+        for (ctrl, ht), hists in self.get_engine().intermediate_hists(self.htbins):
+            for name, h in hists.iteritems():
+                self.plot_component(h, "%s_%s_%s" % (name, ctrl, self.make_ht_string(ht)))
+
+
+    def make_root_hists(self):
+        """
+        Turn the results of make_hists() into TH1s for drawing
+        """
+        self.hist_data_signal = self.data_signal.to_th1()
+        self.component_hists = [h.to_th1() for h in self.components]
+        self.error_hists_stat = [h.to_th1() for h in self.errors_stat]
+        self.error_hists_stat_syst = [h.to_th1() for h in self.errors_stat_syst]
+        for h in self.error_hists_stat:
+            self.style_hist_err1(h)
+        for h in self.error_hists_stat_syst:
+            self.style_hist_err2(h)
 
 
     def make_main_plot(self, pad):
@@ -614,6 +381,7 @@ class PredictionPlot():
         makes data VS background plot, where BG is from data control regions.
         Lots of ugly ROOT hacks in here (axis ranges, etc)
         """
+        self.make_root_hists()
         self.c.cd()
         pad.Draw()
         pad.cd()
@@ -641,13 +409,14 @@ class PredictionPlot():
                 self.shape_stack.Add(h)
 
         self.shape_stack.Add(next((h for h in self.component_hists if "QCD" in h.GetName()), None))
-        log.debug("BG estimate from data: %g" % self.shape_stack.GetStack().Last().Integral())
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("BG estimate from data: %g" % self.shape_stack.GetStack().Last().Integral())
 
         # add entries to the legend
         self.leg.AddEntry(self.hist_data_signal, "Data + stat. error", "pl")
         for h in reversed(self.component_hists):
             self.leg.AddEntry(h, ctrl_regions[h.GetName()], "f")
-        self.leg.AddEntry(self.error_hists_stat[-1], "Stat. error", "F")
+        self.leg.AddEntry(self.error_hists_stat[-1], "Stat. error (toys)" if self.engine.n_toys else "Stat. error", "F")
         if self.fineJetMulti:
             self.leg.AddEntry(self.error_hists_stat_syst[-1], "Stat. + syst. error NULL", "F")
         else:
@@ -663,7 +432,8 @@ class PredictionPlot():
         sum_stack = self.shape_stack.GetStack().Last()  # the "sum" of component hists
         max_stack = sum_stack.GetMaximum() + self.error_hists_stat_syst[-1].GetBinError(sum_stack.GetMaximumBin())
         max_data = self.hist_data_signal.GetMaximum() + self.hist_data_signal.GetBinError(self.hist_data_signal.GetMaximumBin())
-        log.debug("max_stack %g, max_data %g" % (max_stack, max_data))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("max_stack %g, max_data %g" % (max_stack, max_data))
 
         if max_stack < 0. or max_data < 0.:
             raise Exception("max_stack (%f) or max_data(%f) < 0!" % (max_stack, max_data))
@@ -728,33 +498,35 @@ class PredictionPlot():
 
     def make_ratio_plot(self, pad, h_data, h_mc, h_mc_stat=None, h_mc_stat_syst=None, fit=False):
         """
-        Makes the little data/MC ratio plot
+        Makes the little data/MC ratio plot, from np_hist.Hists
         h_mc is the total prediction
         h_mc_stat is the hist of the total stat error on the prediction
         h_mc_stat_syst is the hist of the total stat+syst error on the prediction
+        (error bands can be centred somewhere other than h_mc, e.g. for toys)
         fit is whether to fit a straight line to the ratio points.
         """
         pad.Draw()
         pad.cd()
         pad.SetTicks()
 
-        self.hist_ratio = h_data.Clone("ratio")
-        self.hist_ratio_stat = h_mc_stat.Clone("mcstat")
-        self.hist_ratio_stat_syst = h_mc_stat_syst.Clone("mcstatsyst")
-
         # Only want stat errs from data in SR on points
-        # Also construct MC error bars
-        h_mc_no_err = h_mc.Clone()
-        for i in range(1, 1+h_mc.GetNbinsX()):
-            h_mc_no_err.SetBinError(i, 0)
-            if self.hist_ratio_stat.GetBinContent(i) != 0.:
-                self.hist_ratio_stat.SetBinError(i, self.hist_ratio_stat.GetBinError(i)/self.hist_ratio_stat.GetBinContent(i))
-            self.hist_ratio_stat.SetBinContent(i, 1)
-            if self.hist_ratio_stat_syst.GetBinContent(i) != 0.:
-                self.hist_ratio_stat_syst.SetBinError(i, self.hist_ratio_stat_syst.GetBinError(i)/self.hist_ratio_stat_syst.GetBinContent(i))
-            self.hist_ratio_stat_syst.SetBinContent(i, 1)
-
-        self.hist_ratio.Divide(h_mc_no_err)
+        h_mc_no_err = Hist(h_mc.edges, h_mc.values, np.zeros_like(h_mc.variances))
+        ratio = h_data.copy().divide(h_mc_no_err)
+
+        # Also construct MC error bars - relative to the prediction, so around 1
+        bands = []
+        nonzero = h_mc.values != 0.
+        mc_safe = np.where(nonzero, h_mc.values, 1.)
+        for h in [h_mc_stat, h_mc_stat_syst]:
+            band = h.copy()
+            band.variances = np.where(nonzero, band.variances / mc_safe ** 2, band.variances)
+            band.values = np.where(nonzero, band.values / mc_safe, 1.)
+            bands.append(band)
+
+        self.hist_ratio = ratio.to_th1("ratio")
+        self.hist_ratio_stat = bands[0].to_th1("mcstat")
+        self.hist_ratio_stat_syst = bands[1].to_th1("mcstatsyst")
+
         self.style_hist_ratio(self.hist_ratio)
         self.style_hist_ratio(self.hist_ratio_stat)
         self.style_hist_err1(self.hist_ratio_stat)
@@ -777,9 +549,9 @@ class PredictionPlot():
         #
         # Actually this still mucks up sometimes
         xmax = r.gPad.GetUxmax()
-        self.l = r.TLine(xmin, 1, xmax, 1)
-        self.l.SetLineWidth(2)
-        self.l.SetLineStyle(2)
+        self.l = self.context.line
+        self.l.SetX1(xmin)
+        self.l.SetX2(xmax)
         self.l.Draw()
 
         # Do fit to ratio
@@ -0,0 +1,17 @@
+"""
+The HT, njet & btag bins of the analysis, shared by shape_plots.py,
+closure_tests.py etc. Kept on their own so scripts that only need the
+bins don't have to import all the plotting.
+"""
+
+###############################################
+# Define region bins - inclusive and exclusive
+###############################################
+allHTbins = ["200_275", "275_325", "325_375", "375_475", "475_575",
+          "575_675", "675_775", "775_875", "875_975", "975_1075", "1075"]# "200_upwards", "375_upwards"][:]
+
+n_j = ["le3j", "ge4j", "ge2j"][:]
+n_j_fine = ["eq2j", "eq3j", "eq4j", "ge5j"][:] # fine jet binning
+# n_b = ["eq0b", "eq1b", "eq2b", "eq3b", "ge0b", "ge1b", "ge2b", "ge3b", "ge4b"][:]
+# n_b = ["eq0b", "eq1b", "eq2b", "eq3b", "ge0b", "ge1b", "ge2b", "ge4b"][:]
+n_b = ["eq0b", "eq1b", "eq2b", "ge1b", "ge2b", "ge0b"][:]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the prediction & plotting, on fake inputs from
+make_fake_inputs.py (made the first time, or if the settings change),
+so they can be run anywhere, & catch it when something gets slower.
+
+python benchmark.py                  # all the benchmarks we can do here
+python benchmark.py -k fetch compute --repeat 10
+
+The benchmarks:
+- grab_plots: one grab_plots() (needs ROOT)
+- fetch: read all the inputs for one var/njet/btag (PredictionEngine.fetch_inputs)
+- compute: the whole prediction for one var/njet/btag, incl. reading the inputs
+- make_hists: PredictionPlot.make_hists() for one plot, prediction already done (needs ROOT)
+- plot: one plot, start to finish & saved (needs ROOT)
+- sweep: run_over() for all the fake vars/njet/btag - makes the plots if we
+  have ROOT, otherwise just the predictions (like --compute-only)
+
+Each one gets run --repeat times, starting cold each time (see
+clear_caches() - the OS will still have the files cached though), & the
+best & median times are appended to the history file (one JSON line per
+run, with the commit & host). They get compared to the last run on this
+host with the same settings, & anything more than --threshold slower is
+flagged as a regression (exit code 1).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+import plot_grabber as grabr
+import hist_store
+import plot_export
+import make_fake_inputs
+import shape_plots as plotr
+from prediction_engine import PredictionEngine
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+BENCH_VARS = ["AlphaT", "HT", "MHT"]  # for the fake inputs & sweep
+VAR, NJET, BTAG = "AlphaT", "le3j", "eq0b"  # for the single var/njet/btag & plot ones
+NEEDS_ROOT = ["grab_plots", "make_hists", "plot"]
+
+
+@contextmanager
+def quiet():
+    """
+    Hide all the printing, so it doesn't get timed & we can see the results
+    """
+    old = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = old
+
+
+def new_engine(inputs, htbins):
+    return PredictionEngine(inputs, VAR, NJET, BTAG, htbins, plotr.get_rebin(VAR))
+
+
+def setup_benchmarks(inputs, out_dir, htbins):
+    """
+    dict of name : function to time
+    """
+    def grab_plots():
+        grabr.grab_plots(os.path.join(inputs, "Muon_Data.root"), VAR, "OneMuon", NJET, BTAG, htbins)
+
+    def fetch():
+        new_engine(inputs, htbins).fetch_inputs()
+
+    def compute():
+        new_engine(inputs, htbins).compute()
+
+    engine = []  # done the first time make_hists is run
+
+    def make_hists():
+        if not engine:
+            engine.append(new_engine(inputs, htbins))
+            engine[0].compute()
+        plotr.setup_root()
+        plotr.PredictionPlot(inputs, out_dir, VAR, NJET, BTAG, htbins, plotr.get_rebin(VAR), True,
+                             plotr.title, False, engine[0]).make_hists()
+
+    def plot():
+        plotr.make_plot(inputs, out_dir, VAR, NJET, BTAG, htbins, plotr.get_rebin(VAR), True,
+                        plotr.title, False, new_engine(inputs, htbins), force=True)
+        plot_export.default_exporter().wait()
+
+    def sweep():
+        opts = dict(plot_vars=BENCH_VARS, njet=plotr.n_j, btag=plotr.n_b, htbins=htbins, force=True)
+        if grabr.need_root():
+            plotr.run_over(inputs, out_dir, **opts)
+            plot_export.default_exporter().wait()
+        else:
+            plotr.run_over(inputs, out_dir, compute_only=os.path.join(out_dir, "results.npz"), **opts)
+
+    return {"grab_plots": grab_plots, "fetch": fetch, "compute": compute,
+            "make_hists": make_hists, "plot": plot, "sweep": sweep}
+
+
+def clear_caches():
+    """
+    Forget the open files & stores (& their mmaps) from the last run, so
+    each repeat has to open them again like a fresh process would
+    """
+    grabr.file_pool.close_all()
+    hist_store._stores.clear()
+    grabr.key_manifest = None
+
+
+def time_it(fn, repeat):
+    """
+    (best, median) seconds from running fn repeat times
+    """
+    times = []
+    for i in xrange(repeat):
+        clear_caches()
+        start = time.time()
+        with quiet():
+            fn()
+        times.append(time.time() - start)
+    return min(times), float(np.median(times))
+
+
+def git_commit():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_run(history, settings):
+    """
+    Latest entry in the history file on this host with the same settings, or None
+    """
+    last = None
+    if not os.path.isfile(history):
+        return last
+    host = socket.gethostname()
+    settings = json.loads(json.dumps(settings))  # unicode etc., to compare like with like
+    with open(history) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry["host"] == host and entry["settings"] == settings:
+                last = entry
+    return last
+
+
+def compare(results, previous, threshold):
+    """
+    Print the results next to the previous ones. Returns list of names that got slower
+    """
+    slower = []
+    print "%-12s %10s %10s %10s %8s" % ("benchmark", "best s", "median s", "before s", "change")
+    for name in sorted(results):
+        best, median = results[name]["best"], results[name]["median"]
+        if previous and name in previous["results"]:
+            before = previous["results"][name]["best"]
+            change = (best - before) / before if before > 0 else 0.
+            flag = ""
+            if change > threshold:
+                flag = "  <-- REGRESSION"
+                slower.append(name)
+            print "%-12s %10.4f %10.4f %10.4f %+7.0f%%%s" % (name, best, median, before, 100. * change, flag)
+        else:
+            print "%-12s %10.4f %10.4f %10s %8s" % (name, best, median, "-", "")
+    return slower
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", "--only", help="just run these benchmarks", nargs="+")
+    parser.add_argument("--repeat", help="how many times to run each one", type=int, default=5)
+    parser.add_argument("--nbins", help="bins in each fake histogram", type=int, default=100)
+    parser.add_argument("--inputs", help="dir for the fake inputs",
+                        default=os.path.join(tempfile.gettempdir(), "shape_plots_bench_inputs"))
+    parser.add_argument("--history", help="file to add the results to", default="benchmarks.jsonl")
+    parser.add_argument("--threshold", help="flag anything this much slower than last time (fraction)",
+                        type=float, default=0.2)
+    args = parser.parse_args(in_args)
+
+    have_root = grabr.need_root() is not None
+    fmt = "root" if have_root else "store"
+    htbins = plotr.allHTbins
+    wanted = make_fake_inputs.fake_settings(BENCH_VARS, plotr.n_j, plotr.n_b, htbins, args.nbins, fmt)
+    if make_fake_inputs.load_settings(args.inputs) != json.loads(json.dumps(wanted)):
+        if os.path.isdir(args.inputs):
+            shutil.rmtree(args.inputs)
+        make_fake_inputs.make_fake_inputs(args.inputs, BENCH_VARS, plotr.n_j, plotr.n_b, htbins, args.nbins, fmt)
+
+    # plots use the global HT bins for inclusive HT
+    plotr.HTbins = htbins
+    out_dir = tempfile.mkdtemp(prefix="shape_plots_bench_")
+    benchmarks = setup_benchmarks(args.inputs, out_dir, htbins)
+    names = [n for n in ["grab_plots", "fetch", "compute", "make_hists", "plot", "sweep"]
+             if not args.only or n in args.only]
+    if not have_root:
+        skipped = [n for n in names if n in NEEDS_ROOT]
+        if skipped:
+            print "No ROOT, so skipping", ", ".join(skipped)
+        names = [n for n in names if n not in NEEDS_ROOT]
+
+    results = {}
+    try:
+        for name in names:
+            print "Running", name, "..."
+            best, median = time_it(benchmarks[name], args.repeat)
+            results[name] = {"best": best, "median": median}
+    finally:
+        shutil.rmtree(out_dir)
+
+    # "cold": older entries kept the caches warm between repeats, so aren't comparable
+    settings = {"nbins": args.nbins, "format": fmt, "repeat": args.repeat, "vars": BENCH_VARS, "cold": True}
+    slower = compare(results, last_run(args.history, settings), args.threshold)
+    with open(args.history, "a") as f:
+        f.write(json.dumps({"time": time.time(), "commit": git_commit(), "host": socket.gethostname(),
+                            "settings": settings, "results": results}) + "\n")
+    print "Added to", args.history
+    if slower:
+        print "Slower than last time:", ", ".join(slower)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Closure tests to derive the systematics on the transfer factors.
+
+For each test, we use the same machinery as the prediction: take data in a
+source control region, scale by MC_target / MC_source, and compare to data
+in the target control region. This is done for every njet & HT bin at once,
+using the event yields (integral of var, incl. under/overflow).
+
+For each njet bin & test we then fit a straight line to the closure
+(observed / predicted - 1) vs HT, weighted by the errors, and the syst in
+each HT bin is the biggest (over tests) of the fitted non-closure, with its
+fit error added in quadrature, rounded up to a whole %.
+
+The result gets written out as a new systematics config (see systematics.py),
+replacing the tf_closure source & keeping all the others.
+
+Usage:
+
+python closure_tests.py <ROOTdir> [--out systematics_new.json] [--btag eq0b] ...
+
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+import numpy as np
+import plot_grabber as grabr
+from prediction_engine import file_start, processes_mc_ctrl
+from analysis_bins import allHTbins, n_j, n_j_fine
+import systematics
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# (source region, target region): predict target from source
+closure_tests = [("OneMuon", "DiMuon"), ("DiMuon", "OneMuon")]
+
+
+def get_yields(ROOTdir, regions, njets, btag, htbins, var="HT"):
+    """
+    Get event yields in data & MC (summed over processes_mc_ctrl) for each
+    region/njet/HT bin. Grabs everything from each file in one go.
+    Returns data, mc arrays [2 (sumw, sumw2), region, njet, HT bin]
+    """
+    data = np.zeros((2, len(regions), len(njets), len(htbins)))
+    mc = np.zeros_like(data)
+    by_file = {}  # file : list of (array, index, request)
+    for i, region in enumerate(regions):
+        f_data = "%s/%s_Data.root" % (ROOTdir, file_start(region))
+        f_mc = ["%s/%s_%s.root" % (ROOTdir, file_start(region), p) for p in processes_mc_ctrl]
+        for j, njet in enumerate(njets):
+            for k, ht in enumerate(htbins):
+                req = (region, var, njet, btag, ht)
+                by_file.setdefault(f_data, []).append((data, (i, j, k), req))
+                for f_path in f_mc:
+                    by_file.setdefault(f_path, []).append((mc, (i, j, k), req))
+
+    for f_path, items in sorted(by_file.iteritems()):
+        log.debug("Getting %d hists from %s" % (len(items), f_path))
+        hists = grabr.grab_hists(f_path, [req for _, _, req in items])
+        for arr, index, req in items:
+            h = hists[grabr.request_key(*req)]
+            arr[(0,) + index] += h.values.sum()
+            arr[(1,) + index] += h.variances.sum()
+    return data, mc
+
+
+def closure(data, mc, source, target):
+    """
+    Predict target from source in each njet/HT bin. Inputs from get_yields(),
+    source & target are region indices. Returns (closure, error) arrays
+    [njet, HT bin], where closure = observed / predicted - 1
+    """
+    d_s, d_t, mc_s, mc_t = data[:, source], data[:, target], mc[:, source], mc[:, target]
+    ok = (d_s[0] > 0) & (mc_s[0] > 0) & (mc_t[0] > 0)
+    safe = lambda a: np.where(ok, a, 1.)
+    pred = np.where(ok, d_s[0] * mc_t[0] / safe(mc_s[0]), 0.)
+    ratio = np.where(ok & (pred > 0), d_t[0] / safe(pred), 1.)
+    # relative errors on all 4 inputs in quadrature
+    rel2 = sum(np.where(ok, h[1] / safe(h[0]) ** 2, 0.) for h in [d_s, mc_s, mc_t])
+    rel2 = rel2 + np.where(d_t[0] > 0, d_t[1] / np.where(d_t[0] > 0, d_t[0], 1.) ** 2, 1.)
+    err = np.where(ok, ratio * np.sqrt(rel2), np.inf)  # no info -> no weight in fit
+    return ratio - 1., err
+
+
+def fit_lines(x, y, err):
+    """
+    Weighted straight line fits y = a + b*x, for many sets of points at once.
+    x is [point], y & err are [..., point]. Returns the fitted values and
+    their errors at each x, both [..., point] - NaN for any set without
+    enough usable points to fit a line.
+    """
+    w = np.where(np.isfinite(err) & (err > 0), 1. / np.where(err > 0, err, 1.) ** 2, 0.)
+    s0, s1, s2 = w.sum(axis=-1), (w * x).sum(axis=-1), (w * x * x).sum(axis=-1)
+    t0, t1 = (w * y).sum(axis=-1), (w * x * y).sum(axis=-1)
+    det = s0 * s2 - s1 * s1
+    good = det > 0
+    det_safe = np.where(good, det, 1.)
+    a = np.where(good, (s2 * t0 - s1 * t1) / det_safe, np.nan)
+    b = np.where(good, (s0 * t1 - s1 * t0) / det_safe, np.nan)
+    # covariance of a, b is [[s2, -s1], [-s1, s0]] / det
+    var_fit = np.where(good[..., np.newaxis],
+                       (s2[..., np.newaxis] - 2 * s1[..., np.newaxis] * x + s0[..., np.newaxis] * x * x) / det_safe[..., np.newaxis],
+                       np.nan)
+    return a[..., np.newaxis] + b[..., np.newaxis] * x, np.sqrt(var_fit)
+
+
+def derive_systs(ROOTdir, njets, btag="eq0b", htbins=allHTbins, var="HT", tests=closure_tests):
+    """
+    Run all the closure tests for all njet & HT bins, fit them, and return
+    (systs, details) where systs is njet : {HT bin : syst in %}
+    """
+    regions = sorted(set(r for test in tests for r in test))
+    data, mc = get_yields(ROOTdir, regions, njets, btag, htbins, var)
+    results = np.array([closure(data, mc, regions.index(s), regions.index(t)) for s, t in tests])  # [test, 2, njet, HT]
+    x = np.array([float(ht.split("_")[0]) for ht in htbins])
+    fit, fit_err = fit_lines(x, results[:, 0], results[:, 1])  # [test, njet, HT]
+    fitted = np.isfinite(fit[..., 0])  # [test, njet]
+    for i, j in zip(*np.where(~fitted)):
+        log.warning("Not enough points to fit %s -> %s closure for %s, ignoring it" % (tests[i] + (njets[j],)))
+    no_fit = [njet for j, njet in enumerate(njets) if not fitted[:, j].any()]
+    if no_fit:
+        raise RuntimeError("No closure test could be fitted for %s - not writing a 0%% syst for them. "
+                           "Leave them out with -j, or check the inputs" % ", ".join(no_fit))
+    non_closure = np.sqrt(fit ** 2 + fit_err ** 2)
+    systs_pct = np.ceil(100. * np.where(fitted[..., np.newaxis], non_closure, 0.).max(axis=0))  # [njet, HT]
+    systs = dict((njet, dict((ht, int(systs_pct[j, k])) for k, ht in enumerate(htbins)))
+                 for j, njet in enumerate(njets))
+    details = {"tests": tests, "closure": results[:, 0].tolist(), "closure_err": np.where(np.isfinite(results[:, 1]), results[:, 1], -1).tolist(),
+               "fit": np.where(fitted[..., np.newaxis], fit, 0.).tolist(),
+               "fit_err": np.where(fitted[..., np.newaxis], fit_err, -1).tolist()}
+    return systs, details
+
+
+def write_config(systs, out_path, ROOTdir, fine_jet=False, base_config=None):
+    """
+    Write a systematics config, with tf_closure replaced by systs, and
+    everything else from base_config (default: the current one)
+    """
+    with open(base_config or systematics.DEFAULT_CONFIG) as f:
+        config = json.load(f)
+    source = config["sources"].get("tf_closure", {})
+    source.update({"description": "Systematics on TF from closure tests (as a %%). Fn on njets & HT. "
+                                  "Made by closure_tests.py from %s on %s" % (ROOTdir, time.strftime("%d %b %Y")),
+                   "values": systs,
+                   "fine_jet": fine_jet})
+    config["sources"]["tf_closure"] = source
+    with open(out_path, "w") as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+    print "Written systematics to", out_path
+
+
+def print_table(systs, njets, htbins):
+    print "%-6s" % "", " ".join("%8s" % ht for ht in htbins)
+    for njet in njets:
+        print "%-6s" % njet, " ".join("%8d" % systs[njet][ht] for ht in htbins)
+
+
+def main(in_args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ROOTdir", help="directory of input ROOT files")
+    parser.add_argument("--out", help="output systematics config", default="systematics_new.json")
+    parser.add_argument("--base", help="config to take the other systematics from", default=systematics.DEFAULT_CONFIG)
+    parser.add_argument("-j", "--njet", help="njet bins (default: all for this ROOTdir)", nargs="+")
+    parser.add_argument("-b", "--btag", help="btag bin to do the tests in", default="eq0b")
+    parser.add_argument("--var", help="var to get the yields from (any will do)", default="HT")
+    parser.add_argument("--details", help="also write closure values & fits to this JSON file")
+    args = parser.parse_args(in_args)
+
+    fine_jet = "fineJetMulti" in args.ROOTdir
+    njets = args.njet or (n_j_fine if fine_jet else n_j)
+    systs, details = derive_systs(args.ROOTdir, njets, args.btag, allHTbins, args.var)
+    print_table(systs, njets, allHTbins)
+    write_config(systs, args.out, os.path.abspath(args.ROOTdir), fine_jet, args.base)
+    if args.details:
+        with open(args.details, "w") as f:
+            json.dump(details, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Split a shape_plots sweep into N roughly equal shards for HTCondor,
+rather than one job per variable (which leaves you waiting for AlphaT
+long after MHT is done).
+
+Each var/njet/btag is a task. Its cost is estimated from:
+- how long it took last time, if shape_plots was run with --timings DIR
+  (one JSON line per task, with time, memory & number of input keys -
+  see shape_plots.record_timing()), or
+- otherwise the number of input histogram keys it needs, times the
+  average time per key from the recorded timings.
+
+Tasks then get shared out, biggest first, to whichever shard has the least
+work so far. Each shard asks for enough memory for its hungriest task.
+
+python condor_planner.py plan -n 10 --timings out/timings --qcd
+    -> writes shards.json & shape_plots_shards.condor, condor_submit that
+
+python condor_planner.py local --shards shards.json -p 4 --qcd
+    -> runs the shards here instead, exactly as condor would, to test it
+
+Any options after the planner ones get passed to shape_plots.py.
+"""
+
+import os
+import sys
+import glob
+import json
+import math
+import time
+import heapq
+import logging
+import argparse
+import subprocess
+from itertools import product
+import shape_plots as plotr
+import plot_grabber as grabr
+from prediction_engine import input_requests, count_keys
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEFAULT_SECONDS_PER_KEY = 0.02  # if we don't have any timings to go on
+DEFAULT_MEMORY_MB = 500
+MIN_MEMORY_MB = 200
+MEMORY_MARGIN = 1.25  # ask for this much more memory than the biggest we've seen
+
+
+def task_name(task):
+    return "|".join(task)
+
+
+def load_timings(timings_dir):
+    """
+    Latest recorded timing for each task, as dict of task name : entry
+    """
+    timings = {}
+    if not timings_dir:
+        return timings
+    for f_path in sorted(glob.glob(os.path.join(timings_dir, "*.jsonl")), key=os.path.getmtime):
+        with open(f_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # half written
+                    continue
+                timings[task_name(entry["task"])] = entry
+    return timings
+
+
+def estimate_costs(tasks, n_keys, timings):
+    """
+    Estimated (seconds, memory MB) for each task
+    """
+    timed = [t for t in timings.itervalues() if t["keys"] > 0]
+    if timed:
+        per_key = sum(t["seconds"] for t in timed) / sum(t["keys"] for t in timed)
+        default_mb = max(t["rss_mb"] for t in timed)
+    else:
+        per_key, default_mb = DEFAULT_SECONDS_PER_KEY, DEFAULT_MEMORY_MB
+    costs = []
+    for task in tasks:
+        t = timings.get(task_name(task))
+        if t:
+            costs.append((t["seconds"], t["rss_mb"]))
+        else:
+            costs.append((n_keys[task] * per_key, default_mb))
+    return costs
+
+
+def make_shards(tasks, costs, n_shards):
+    """
+    Split tasks into n_shards with roughly equal total cost: biggest first,
+    each to the shard with the least so far. Returns list of
+    (tasks, estimated seconds, memory MB) per shard, dropping empty ones.
+    """
+    shards = [(0., i) for i in xrange(n_shards)]
+    contents = [[] for i in xrange(n_shards)]
+    memory = [0.] * n_shards
+    for cost, task in sorted(zip(costs, tasks), key=lambda x: -x[0][0]):
+        total, i = heapq.heappop(shards)
+        contents[i].append(task)
+        memory[i] = max(memory[i], cost[1])
+        heapq.heappush(shards, (total + cost[0], i))
+    totals = dict((i, total) for total, i in shards)
+    return [(contents[i], totals[i], max(MIN_MEMORY_MB, int(math.ceil(memory[i] * MEMORY_MARGIN / 100.) * 100)))
+            for i in xrange(n_shards) if contents[i]]
+
+
+def plan(root_dir, n_shards, plot_vars, njets, btags, htbins, qcd=False, timings_dir=None):
+    """
+    Make the shards for all the var/njet/btag combinations
+    """
+    tasks = list(product(plot_vars, njets, btags))
+    n_keys = dict((t, count_keys(input_requests(root_dir, t[0], t[1], t[2], htbins, qcd))) for t in tasks)
+    timings = load_timings(timings_dir)
+    shards = make_shards(tasks, estimate_costs(tasks, n_keys, timings), n_shards)
+    n_timed = len([t for t in tasks if task_name(t) in timings])
+    print "%d tasks (%d with timings) in %d shards" % (len(tasks), n_timed, len(shards))
+    for i, (contents, seconds, mb) in enumerate(shards):
+        print "Shard %d: %d tasks, ~%.0f s, %d MB" % (i, len(contents), seconds, mb)
+    return shards
+
+
+def write_shards(shards, f_path):
+    with open(f_path, "w") as f:
+        json.dump({"shards": [{"tasks": [list(t) for t in contents], "seconds": seconds, "memory_mb": mb}
+                              for contents, seconds, mb in shards]}, f, indent=1)
+
+
+def load_shard(f_path, index):
+    """
+    List of (var, njet, btag) for one shard
+    """
+    with open(f_path) as f:
+        return [tuple(str(x) for x in t) for t in json.load(f)["shards"][index]["tasks"]]
+
+
+submit_template = """# Made by condor_planner.py - one job per shard, see %(shards_file)s
+#
+# It calls a shell script, which sets up ROOT on the worker
+# node. That then calls shape_plots_condor.py, which runs the plotter
+# over all the var/njet/btag in its shard.
+
+Executable = shape_plots_condor.sh
+Universe = vanilla
+Output = plots.$(cluster).$(shard).out
+Error = plots.$(cluster).$(shard).err
+Log = plots.$(cluster).$(shard).log
+should_transfer_files = YES
+when_to_transfer_output = ON_EXIT_OR_EVICT
+
+request_cpus = 1
+request_memory = $(memory)
+
+# use the ENV that is provided
+getenv = true
+
+input_root_files = %(input_root_files)s
+output_dir = %(output_dir)s
+
+transfer_input_files = %(input_files)s
+transfer_output_files = $(output_dir)
+
+arguments = --shards %(shards_name)s $(shard) $(input_root_files) $(output_dir) %(other)s
+
+queue shard, memory from (
+%(queue)s
+)
+"""
+
+
+def write_submit(shards, f_path, shards_file, input_root_files, output_dir, other_args):
+    """
+    Write the condor submit file, with memory requests per shard
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    input_files = [input_root_files, shards_file] + sorted(glob.glob(os.path.join(here, "*.py"))) + \
+                  [os.path.join(here, "systematics.json")]
+    with open(f_path, "w") as f:
+        f.write(submit_template % {"shards_file": shards_file, "shards_name": os.path.basename(shards_file),
+                                   "input_root_files": os.path.basename(os.path.normpath(input_root_files)),
+                                   "output_dir": output_dir,
+                                   "input_files": ",".join(input_files),
+                                   "other": " ".join(other_args),
+                                   "queue": "\n".join("%d %d" % (i, mb) for i, (_, _, mb) in enumerate(shards))})
+    print "Written", f_path
+
+
+def run_local(shards_file, input_root_files, output_dir, other_args, n_parallel=1, log_dir="."):
+    """
+    Run all the shards here, the same way condor would (minus setting up
+    the environment), n_parallel at once. Returns list of shards that failed.
+    """
+    with open(shards_file) as f:
+        n_shards = len(json.load(f)["shards"])
+    here = os.path.dirname(os.path.abspath(__file__))
+    pending = range(n_shards)
+    running = {}  # shard : (process, log file)
+    failed = []
+    while pending or running:
+        while pending and len(running) < n_parallel:
+            i = pending.pop(0)
+            out = open(os.path.join(log_dir, "plots.local.%d.out" % i), "w")
+            cmd = [sys.executable, os.path.join(here, "shape_plots_condor.py"), "--shards", shards_file,
+                   str(i), input_root_files, output_dir] + other_args
+            running[i] = (subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT), out)
+            print "Started shard", i
+        finished = [i for i, (proc, out) in running.iteritems() if proc.poll() is not None]
+        if not finished:
+            time.sleep(0.2)
+        for i in finished:
+            proc, out = running.pop(i)
+            out.close()
+            if proc.returncode == 0:
+                print "Shard %d OK" % i
+            else:
+                print "Shard %d FAILED (exit code %d), see %s" % (i, proc.returncode, out.name)
+                failed.append(i)
+    return failed
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["plan", "local"], help="make the shards & submit file, or run the shards here")
+    parser.add_argument("-n", "--n_shards", help="number of shards", type=int, default=10)
+    parser.add_argument("--input", help="dir of input ROOT files", default=plotr.ROOTdir)
+    parser.add_argument("--output", help="output dir", default=plotr.out_dir)
+    parser.add_argument("--timings", help="dir of timings from previous runs (shape_plots.py --timings)")
+    parser.add_argument("--shards", help="shards file", default="shards.json")
+    parser.add_argument("--submit", help="condor submit file to write", default="shape_plots_shards.condor")
+    parser.add_argument("-v", "--var", help="variables (default: all)", nargs="+")
+    parser.add_argument("-j", "--njet", help="njet bins (default: all)", nargs="+")
+    parser.add_argument("-b", "--btag", help="btag bins (default: all)", nargs="+")
+    parser.add_argument("-p", "--parallel", help="for local: how many shards to run at once", type=int, default=1)
+    args, other = parser.parse_known_args(in_args)
+
+    if args.mode == "local":
+        failed = run_local(args.shards, args.input, args.output, other, args.parallel)
+        if failed:
+            raise RuntimeError("Shards %s failed" % failed)
+        return
+
+    njets = args.njet or (plotr.n_j_fine if "fineJetMulti" in args.input else plotr.n_j)
+    shards = plan(args.input, args.n_shards, args.var or plotr.plot_vars, njets, args.btag or plotr.n_b,
+                  plotr.HTbins, qcd="--qcd" in other, timings_dir=args.timings)
+    write_shards(shards, args.shards)
+    write_submit(shards, args.submit, args.shards, args.input, args.output, other)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Little file helpers shared by the plotting, caches & manifests.
+
+write_atomic() writes to a temp file (unique to this process & thread) in
+the same dir, then renames it into place, so no-one ever reads half a file,
+& several processes writing the same file at once (e.g. condor_planner.py
+local -p N) just means the last one wins:
+
+    write_atomic("out/plot.deps", lambda f: json.dump(deps, f))
+"""
+
+import os
+import errno
+import tempfile
+
+
+def check_dir_exists(d):
+    """
+    Make dir d (& any parents) if it doesn't exist. Fine if someone else makes it first.
+    """
+    try:
+        os.makedirs(d)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_atomic(path, write_fn, mode="w"):
+    """
+    Call write_fn(f) on a temp file next to path, then rename it to path.
+    mode is "w" or "wb". Makes the dir if needed.
+    """
+    dir_name = os.path.dirname(os.path.abspath(path))
+    check_dir_exists(dir_name)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_fn(f)
+        os.chmod(tmp_path, 0644)  # mkstemp makes it just for us
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,166 @@
+"""
+On-disk cache of scaled histograms, shared between runs and worker processes.
+
+plot_grabber scales every MC histogram it reads by trigger efficiency,
+sideband correction & lumi. That gives the same answer every time for the
+same (file, directory, histogram, selection, njet), so we store the result
+here as NumPy arrays (bin edges, sumw, sumw2) and skip the input file
+entirely next time.
+
+Entries are keyed by:
+- a hash of the input file *contents* (memoised by path/mtime/size, so we
+  only hash each file once),
+- the key path inside the file, selection & njet,
+- the scale factor itself, as that also depends on the file's name & dir
+  (process, Data, SMS, fineJetMulti) - so a copy of a file under another
+  name doesn't get the original's scaling,
+- plot_grabber.SCALE_VERSION, so changing the scale factor tables
+  invalidates everything.
+
+The cache is bounded to max_bytes - least recently used entries get
+deleted first. Entries are written to a temp file & renamed into place,
+and anything that modifies shared state (eviction, the file hash list)
+holds an exclusive lock on the cache dir, so several workers can use
+the same cache on a shared filesystem.
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import numpy as np
+from contextlib import contextmanager
+from file_utils import check_dir_exists, write_atomic
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+HASH_DB_NAME = "file_hashes.json"
+LOCK_NAME = ".lock"
+
+
+def hash_file(f_path, chunk_size=1 << 24):
+    """
+    SHA1 of a file's contents
+    """
+    sha = hashlib.sha1()
+    with open(f_path, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = f.read(chunk_size)
+    return sha.hexdigest()
+
+
+class HistCache():
+    """
+    Persistent, size-bounded cache of (edges, sumw, sumw2) arrays.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3, version=0):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.version = version  # plot_grabber.SCALE_VERSION
+        self.file_hashes = {}  # in-memory copy of the hash db
+        self.puts_since_evict = 0
+        check_dir_exists(self.cache_dir)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold an exclusive lock on the cache dir - works across processes
+        """
+        with open(os.path.join(self.cache_dir, LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def file_hash(self, f_path):
+        """
+        Content hash of f_path. Only actually hash it if it's new or has
+        changed since we (or another process) last did.
+        """
+        st = os.stat(f_path)
+        stamp = [os.path.abspath(f_path), st.st_mtime, st.st_size]
+        id_ = "%s:%r:%d" % tuple(stamp)
+        if id_ in self.file_hashes:
+            return self.file_hashes[id_]
+
+        db_path = os.path.join(self.cache_dir, HASH_DB_NAME)
+        with self.locked():
+            if os.path.isfile(db_path):
+                with open(db_path) as f:
+                    self.file_hashes = json.load(f)
+            if id_ not in self.file_hashes:
+                log.info("Hashing %s" % f_path)
+                self.file_hashes[id_] = hash_file(f_path)
+                write_atomic(db_path, lambda f: json.dump(self.file_hashes, f))
+        return self.file_hashes[id_]
+
+    def entry_path(self, f_path, key, sele, njet, scale):
+        """
+        Where the entry for this histogram lives (scaled by scale)
+        """
+        name = "|".join([self.file_hash(f_path), key, sele, njet, repr(float(scale)), str(self.version)])
+        digest = hashlib.sha1(name).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".npz")
+
+    def get(self, f_path, key, sele, njet, scale):
+        """
+        Get cached (edges, sumw, sumw2) for a hist scaled by scale, or None if we don't have it
+        """
+        path = self.entry_path(f_path, key, sele, njet, scale)
+        try:
+            with open(path, "rb") as f:
+                arrs = np.load(f)
+                entry = (arrs["edges"], arrs["sumw"], arrs["sumw2"])
+            os.utime(path, None)  # mark as recently used
+        except (IOError, OSError, KeyError, ValueError):
+            return None  # not there, or evicted under our feet
+        return entry
+
+    def put(self, f_path, key, sele, njet, scale, edges, sumw, sumw2):
+        """
+        Store a hist scaled by scale
+        """
+        path = self.entry_path(f_path, key, sele, njet, scale)
+        write_atomic(path, lambda f: np.savez(f, edges=edges, sumw=sumw, sumw2=sumw2), "wb")
+        self.puts_since_evict += 1
+        if self.puts_since_evict >= 100:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until we're under max_bytes
+        """
+        self.puts_since_evict = 0
+        with self.locked():
+            entries = []
+            total = 0
+            for dir_path, _, f_names in os.walk(self.cache_dir):
+                for f_name in f_names:
+                    if not f_name.endswith(".npz"):
+                        continue
+                    path = os.path.join(dir_path, f_name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= 0.9 * self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            log.debug("Evicted cache down to %d bytes" % total)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Columnar NumPy store for the histograms in our input ROOT files.
+
+convert() walks one <Region>_<Proc>.root file once and packs every 1D
+histogram in it into three flat arrays - bin edges, sumw and sumw2
+(both including under/overflow) - plus a JSON index of key -> offsets.
+These all go in a <Region>_<Proc>.npstore/ directory next to the ROOT file.
+
+Reading a store back only needs numpy: the arrays are memory-mapped,
+and get() hands back slices of them, so nothing gets copied or read
+from disk until you actually use it.
+
+plot_grabber will automatically use a store instead of the ROOT file if
+there is one, and it's newer than the ROOT file.
+
+Usage:
+
+python hist_store.py <ROOT file or dir of ROOT files> [<more>...]
+
+"""
+
+import os
+import sys
+import json
+import shutil
+import logging
+import numpy as np
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+STORE_EXT = ".npstore"
+INDEX_NAME = "index.json"
+ARRAY_NAMES = ["edges", "sumw", "sumw2"]
+
+# stores we've already opened, f_path : HistStore
+_stores = {}
+
+
+def store_path(f_path):
+    """
+    Get the store directory for a ROOT file, e.g. Had_DY.root -> Had_DY.npstore
+    """
+    return os.path.splitext(f_path)[0] + STORE_EXT
+
+
+def file_stamp(f_path):
+    """
+    What we use to tell whether the ROOT file has changed since conversion
+    """
+    st = os.stat(f_path)
+    return {"mtime": st.st_mtime, "size": st.st_size}
+
+
+def input_stamp(f_path):
+    """
+    Like file_stamp, but if there's only a store for f_path (no ROOT file,
+    e.g. from make_fake_inputs.py), the stamp of the store
+    """
+    if os.path.isfile(f_path):
+        return file_stamp(f_path)
+    return file_stamp(os.path.join(store_path(f_path), INDEX_NAME))
+
+
+class HistStore():
+    """
+    Read-only view of a converted ROOT file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self.source = self.index["source"]
+        self.keys = self.index["keys"]  # key : [edge offset, bin offset, nbins, has sumw2]
+        self.arrays = {}
+        for name in ARRAY_NAMES:
+            self.arrays[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def is_stale(self, f_path=None):
+        """
+        Whether the ROOT file has changed since we made this store
+        """
+        f_path = f_path or self.source
+        if not os.path.isfile(f_path):
+            return False  # only have the store, so it's all we've got
+        return file_stamp(f_path) != self.index["stamp"]
+
+    def get(self, key):
+        """
+        Get (edges, sumw, sumw2) for histogram key (e.g. "btag_zero_OneMuon_200_275/AlphaT_2").
+        These are read-only slices of the store arrays - copy them if you want to modify them.
+        sumw/sumw2 include the underflow & overflow bins, like ROOT.
+        """
+        if key not in self.keys:
+            raise KeyError("No histogram %s in %s" % (key, self.path))
+        e_off, b_off, nbins, _ = self.keys[key]
+        edges = self.arrays["edges"][e_off:e_off + nbins + 1]
+        sumw = self.arrays["sumw"][b_off:b_off + nbins + 2]
+        sumw2 = self.arrays["sumw2"][b_off:b_off + nbins + 2]
+        return edges, sumw, sumw2
+
+
+def open_store(f_path):
+    """
+    Get the HistStore for ROOT file f_path, or None if there isn't an up-to-date one.
+    """
+    if f_path in _stores:
+        return _stores[f_path]
+    path = store_path(f_path)
+    store = None
+    if os.path.isfile(os.path.join(path, INDEX_NAME)):
+        store = HistStore(path)
+        if store.is_stale(f_path):
+            log.warning("%s is older than %s - ignoring it, please re-run hist_store.py" % (path, f_path))
+            store = None
+    _stores[f_path] = store
+    return store
+
+
+def walk_hists(tdir, prefix=""):
+    """
+    Yield (key, TH1) for every 1D histogram in tdir & its subdirectories
+    """
+    import ROOT as r
+    for key in tdir.GetListOfKeys():
+        name = prefix + key.GetName()
+        cl = r.TClass.GetClass(key.GetClassName())
+        if not cl:
+            continue
+        if cl.InheritsFrom("TDirectory"):
+            for item in walk_hists(key.ReadObj(), name + "/"):
+                yield item
+        elif cl.InheritsFrom("TH1"):
+            h = key.ReadObj()
+            if h.GetDimension() == 1:
+                yield name, h
+
+
+def convert(f_path, out_path=None):
+    """
+    Pack all the 1D histograms in ROOT file f_path into a store.
+    Needs ROOT, unlike everything else here.
+    """
+    import ROOT as r
+    out_path = out_path or store_path(f_path)
+    f = r.TFile.Open(f_path)
+    if not f or f.IsZombie():
+        raise Exception("Cannot open file", f_path)
+
+    keys = {}
+    edges, sumw, sumw2 = [], [], []
+    n_edges, n_bins = 0, 0
+    for key, h in walk_hists(f):
+        nbins = h.GetNbinsX()
+        ax = h.GetXaxis()
+        has_sumw2 = h.GetSumw2N() > 0
+        edges.extend(ax.GetBinLowEdge(i) for i in xrange(1, nbins + 2))
+        w = [h.GetBinContent(i) for i in xrange(nbins + 2)]
+        sumw.extend(w)
+        sumw2.extend([h.GetBinError(i) ** 2 for i in xrange(nbins + 2)] if has_sumw2 else w)
+        keys[key] = [n_edges, n_bins, nbins, has_sumw2]
+        n_edges += nbins + 1
+        n_bins += nbins + 2
+    f.Close()
+
+    write_store(out_path, f_path, file_stamp(f_path), keys, edges, sumw, sumw2)
+    log.info("Converted %s: %d hists -> %s" % (f_path, len(keys), out_path))
+    return out_path
+
+
+def write_store(out_path, f_path, stamp, keys, edges, sumw, sumw2):
+    """
+    Write a store for ROOT file f_path (with stamp from file_stamp(), or None
+    if there's no ROOT file). keys is key : [edge offset, bin offset, nbins, has sumw2]
+    into the flat edges, sumw & sumw2.
+    """
+    # write to a temp dir & move into place, so no-one ever sees half a store
+    tmp_path = out_path + ".tmp%d" % os.getpid()
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, arr in zip(ARRAY_NAMES, [edges, sumw, sumw2]):
+        np.save(os.path.join(tmp_path, name + ".npy"), np.array(arr, dtype=np.float64))
+    with open(os.path.join(tmp_path, INDEX_NAME), "w") as f_index:
+        json.dump({"source": os.path.abspath(f_path), "stamp": stamp, "keys": keys}, f_index)
+    if os.path.isdir(out_path):
+        shutil.rmtree(out_path)
+    os.rename(tmp_path, out_path)
+    _stores.pop(f_path, None)
+
+
+def convert_all(paths):
+    """
+    Convert ROOT files, or all ROOT files in directories
+    """
+    for p in paths:
+        if os.path.isdir(p):
+            for f_name in sorted(os.listdir(p)):
+                if f_name.endswith(".root"):
+                    convert(os.path.join(p, f_name))
+        else:
+            convert(p)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "Usage: python hist_store.py <ROOT file or dir of ROOT files> [<more>...]"
+        exit(0)
+    logging.basicConfig()
+    convert_all(sys.argv[1:])
@@ -0,0 +1,171 @@
+"""
+Manifest of every directory & histogram key in the input ROOT files.
+
+build_manifest() scans all the ROOT files in a directory in parallel, and
+caches the result on disk (in the input directory, as .key_manifest.json).
+Files only get rescanned if their mtime or size has changed.
+
+Each key is stored with a cheap fingerprint (seek position, size & timestamp
+of its TKey) - if the object gets rewritten, the fingerprint changes,
+without us having to read the histogram itself. Keys only in a NumPy store
+have no TKey, so they get a hash of their contents instead (it's just a
+slice of a memmapped array, so still cheap).
+
+Use it to check that everything a set of plots needs actually exists
+*before* spending hours making them:
+
+    manifest = build_manifest(ROOTdir)
+    missing = manifest.missing(requests)
+
+and set plot_grabber.key_manifest = manifest so lookups use it as well.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import plot_grabber as grabr
+import hist_store
+from file_utils import write_atomic
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+CACHE_NAME = ".key_manifest.json"
+
+
+def norm_path(f_path):
+    """
+    So we can match up "dir//file.root" and "dir/file.root"
+    """
+    return os.path.normpath(os.path.abspath(f_path))
+
+
+def scan_file(f_path):
+    """
+    Get all the directories & keys (+ fingerprints) in a file.
+    Uses the NumPy store instead if we can't import ROOT (or there's only a store).
+    Returns (f_path, stamp, contents) so it can be used with Pool.map
+    """
+    stamp = hist_store.input_stamp(f_path)
+    dirs, keys = [], {}
+    r = grabr.need_root()
+    if r is None or not os.path.isfile(f_path):
+        # not open_store(), that might be an older copy we've cached
+        path = hist_store.store_path(f_path)
+        if not os.path.isfile(os.path.join(path, hist_store.INDEX_NAME)):
+            raise Exception("Need either ROOT or a NumPy store to scan %s" % f_path)
+        store = hist_store.HistStore(path)
+        if store.is_stale(f_path):
+            raise Exception("%s is older than %s - please re-run hist_store.py" % (path, f_path))
+        for key in store.keys:
+            h = hashlib.sha1()
+            for arr in store.get(key):
+                h.update(np.ascontiguousarray(arr, dtype=np.float64).tostring())
+            keys[key] = "store:" + h.hexdigest()[:16]
+            if "/" in key:
+                dirs.append(key.rsplit("/", 1)[0])
+        return f_path, stamp, {"dirs": sorted(set(dirs)), "keys": keys}
+
+    f = r.TFile.Open(f_path)
+    if not f or f.IsZombie():
+        raise Exception("Cannot open file", f_path)
+
+    def walk(tdir, prefix):
+        for key in tdir.GetListOfKeys():
+            name = prefix + key.GetName()
+            if key.IsFolder() and r.TClass.GetClass(key.GetClassName()).InheritsFrom("TDirectory"):
+                dirs.append(name)
+                walk(key.ReadObj(), name + "/")
+            else:
+                keys[name] = "%d:%d:%d" % (key.GetSeekKey(), key.GetNbytes(), key.GetDatime().Get())
+
+    walk(f, "")
+    f.Close()
+    return f_path, stamp, {"dirs": dirs, "keys": keys}
+
+
+class Manifest():
+    """
+    Holds the contents of each scanned file, keyed by normalised path
+    """
+
+    def __init__(self, files=None):
+        self.files = files or {}  # path : {"stamp":..., "dirs": [...], "keys": {key: fingerprint}}
+
+    def knows(self, f_path):
+        return norm_path(f_path) in self.files
+
+    def has_key(self, f_path, key):
+        f_info = self.files.get(norm_path(f_path))
+        return f_info is not None and key in f_info["keys"]
+
+    def fingerprint(self, f_path, key):
+        """
+        Fingerprint for key in file, or None if it isn't there
+        """
+        f_info = self.files.get(norm_path(f_path))
+        return f_info["keys"].get(key) if f_info else None
+
+    def missing(self, requests):
+        """
+        Check a set of requests, dict of file path : list of
+        (sele, h_title, njet, btag, ht_bins) (e.g. from prediction_engine.input_requests()).
+        Returns list of (file path, key) for everything that doesn't exist.
+        """
+        missing = []
+        for f_path, reqs in requests.iteritems():
+            if not self.knows(f_path):
+                missing.append((f_path, ""))
+                continue
+            for req in reqs:
+                for key in grabr.request_keys(f_path, req):
+                    if not self.has_key(f_path, key):
+                        missing.append((f_path, key))
+        return missing
+
+
+def build_manifest(root_dir, n_procs=None, cache_path=None):
+    """
+    Scan all the ROOT files in root_dir, in parallel.
+    Files that haven't changed since the cached manifest get skipped.
+    """
+    cache_path = cache_path or os.path.join(root_dir, CACHE_NAME)
+    files = {}
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                files = json.load(f)
+        except ValueError:
+            log.warning("Ignoring corrupt manifest cache %s" % cache_path)
+
+    # (files we've only got a NumPy store for count as well)
+    names = set(f for f in os.listdir(root_dir) if f.endswith(".root"))
+    names |= set(f[:-len(hist_store.STORE_EXT)] + ".root" for f in os.listdir(root_dir) if f.endswith(hist_store.STORE_EXT))
+    f_paths = [norm_path(os.path.join(root_dir, f)) for f in sorted(names)]
+    # drop anything that's been deleted, and find anything that's changed
+    files = dict((p, files[p]) for p in f_paths if p in files)
+    to_scan = [p for p in f_paths if p not in files or files[p]["stamp"] != hist_store.input_stamp(p)]
+
+    if to_scan:
+        log.info("Scanning %d of %d files in %s" % (len(to_scan), len(f_paths), root_dir))
+        n_procs = min(n_procs or cpu_count(), len(to_scan))
+        if n_procs > 1:
+            pool = Pool(n_procs)
+            results = pool.map(scan_file, to_scan)
+            pool.close()
+            pool.join()
+        else:
+            results = map(scan_file, to_scan)
+        for f_path, stamp, contents in results:
+            contents["stamp"] = stamp
+            files[f_path] = contents
+        try:
+            write_atomic(cache_path, lambda f: json.dump(files, f))
+        except (IOError, OSError) as e:
+            log.warning("Couldn't write manifest cache %s: %s" % (cache_path, e))
+
+    return Manifest(files)
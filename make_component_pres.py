@@ -2,6 +2,10 @@
 Make component plots into beamer pres. Does it for one variable, in one
 njet/btag bin. Need to pass in parent plot directory, var to plot, njet,
 btag, HT bounds
+
+Component plots get made by shape_plots.py --components. If you didn't do
+that, pass in the results file from shape_plots.py --compute-only and any
+missing ones will get made from that (no need to re-read the input files).
 """
 
 from itertools import product
@@ -9,8 +13,29 @@ import subprocess
 import sys
 import os
 
+def make_missing_components(results_file, plot_dir, var, njet, btag, HTbins, ctrl_regions):
+    """
+    Make any component plots we need that aren't there, from the
+    predictions saved in results_file by shape_plots.py --compute-only
+    """
+    components = ["data_control", "hist_mc_control", "hist_mc_signal", "mc_ratio"]
+    todo = [ht for ht in HTbins if not all(os.path.isfile("%s/%s_%s_%s/%s/%s_%s_%s.pdf" % (plot_dir, njet, btag, ht, var, comp, ctrl, ht))
+                                           for comp, ctrl in product(components, ctrl_regions))]
+    if not todo:
+        return
+    # only need ROOT if we actually have something to plot
+    from prediction_engine import load_results
+    from Prediction_Plot import PredictionPlot
+    engine = load_results(results_file)[(var, njet, btag)]
+    for ht in todo:
+        print "Making component plots for", ht
+        plot = PredictionPlot(engine.ROOTdir, plot_dir, var, njet, btag, [ht], engine.rebin, False, "", engine.qcd, engine)
+        plot.make_component_plots()
+
+
 def make_pres(plot_dir="/Users/robina/Dropbox/AlphaT/RA1_scripts/11Dec_aT_0p53_forRobin_v0/",
-              var="ComMinBiasDPhi_acceptedJets", njet="ge4j", btag="eq0b", lo_ht="200", hi_ht="Inf"):
+              var="ComMinBiasDPhi_acceptedJets", njet="ge4j", btag="eq0b", lo_ht="200", hi_ht="Inf",
+              results_file=None):
 
     var_safe = var.replace("_", "\_")
 
@@ -39,6 +64,9 @@ def make_pres(plot_dir="/Users/robina/Dropbox/AlphaT/RA1_scripts/11Dec_aT_0p53_f
     # Control regions to plot
     ctrl_regions = ["OneMuon", "DiMuon"]
 
+    if results_file:
+        make_missing_components(results_file, plot_dir, var, njet, btag, HTbins, ctrl_regions)
+
     # Use template - change title, subtitle, include file
     with open(template, "r") as t:
         with open(new_tex_file, "w") as f:
@@ -191,8 +219,9 @@ if __name__ == "__main__":
 
     if len(sys.argv) == 1: # cos I'm lazy
         make_pres()
-    elif len(sys.argv) == 7:
-        make_pres(plot_dir=sys.argv[1], var=sys.argv[2], njet=sys.argv[3], btag=sys.argv[4], lo_ht=sys.argv[5], hi_ht=sys.argv[6])
+    elif len(sys.argv) in [7, 8]:
+        make_pres(plot_dir=sys.argv[1], var=sys.argv[2], njet=sys.argv[3], btag=sys.argv[4], lo_ht=sys.argv[5], hi_ht=sys.argv[6],
+                  results_file=sys.argv[7] if len(sys.argv) == 8 else None)
     elif len(sys.argv) == 4: # make pres for all var/njet/btag bins
         plot_vars = ["Number_Btags", "AlphaT", "LeadJetPt", "LeadJetEta",
                      "SecondJetPt", "SecondJetEta", "HT", "MHT", "MET_Corrected",
@@ -204,6 +233,6 @@ if __name__ == "__main__":
             make_pres(plot_dir=sys.argv[1], var=v, njet=nj, btag=nb, lo_ht=sys.argv[2], hi_ht=sys.argv[3])
     else:
         print "Usage:"
-        print "python make_component_pres.py <plot_dir> <var> <njet> <btag> <lower HT bound> <upper HT bound e.g. Inf>"
+        print "python make_component_pres.py <plot_dir> <var> <njet> <btag> <lower HT bound> <upper HT bound e.g. Inf> [<results file>]"
         print "or python make_component_pres.py <plot_dir> <lower HT bound> <upper HT bound e.g. Inf> to run over existing component plots"
         exit(0)
\ No newline at end of file
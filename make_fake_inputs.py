@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Make fake input files, with the same files, directories & histogram names
+as the real Root_Files_* dirs, so you can test or benchmark (see
+benchmark.py) the plotting without the real (multi-GB) inputs.
+
+Every histogram that shape_plots.py would ask for (for the vars, njet,
+btag & HT bins given) gets made - the list comes from
+prediction_engine.input_requests(), so it's always the layout get_dirs(),
+btag_string() & jet_string_*() expect. Contents are a falling spectrum,
+random but reproducible (seeded by file & key): Poisson counts for data,
+weighted for MC.
+
+python make_fake_inputs.py fake_inputs                  # all vars, njet, btag, HT
+python make_fake_inputs.py fake_fineJetMulti -v AlphaT HT --nbins 200
+
+Writes ROOT files if we have ROOT, otherwise NumPy stores (see hist_store.py),
+which plot_grabber reads just the same. Put "fineJetMulti" in the dir name
+to get the fine jet binning, like the real ones.
+"""
+
+import os
+import sys
+import json
+import zlib
+import logging
+import argparse
+import numpy as np
+from itertools import product
+import plot_grabber as grabr
+import hist_store
+from prediction_engine import input_requests
+import shape_plots as plotr
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# x range for each variable - default is DEFAULT_RANGE
+VAR_RANGES = {"AlphaT": (0., 5.), "ComMinBiasDPhi": (0., 4.), "ComMinBiasDPhi_acceptedJets": (0., 4.),
+              "JetMultiplicity": (0., 20.), "Number_Btags": (0., 10.), "Number_Good_verticies": (0., 50.),
+              "CommonJetEta": (-5., 5.), "LeadJetEta": (-5., 5.), "SecondJetEta": (-5., 5.),
+              "MHTovMET": (0., 5.), "HT": (0., 2500.), "EffectiveMass": (0., 3000.)}
+DEFAULT_RANGE = (0., 1000.)
+
+SETTINGS_NAME = ".fake_inputs.json"  # what we made, so benchmark.py can tell if it needs remaking
+
+
+def needed_keys(root_dir, plot_vars, njet, btag, htbins, qcd=True):
+    """
+    dict of file path : set of keys ("dir/hist") needed to plot everything
+    """
+    keys = {}
+    for v, j, b in product(plot_vars, njet, btag):
+        for f_path, reqs in input_requests(root_dir, v, j, b, htbins, qcd).iteritems():
+            for req in reqs:
+                keys.setdefault(f_path, set()).update(grabr.request_keys(f_path, req))
+    return keys
+
+
+def fake_hist(f_path, key, nbins, seed=0):
+    """
+    (edges, sumw, sumw2) (both incl. under/overflow) for one histogram
+    """
+    var = key.split("/")[-1].rsplit("_", 1)[0]
+    lo, hi = VAR_RANGES.get(var, DEFAULT_RANGE)
+    edges = np.linspace(lo, hi, nbins + 1)
+    rng = np.random.RandomState(zlib.crc32("%d:%s:%s" % (seed, os.path.basename(f_path), key)) & 0xffffffff)
+    # falling spectrum, with a different norm & slope for each hist
+    x = np.arange(nbins + 2, dtype=np.float64)
+    expected = rng.uniform(50, 5000) * np.exp(-x / (nbins * rng.uniform(0.05, 0.5)))
+    if "Data" in f_path:
+        sumw = rng.poisson(expected).astype(np.float64)
+        sumw2 = sumw.copy()
+    else:
+        weight = rng.uniform(0.01, 1.)
+        sumw = rng.poisson(expected / weight) * weight
+        sumw2 = sumw * weight
+    return edges, sumw, sumw2
+
+
+def write_root(f_path, hists):
+    """
+    Write hists (dict of key : (edges, sumw, sumw2)) to ROOT file f_path
+    """
+    r = grabr.need_root()
+    f = r.TFile.Open(f_path, "RECREATE")
+    for key in sorted(hists):
+        d, name = key.rsplit("/", 1)
+        if not f.GetDirectory(d):
+            f.mkdir(d)
+        f.cd(d)
+        h = grabr.arrays_to_th1(name, *hists[key])
+        h.Write(name)
+    f.Close()
+
+
+def write_fake_store(f_path, hists):
+    """
+    Write hists (dict of key : (edges, sumw, sumw2)) as just a NumPy store for f_path
+    """
+    keys = {}
+    edges, sumw, sumw2 = [], [], []
+    n_edges, n_bins = 0, 0
+    for key in sorted(hists):
+        e, w, w2 = hists[key]
+        keys[key] = [n_edges, n_bins, len(e) - 1, True]
+        edges.extend(e)
+        sumw.extend(w)
+        sumw2.extend(w2)
+        n_edges += len(e)
+        n_bins += len(w)
+    hist_store.write_store(hist_store.store_path(f_path), f_path, None, keys, edges, sumw, sumw2)
+
+
+def make_fake_inputs(out_dir, plot_vars, njet, btag, htbins, nbins=100, fmt=None, seed=0):
+    """
+    Write fake inputs for everything to out_dir. fmt is "root", "store" or
+    "both" - default is ROOT if we have it, otherwise stores.
+    Returns number of histograms written.
+    """
+    if fmt is None:
+        fmt = "root" if grabr.need_root() else "store"
+    if fmt != "store" and not grabr.need_root():
+        raise RuntimeError("Need ROOT to write ROOT files - use --format store")
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    keys = needed_keys(out_dir, plot_vars, njet, btag, htbins)
+    n_hists = 0
+    for f_path in sorted(keys):
+        hists = dict((key, fake_hist(f_path, key, nbins, seed)) for key in keys[f_path])
+        if fmt in ["root", "both"]:
+            write_root(f_path, hists)
+        if fmt == "both":
+            hist_store.convert(f_path)
+        elif fmt == "store":
+            if os.path.isfile(f_path):
+                os.remove(f_path)  # or the store would be stale
+            write_fake_store(f_path, hists)
+        n_hists += len(hists)
+    with open(os.path.join(out_dir, SETTINGS_NAME), "w") as f:
+        json.dump(fake_settings(plot_vars, njet, btag, htbins, nbins, fmt, seed), f)
+    print "Written %d hists in %d files to %s" % (n_hists, len(keys), out_dir)
+    return n_hists
+
+
+def fake_settings(plot_vars, njet, btag, htbins, nbins, fmt, seed=0):
+    return {"vars": list(plot_vars), "njet": list(njet), "btag": list(btag), "htbins": list(htbins),
+            "nbins": nbins, "format": fmt, "seed": seed}
+
+
+def load_settings(out_dir):
+    """
+    Settings the fake inputs in out_dir were made with, or None
+    """
+    try:
+        with open(os.path.join(out_dir, SETTINGS_NAME)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="where to put the files")
+    parser.add_argument("-v", "--var", help="variables (default: all)", nargs="+", default=plotr.all_vars)
+    parser.add_argument("-j", "--njet", help="njet bins (default: all)", nargs="+")
+    parser.add_argument("-b", "--btag", help="btag bins (default: all)", nargs="+", default=plotr.n_b)
+    parser.add_argument("--ht", help="HT bins (default: all)", nargs="+", default=plotr.allHTbins)
+    parser.add_argument("--nbins", help="number of bins in each histogram", type=int, default=100)
+    parser.add_argument("--format", help="what to write (default: root if we have ROOT, else store)",
+                        choices=["root", "store", "both"])
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    args = parser.parse_args(in_args)
+    njet = args.njet or (plotr.n_j_fine if "fineJetMulti" in args.out_dir else plotr.n_j)
+    make_fake_inputs(args.out_dir, args.var, njet, args.btag, args.ht, args.nbins, args.format, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import ROOT as r
+import plot_grabber as grabr
 from array import array
 from itertools import product
 from copy import deepcopy
@@ -157,13 +158,13 @@ def get_dirs(htbins = None, sele = "", btag = "", keyword = ""):
 
 def grab_plots(f_path = "", h_title = "", sele = "OneMuon", njet = "", btag = "", ht_bins = []):
     if f_path:
-        f = r.TFile.Open(f_path)
+        f = grabr.file_pool.get(f_path)
     else:
         return
 
     h_total = None
     for d in get_dirs(htbins = ht_bins, sele = sele, btag = btag):
-        h = f.Get("%s/%s_%s" % (d, h_title, jet_string(njet)).Clone()
+        h = f.Get("%s/%s_%s" % (d, h_title, jet_string(njet))).Clone()
         if "Data" not in f_path:
             # apply ht bin trig effs
             h.Scale( trig_eff(sele = sele,
@@ -177,7 +178,7 @@ def grab_plots(f_path = "", h_title = "", sele = "OneMuon", njet = "", btag = ""
             h_total.Add(h)
 
     h_total_clone = deepcopy(h_total)
-    f.Close()
+    h_total_clone.SetDirectory(0)  # file stays open in the pool
 
     return h_total_clone
 
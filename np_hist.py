@@ -0,0 +1,213 @@
+"""
+Lightweight 1D histogram backed by NumPy arrays, for doing the prediction
+arithmetic without going through TH1 one bin at a time.
+
+Arrays follow the ROOT convention: values & variances have nbins+2 entries,
+index 0 is underflow and index nbins+1 is overflow. edges has nbins+1 entries.
+
+Arithmetic propagates errors the way TH1 does with Sumw2 on, and divide
+gives 0 (with 0 error) where the denominator is 0, like TH1::Divide.
+
+Only convert to/from TH1 when you need to draw something (to_th1/from_th1).
+"""
+
+import numpy as np
+
+
+# These work on arrays of any shape (bins along the last axis), so the
+# PredictionEngine can do lots of histograms at once. Hist uses them too,
+# so both give exactly the same numbers.
+
+def divide_arrays(a, var_a, b, var_b):
+    """
+    a / b with TH1::Divide error propagation. Returns (values, variances),
+    both 0 where b is 0.
+    """
+    nonzero = b != 0
+    b_safe = np.where(nonzero, b, 1.)
+    values = np.where(nonzero, a / b_safe, 0.)
+    variances = np.where(nonzero, (var_a * b * b + var_b * a * a) / b_safe ** 4, 0.)
+    return values, variances
+
+
+def multiply_arrays(a, var_a, b, var_b):
+    """
+    a * b with TH1::Multiply error propagation. Returns (values, variances)
+    """
+    return a * b, var_a * b * b + var_b * a * a
+
+
+def rebin_map(edges, rebin):
+    """
+    Work out the new edges, and which new bin (0 = underflow) each old bin
+    (incl. under/overflow) goes in, either combining every rebin bins
+    (like TH1::Rebin(n)), or for a new set of bin edges. For the latter
+    each old bin goes wherever its centre is.
+    """
+    edges = np.asarray(edges, dtype=np.float64)
+    nbins = len(edges) - 1
+    if hasattr(rebin, "__len__"):
+        new_edges = np.asarray(rebin, dtype=np.float64)
+        centres = 0.5 * (edges[:-1] + edges[1:])
+        idx = np.searchsorted(new_edges, centres, side="right")
+        idx = np.clip(idx, 0, len(new_edges))
+        idx = np.concatenate(([0], idx, [len(new_edges)]))
+    else:
+        rebin = int(rebin)
+        new_edges = edges[::rebin]
+        n_new = len(new_edges) - 1
+        idx = np.concatenate(([0], np.minimum(np.arange(nbins) // rebin + 1, n_new + 1), [n_new + 1]))
+    return new_edges, idx
+
+
+def rebin_last_axis(arr, idx, n_out):
+    """
+    Sum bins of arr (along the last axis) into n_out new bins, using idx
+    from rebin_map(). idx never goes down, so each new bin is a contiguous
+    block of old ones.
+    """
+    arr = np.asarray(arr, dtype=np.float64)
+    present, starts = np.unique(idx, return_index=True)
+    out = np.zeros(arr.shape[:-1] + (n_out,))
+    out[..., present] = np.add.reduceat(arr, starts, axis=-1)
+    return out
+
+
+class Hist(object):
+    """
+    edges, values (sumw) & variances (sumw2), plus a name (used for styling)
+    """
+
+    __slots__ = ("edges", "values", "variances", "name")
+
+    def __init__(self, edges, values, variances=None, name=""):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.values = np.array(values, dtype=np.float64)
+        # no variances means unweighted, i.e. Poisson
+        self.variances = self.values.copy() if variances is None else np.array(variances, dtype=np.float64)
+        self.name = name
+        if len(self.values) != len(self.edges) + 1 or len(self.variances) != len(self.values):
+            raise ValueError("Need len(values) == len(variances) == len(edges) + 1 (under/overflow)")
+
+    @classmethod
+    def from_th1(cls, h):
+        """
+        Make from a TH1
+        """
+        import plot_grabber as grabr
+        edges, sumw, sumw2 = grabr.th1_to_arrays(h)
+        return cls(edges, sumw, sumw2, h.GetName())
+
+    def to_th1(self, name=None):
+        """
+        Make a TH1D for drawing
+        """
+        import plot_grabber as grabr
+        return grabr.arrays_to_th1(name or self.name, self.edges, self.values, self.variances)
+
+    @property
+    def nbins(self):
+        return len(self.edges) - 1
+
+    @property
+    def errors(self):
+        return np.sqrt(self.variances)
+
+    def copy(self, name=None):
+        return Hist(self.edges, self.values, self.variances, self.name if name is None else name)
+
+    def integral(self):
+        """
+        Sum over visible bins, like TH1::Integral()
+        """
+        return self.values[1:-1].sum()
+
+    def check_compatible(self, other):
+        if len(self.edges) != len(other.edges) or not np.allclose(self.edges, other.edges):
+            raise ValueError("Hists %s and %s have different binning" % (self.name, other.name))
+
+    def add(self, other):
+        """
+        Add other to this one, in place
+        """
+        self.check_compatible(other)
+        self.values += other.values
+        self.variances += other.variances
+        return self
+
+    def __add__(self, other):
+        return self.copy().add(other)
+
+    def scale(self, factor):
+        """
+        Scale in place, errors too
+        """
+        self.values *= factor
+        self.variances *= factor * factor
+        return self
+
+    def divide(self, other):
+        """
+        Divide this by other, in place. Bins where other is 0 become 0.
+        """
+        self.check_compatible(other)
+        self.values, self.variances = divide_arrays(self.values, self.variances, other.values, other.variances)
+        return self
+
+    def multiply(self, other):
+        """
+        Multiply this by other, in place
+        """
+        self.check_compatible(other)
+        self.values, self.variances = multiply_arrays(self.values, self.variances, other.values, other.variances)
+        return self
+
+    def add_quadrature(self, errors):
+        """
+        Add extra errors (array of nbins+2, or for visible bins only) in quadrature
+        """
+        errors = np.asarray(errors, dtype=np.float64)
+        if len(errors) == self.nbins:
+            self.variances[1:-1] += errors ** 2
+        else:
+            self.variances += errors ** 2
+        return self
+
+    def rebin(self, rebin):
+        """
+        Rebin, either combining every rebin bins (like TH1::Rebin(n)),
+        or to a new set of bin edges (like TH1::Rebin(n, name, edges)).
+        Returns a new Hist. Stuff that falls outside the new edges ends up
+        in the under/overflow bins.
+        """
+        new_edges, idx = rebin_map(self.edges, rebin)
+        values, variances = rebin_last_axis(np.array([self.values, self.variances]), idx, len(new_edges) + 1)
+        return Hist(new_edges, values, variances, self.name)
+
+    def filled_range(self):
+        """
+        Low edge of first filled bin & high edge of last, or None if empty
+        """
+        filled = np.nonzero(self.values[1:-1] > 0)[0]
+        if not len(filled):
+            return None
+        return self.edges[filled[0]], self.edges[filled[-1] + 1]
+
+    def poisson_errors(self, cl=0.682689492):
+        """
+        Lower & upper errors from the Garwood (central) Poisson interval on each
+        bin content, like TH1::kPoisson. Uses scipy if it's there, else ROOT.
+        """
+        n = self.values
+        alpha = 1. - cl
+        try:
+            from scipy.stats import chi2
+            low = np.where(n > 0, chi2.ppf(alpha / 2., 2 * n) / 2., 0.)
+            high = chi2.ppf(1. - alpha / 2., 2 * (n + 1)) / 2.
+        except ImportError:
+            import ROOT as r
+            gamma_q = np.vectorize(r.Math.gamma_quantile)
+            gamma_qc = np.vectorize(r.Math.gamma_quantile_c)
+            low = np.where(n > 0, gamma_q(alpha / 2., np.maximum(n, 1), 1.), 0.)
+            high = gamma_qc(alpha / 2., n + 1, 1.)
+        return n - low, high - n
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Keep ROOT, the open input files, the predictions & the plot styling loaded
+in a background process, so "tweak one plot and look" doesn't pay for
+starting all that up every time.
+
+Use it just like shape_plots.py - any args get passed straight on:
+
+python plot_daemon.py -v AlphaT -j le3j -b eq0b --ht 375_475
+
+The first time, this starts the daemon (python plot_daemon.py --serve)
+in the background. Requests get run one at a time by shape_plots.main(),
+in the client's working dir, and the client prints the output (incl. any
+logged warnings) & the plots made. If an input file (or NumPy store) or a
+systematics config changes, the daemon notices & forgets what it had cached.
+
+python plot_daemon.py --stop   # stop the daemon
+
+The daemon listens on a Unix socket that only you can use. Requests &
+replies are one line of JSON each.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import logging
+import argparse
+import tempfile
+import traceback
+import subprocess
+from StringIO import StringIO
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "shape_plots_%d.sock" % os.getuid())
+MAX_ENGINES = 50  # forget all the cached predictions after this many
+
+
+def send(conn, msg):
+    conn.sendall(json.dumps(msg) + "\n")
+
+
+def receive(conn):
+    """
+    Read one line of JSON from conn, or None if it closed first
+    """
+    buf = ""
+    while not buf.endswith("\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            return None
+        buf += chunk
+    return json.loads(buf)
+
+
+def file_stamps(paths):
+    """
+    dict of path : (mtime, size), or (None, None) if it's not there
+    """
+    stamps = {}
+    for p in paths:
+        try:
+            st = os.stat(p)
+            stamps[p] = (st.st_mtime, st.st_size)
+        except OSError:
+            stamps[p] = (None, None)
+    return stamps
+
+
+def input_stamp(root_dir):
+    """
+    Something that changes if any input file or NumPy store in root_dir changes
+    """
+    import hist_store
+    paths = []
+    if os.path.isdir(root_dir):
+        for f in sorted(os.listdir(root_dir)):
+            if f.endswith(".root"):
+                paths.append(os.path.join(root_dir, f))
+            elif f.endswith(hist_store.STORE_EXT):
+                paths.append(os.path.join(root_dir, f, hist_store.INDEX_NAME))
+    return file_stamps(paths)
+
+
+class PlotDaemon():
+    """
+    Runs shape_plots.main() for each request, keeping everything loaded in between
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        import shape_plots
+        self.plotr = shape_plots
+        self.plotr.setup_root()  # the slow bit: ROOT, styles etc.
+        self.plotr.engine_cache = {}
+        self.stamp = None
+        self.syst_stamp = {}  # of the systematics configs loaded by the last request
+        self.n_requests = 0
+
+    def refresh(self):
+        """
+        Forget anything cached if the inputs or systematics have changed since last time
+        """
+        import systematics
+        import hist_store
+        import plot_grabber as grabr
+        stamp = input_stamp(self.plotr.ROOTdir)
+        syst_stamp = file_stamps(self.syst_stamp)
+        if stamp != self.stamp or syst_stamp != self.syst_stamp or len(self.plotr.engine_cache) > MAX_ENGINES:
+            if self.stamp is not None:
+                log.info("Inputs changed, clearing caches")
+            self.plotr.engine_cache.clear()
+            grabr.file_pool.close_all()
+            grabr.key_manifest = None
+            hist_store._stores.clear()
+            systematics.clear_cache()
+            self.stamp, self.syst_stamp = stamp, syst_stamp
+
+    def handle(self, request):
+        """
+        Do one plot request, return the reply
+        """
+        import systematics
+        self.n_requests += 1
+        start = time.time()
+        out = StringIO()
+        old_cwd = os.getcwd()
+        sys.stdout, sys.stderr = out, out
+        # so the client sees warnings as well, not just what gets printed
+        handler = logging.StreamHandler(out)
+        handler.setLevel(logging.WARNING)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        logging.getLogger().addHandler(handler)
+        reply = {"ok": True}
+        try:
+            os.chdir(request["cwd"])
+            self.refresh()
+            self.plotr.made_outputs = []
+            self.plotr.main(request["args"])
+        except SystemExit as e:  # argparse: --help or bad args
+            reply["ok"] = not e.code
+        except Exception:
+            reply["ok"] = False
+            reply["error"] = traceback.format_exc()
+        finally:
+            logging.getLogger().removeHandler(handler)
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+            self.syst_stamp = file_stamps([systematics.DEFAULT_CONFIG] + systematics.loaded_paths())
+            os.chdir(old_cwd)
+        reply["outputs"] = [os.path.abspath(os.path.join(request["cwd"], o)) for o in self.plotr.made_outputs or []]
+        reply["log"] = out.getvalue()
+        reply["seconds"] = time.time() - start
+        self.plotr.made_outputs = None
+        return reply
+
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0177)  # only us
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(5)
+        log.info("Listening on %s" % self.socket_path)
+        try:
+            while True:
+                conn, _ = server.accept()
+                try:
+                    request = receive(conn)
+                    if request is None:
+                        continue
+                    if request.get("cmd") == "stop":
+                        send(conn, {"ok": True})
+                        break
+                    if request.get("cmd") == "ping":
+                        send(conn, {"ok": True, "pid": os.getpid(), "requests": self.n_requests})
+                        continue
+                    send(conn, self.handle(request))
+                except socket.error as e:
+                    log.warning("Lost client: %s" % e)
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def connect(socket_path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(socket_path)
+    return conn
+
+
+def request(socket_path, msg):
+    """
+    Send msg to the daemon & get the reply
+    """
+    conn = connect(socket_path)
+    try:
+        send(conn, msg)
+        reply = receive(conn)
+    finally:
+        conn.close()
+    if reply is None:
+        raise RuntimeError("Plot daemon died - see its log. It'll get restarted next time.")
+    return reply
+
+
+def start_daemon(socket_path, log_path, timeout=120):
+    """
+    Start the daemon in the background & wait for it to be ready
+    """
+    print "Starting plot daemon (log in %s)..." % log_path
+    with open(log_path, "a") as log_file:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--socket", socket_path],
+                         stdout=log_file, stderr=subprocess.STDOUT, stdin=open(os.devnull),
+                         preexec_fn=os.setsid, close_fds=True)
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            return request(socket_path, {"cmd": "ping"})
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError("Plot daemon didn't start - see %s" % log_path)
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, add_help=False)
+    parser.add_argument("--serve", help="run the daemon (in the foreground)", action="store_true")
+    parser.add_argument("--stop", help="stop the daemon", action="store_true")
+    parser.add_argument("--socket", help="socket to use (default: %(default)s)", default=DEFAULT_SOCKET)
+    parser.add_argument("--daemon_log", help="where the daemon's output goes", default=DEFAULT_SOCKET.replace(".sock", ".log"))
+    args, plot_args = parser.parse_known_args(in_args)
+
+    if args.serve:
+        logging.basicConfig()
+        PlotDaemon(args.socket).serve()
+        return
+    if args.stop:
+        try:
+            request(args.socket, {"cmd": "stop"})
+            print "Stopped plot daemon"
+        except socket.error:
+            print "Plot daemon wasn't running"
+        return
+
+    try:
+        reply = request(args.socket, {"cmd": "plot", "args": plot_args, "cwd": os.getcwd()})
+    except socket.error as e:
+        if e.errno not in [errno.ENOENT, errno.ECONNREFUSED]:
+            raise
+        start_daemon(args.socket, args.daemon_log)
+        reply = request(args.socket, {"cmd": "plot", "args": plot_args, "cwd": os.getcwd()})
+    sys.stdout.write(reply["log"])
+    for output in reply["outputs"]:
+        print "Plot:", output
+    if not reply["ok"]:
+        sys.stderr.write(reply.get("error", ""))
+        sys.exit(1)
+    print "(%.2f s in daemon)" % reply["seconds"]
+
+
+if __name__ == "__main__":
+    main()
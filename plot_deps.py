@@ -0,0 +1,120 @@
+"""
+Make-style dependency tracking for plots, so reruns only remake plots whose
+inputs or settings have actually changed.
+
+Next to each plot we keep a small JSON sidecar (<outname>.deps) with:
+- a hash of the fingerprints of every input histogram key the plot read
+  (from the key_manifest, so we don't have to read the histograms), or of
+  the results file if it was made from one (--render-from),
+- the settings that made it: var/njet/btag/HT bins, rebin, log, title,
+  QCD, toys, the systematics config & plot_grabber.SCALE_VERSION.
+
+A plot is up to date if all its output files exist & its sidecar matches.
+If you change how plots get drawn (i.e. the code), bump DEPS_VERSION to
+remake everything.
+
+    deps = plot_deps.plot_deps(engine, htbins, settings, manifest)
+    reason = plot_deps.why_stale(outname, deps, formats)
+    if reason:
+        ...make plot...
+        plot_deps.write_deps(outname, deps)
+"""
+
+import os
+import json
+import hashlib
+import logging
+import plot_grabber as grabr
+from key_manifest import norm_path
+from hist_cache import hash_file
+from hist_store import file_stamp
+from prediction_engine import input_requests
+from file_utils import write_atomic
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEPS_VERSION = 1
+
+_results_hashes = {}  # results file path : (stamp, hash), so we only hash each once
+
+
+def deps_path(outname):
+    return outname + ".deps"
+
+
+def input_hash(requests, manifest):
+    """
+    Hash of the fingerprints of every key needed for requests (dict of
+    file path : list of requests, e.g. from prediction_engine.input_requests())
+    """
+    sha = hashlib.sha1()
+    for f_path in sorted(requests):
+        for req in requests[f_path]:
+            for key in grabr.request_keys(f_path, req):
+                sha.update("%s|%s|%s\n" % (norm_path(f_path), key, manifest.fingerprint(f_path, key)))
+    return sha.hexdigest()
+
+
+def results_hash(f_path):
+    """
+    Hash of a results file (from prediction_engine.save_results())
+    """
+    stamp = file_stamp(f_path)
+    if f_path not in _results_hashes or _results_hashes[f_path][0] != stamp:
+        _results_hashes[f_path] = (stamp, hash_file(f_path))
+    return _results_hashes[f_path][1]
+
+
+def plot_deps(engine, htbins, settings, manifest):
+    """
+    Everything that goes into a plot of htbins made with engine.
+    settings: dict of anything else that affects how it looks (title etc.)
+    manifest: key_manifest.Manifest for the engine's input dir
+    """
+    if engine.results_file:
+        inputs = "results:" + results_hash(engine.results_file)
+    else:
+        inputs = input_hash(input_requests(engine.ROOTdir, engine.var, engine.njet, engine.btag, htbins, engine.qcd),
+                            manifest)
+    config = {"var": engine.var, "njet": engine.njet, "btag": engine.btag, "htbins": list(htbins),
+              "rebin": engine.rebin, "qcd": engine.qcd, "n_toys": engine.n_toys,
+              "scale_version": grabr.SCALE_VERSION,
+              # already applied if we're using a results file
+              "systematics": None if engine.results_file else engine.systematics.digest}
+    config.update(settings)
+    # round trip so we compare like with like (lists not tuples etc.)
+    # (& numpy arrays, e.g. rebin edges, become lists)
+    return json.loads(json.dumps({"version": DEPS_VERSION, "inputs": inputs, "config": config},
+                                 default=lambda o: o.tolist()))
+
+
+def why_stale(outname, deps, formats):
+    """
+    Reason why the plot at outname needs remaking, or None if it's up to date
+    """
+    missing = [fmt for fmt in formats if not os.path.isfile("%s.%s" % (outname, fmt))]
+    if missing:
+        return "no " + ", ".join(missing)
+    try:
+        with open(deps_path(outname)) as f:
+            old = json.load(f)
+    except (IOError, ValueError):
+        return "no dependency info"
+    if old.get("version") != deps["version"]:
+        return "DEPS_VERSION changed"
+    if old.get("inputs") != deps["inputs"]:
+        return "inputs changed"
+    changed = sorted(k for k in set(old.get("config", {})) | set(deps["config"])
+                     if old.get("config", {}).get(k) != deps["config"].get(k))
+    if changed:
+        return "changed: " + ", ".join(changed)
+    return None
+
+
+def write_deps(outname, deps):
+    """
+    Record what went into the plot at outname
+    """
+    write_atomic(deps_path(outname), lambda f: json.dump(deps, f, indent=1, sort_keys=True))
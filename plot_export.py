@@ -0,0 +1,189 @@
+"""
+Saves canvases to file in several formats, without holding up the plotting.
+
+ROOT can only safely be used from the main thread, so the PDF (and .C macro)
+get written straight away with SaveAs - the PDF is effectively our snapshot
+of the canvas, so the canvas is free to be reused as soon as export() returns.
+PNGs are then rasterised from that PDF by a bounded pool of background
+threads, using pdftoppm or ghostscript, while the main thread gets on with
+the next plot. If neither of those is installed, PNGs are made by ROOT
+as before.
+
+Usage:
+
+    exporter = Exporter(formats=["pdf", "png"], n_workers=4)
+    exporter.export(canvas, "plots/myplot")  # no extension
+    exporter.export(canvas, "plots/other", on_done=lambda: record("plots/other"))
+    ...
+    exporter.close()  # wait for everything to be written
+
+"""
+
+import os
+import logging
+import threading
+import subprocess
+from Queue import Queue
+from distutils.spawn import find_executable
+import profiling
+from file_utils import check_dir_exists
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEFAULT_FORMATS = ["pdf", "png", "C"]
+
+
+def find_rasteriser():
+    """
+    Get a function (pdf_path, png_path, width, height) -> command list to
+    turn a PDF into a PNG, or None if we don't have a suitable program
+    """
+    if find_executable("pdftoppm"):
+        def cmd(pdf_path, png_path, width, height):
+            # pdftoppm adds the .png itself
+            return ["pdftoppm", "-png", "-singlefile", "-scale-to-x", str(width), "-scale-to-y", str(height),
+                    pdf_path, os.path.splitext(png_path)[0]]
+        return cmd
+    if find_executable("gs"):
+        def cmd(pdf_path, png_path, width, height):
+            return ["gs", "-q", "-dSAFER", "-dBATCH", "-dNOPAUSE", "-sDEVICE=png16m",
+                    "-dTextAlphaBits=4", "-dGraphicsAlphaBits=4", "-dPDFFitPage",
+                    "-g%dx%d" % (width, height), "-sOutputFile=%s" % png_path, pdf_path]
+        return cmd
+    return None
+
+
+class Exporter():
+    """
+    Writes canvases to file in formats (list of file extensions),
+    rasterising PNGs in up to n_workers background threads.
+    At most max_pending PNGs can be queued up, after which export() waits,
+    so we can't run miles ahead & fill the disk with temp PDFs.
+    """
+
+    def __init__(self, formats=None, n_workers=2, max_pending=50):
+        self.formats = formats or DEFAULT_FORMATS[:]
+        self.rasterise = find_rasteriser() if "png" in self.formats else None
+        if "png" in self.formats and not self.rasterise:
+            log.warning("No pdftoppm or gs, so making PNGs with ROOT (slower)")
+        self.queue = Queue(max_pending)
+        self.failed = []  # outputs that didn't get made, with reason
+        self.lock = threading.Lock()
+        self.workers = []
+        if self.rasterise:
+            for i in xrange(n_workers):
+                t = threading.Thread(target=self.work, name="exporter%d" % i)
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
+
+    def export(self, canvas, out_stem, formats=None, on_done=None):
+        """
+        Save canvas to out_stem.<fmt> for each format. Everything that needs
+        ROOT is done before this returns, PNGs may still be in progress.
+        on_done() gets called once every format has been written (maybe in
+        a background thread), & not at all if any of them failed - so use it
+        for anything that says the plot is finished.
+        """
+        formats = formats or self.formats
+        check_dir_exists(os.path.dirname(os.path.abspath(out_stem)))
+        rasterise = self.rasterise and "png" in formats
+        for fmt in formats:
+            if fmt == "png" and rasterise:
+                continue
+            with profiling.timed("save_as"):
+                canvas.SaveAs("%s.%s" % (out_stem, fmt))
+            if profiling.enabled:
+                profiling.count("bytes_written", os.path.getsize("%s.%s" % (out_stem, fmt)))
+        if rasterise:
+            pdf_path = "%s.pdf" % out_stem
+            keep_pdf = "pdf" in formats
+            if not keep_pdf:
+                pdf_path = "%s.%d.tmp.pdf" % (out_stem, os.getpid())
+                canvas.SaveAs(pdf_path)
+            self.queue.put((pdf_path, "%s.png" % out_stem, canvas.GetWw(), canvas.GetWh(), keep_pdf, on_done))
+        elif on_done:
+            on_done()
+
+    def work(self):
+        """
+        Background thread: rasterise PDFs from the queue
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:  # from close()
+                self.queue.task_done()
+                return
+            pdf_path, png_path, width, height, keep_pdf, on_done = item
+            tmp_path = "%s.%s.tmp.png" % (os.path.splitext(png_path)[0], threading.current_thread().name)
+            try:
+                with profiling.timed("rasterise"):
+                    proc = subprocess.Popen(self.rasterise(pdf_path, tmp_path, width, height),
+                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                    out = proc.communicate()[0]
+                if proc.returncode != 0:
+                    raise RuntimeError(out.strip())
+                os.rename(tmp_path, png_path)
+                if profiling.enabled:
+                    profiling.count("bytes_written", os.path.getsize(png_path))
+                if on_done:
+                    on_done()
+            except Exception as e:
+                log.error("Failed to make %s: %s" % (png_path, e))
+                with self.lock:
+                    self.failed.append((png_path, str(e)))
+            finally:
+                for path in [tmp_path] + ([] if keep_pdf else [pdf_path]):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.queue.task_done()
+
+    def wait(self):
+        """
+        Wait for all queued PNGs to be written
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+        Wait for everything to finish & stop the workers.
+        Returns list of (output, reason) for any failures.
+        """
+        self.wait()
+        for t in self.workers:
+            self.queue.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+        self.rasterise = None  # any more exports get done by ROOT
+        if self.failed:
+            log.warning("%d outputs failed, first: %s" % (len(self.failed), self.failed[0]))
+        return self.failed
+
+
+_default_exporter = None
+
+
+def default_exporter():
+    """
+    The Exporter for this process - made the first time you ask, or set with configure()
+    """
+    global _default_exporter
+    if not _default_exporter:
+        _default_exporter = Exporter()
+    return _default_exporter
+
+
+def configure(formats=None, n_workers=2, max_pending=50, close_old=True):
+    """
+    Setup the default Exporter. Waits for the old one to finish first,
+    unless close_old=False (e.g. in a forked process, where the old one's
+    threads don't exist).
+    """
+    global _default_exporter
+    if _default_exporter and close_old:
+        _default_exporter.close()
+    _default_exporter = Exporter(formats, n_workers, max_pending)
+    return _default_exporter
@@ -1,6 +1,12 @@
-import ROOT as r
-from copy import deepcopy
+from collections import OrderedDict
+from array import array
 import logging
+import numpy as np
+import hist_store
+import profiling
+from np_hist import Hist
+
+r = None  # ROOT - slow to import, so only done when we need it, see need_root()
 
 
 # setup logger
@@ -11,6 +17,96 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 
+def need_root():
+    """
+    Import ROOT, if we haven't already. Returns it, or None if we can't
+    (can still grab_arrays() from NumPy stores, see hist_store.py)
+    """
+    global r
+    if r is None:
+        try:
+            import ROOT
+        except ImportError:
+            return None
+        ROOT.PyConfig.IgnoreCommandLineOptions = True  # before it sees our args
+        r = ROOT
+    return r
+
+
+MAX_OPEN_FILES = 32  # default for FilePool
+
+
+class FilePool():
+    """
+    Process-wide pool of open TFiles, so that each input file gets opened once
+    per worker rather than once per histogram. Least recently used handles
+    get closed once there are more than max_open files open.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        self.files = OrderedDict()  # f_path : TFile, oldest first
+
+    def get(self, f_path):
+        """
+        Get an open TFile for f_path, opening it if we don't already have it
+        """
+        if f_path in self.files:
+            f = self.files.pop(f_path)
+            self.files[f_path] = f  # move to most recently used
+            return f
+
+        r = need_root()
+        with profiling.timed("file_open"):
+            f = r.TFile.Open(f_path)
+        profiling.count("files_opened")
+        if not f or f.IsZombie():
+            raise Exception("Cannot open file", f_path)
+        f.Get._creates = True  # not quite sure what this does. but it stops root from leaking memory and keeps it's ram usage MUCH smaller
+        r.gROOT.cd()  # Open() cd's into the file, which is what closing it used to undo
+        self.files[f_path] = f
+        log.debug("Opened %s (%d files open)" % (f_path, len(self.files)))
+        self.evict()
+        return f
+
+    def evict(self):
+        """
+        Close least recently used files until we're within the cap
+        """
+        while len(self.files) > max(self.max_open, 1):
+            old_path, old_f = self.files.popitem(last=False)
+            log.debug("Closing %s" % old_path)
+            old_f.Close()
+
+    def set_max_open(self, max_open):
+        """
+        Change the cap on open file handles
+        """
+        self.max_open = max_open
+        self.evict()
+
+    def close_all(self):
+        """
+        Close every file in the pool
+        """
+        while self.files:
+            self.files.popitem(last=False)[1].Close()
+
+
+# one pool per process - use this rather than opening files yourself
+file_pool = FilePool()
+
+# whether to read from NumPy stores (see hist_store.py) instead of ROOT files where we have them
+use_stores = True
+
+# hist_cache.HistCache to keep scaled hists between runs, if wanted
+scaled_cache = None
+
+# key_manifest.Manifest of what's in the input files - if set, used to look up keys
+# rather than trying to Get() them
+key_manifest = None
+
+
 def get_dirs(htbins = None, sele = "", btag = "", keyword = ""):
     """get the list of dirs to access multi files"""
 
@@ -180,6 +276,10 @@ def trig_eff_fine(sele = "OneMuon", ht = "", njet = ""):
 
     return d[ht+"_"+njet]
 
+# Bump this whenever you change trig_eff_*, lumi or sb_corr,
+# so that scaled hists in any hist_cache get thrown away
+SCALE_VERSION = 1
+
 def lumi(sele = "mu"):
     """get the luminosity in fb-1"""
 
@@ -210,53 +310,256 @@ def sb_corr(samp = ""):
 
     return d[samp] if samp in d.keys() else 1
 
+def scale_factor(f_path, sele, d, njet):
+    """
+    Get the trigger eff * sideband correction * lumi scaling for a hist
+    from directory d of file f_path. Data doesn't get scaled.
+    """
+    if "Data" in f_path:
+        return 1.
+    if "fineJetMulti" in f_path:
+        jet_string = jet_string_fine
+        trig_eff = trig_eff_fine
+    else:
+        jet_string = jet_string_old
+        trig_eff = trig_eff_old
+    # apply ht bin trig effs
+    factor = trig_eff(sele = sele,
+                    ht = d.split("_")[-2] if "1075" != d[-4:] else d.split("_")[-1],
+                    njet = jet_string(njet))
+    debug = log.isEnabledFor(logging.DEBUG)  # this gets called for every key, so don't format for nothing
+    if debug:
+        log.debug("trig eff scaling: %f" % factor)
+    if "SMS" not in f_path.split("/")[-1]:
+        factor *= sb_corr(f_path.split("/")[-1].split("_")[1].split(".")[0])
+        if debug:
+            log.debug("sideband corr: %f" % ( sb_corr(f_path.split("/")[-1].split("_")[1].split(".")[0]) ))
+    factor *= lumi(sele)
+    if debug:
+        log.debug("lumi scaling: %f" %(lumi(sele)))
+    return factor
+
+
+def scale_hist(h, f_path, sele, d, njet):
+    """
+    Apply trigger eff, sideband correction & lumi scaling to a hist from
+    directory d of file f_path. Data is left alone.
+    """
+    if "Data" not in f_path:
+        h.Scale(scale_factor(f_path, sele, d, njet))
+
+
+def th1_to_arrays(h):
+    """
+    Get bin edges, sumw & sumw2 (both incl. under/overflow) from a TH1
+    """
+    nbins = h.GetNbinsX()
+    edges = np.array([h.GetBinLowEdge(i) for i in xrange(1, nbins + 2)])
+    sumw = np.array([h.GetBinContent(i) for i in xrange(nbins + 2)])
+    sumw2 = np.array([h.GetBinError(i) for i in xrange(nbins + 2)]) ** 2
+    return edges, sumw, sumw2
+
+
+def arrays_to_th1(name, edges, sumw, sumw2):
+    """
+    Make a TH1D out of bin edges, sumw & sumw2 (both incl. under/overflow)
+    """
+    r = need_root()
+    nbins = len(edges) - 1
+    h = r.TH1D(name, "", nbins, array("d", edges))
+    h.SetDirectory(0)
+    h.Sumw2()
+    for i in xrange(nbins + 2):
+        h.SetBinContent(i, sumw[i])
+        h.SetBinError(i, np.sqrt(sumw2[i]))
+    h.SetEntries(np.sum(sumw))
+    return h
+
+
+def request_key(sele, h_title, njet, btag, ht_bins):
+    """
+    Hashable key for one grab_many request - lists of HT bins become tuples
+    """
+    if not isinstance(ht_bins, basestring):
+        ht_bins = tuple(ht_bins)
+    return (sele, h_title, njet, btag, ht_bins)
+
+
+def request_keys(f_path, req):
+    """
+    Get the full keys ("dir/hist") in f_path that a (sele, h_title, njet, btag, ht_bins)
+    request needs
+    """
+    sele, h_title, njet, btag, ht_bins = req
+    jet_string = jet_string_fine if "fineJetMulti" in f_path else jet_string_old
+    return ["%s/%s_%s" % (d, h_title, jet_string(njet)) for d in get_dirs(htbins = ht_bins, sele = sele, btag = btag)]
+
+
+def grab_arrays(f_path = "", requests = []):
+    """
+    Like grab_many, but served from the NumPy store for f_path (see hist_store.py),
+    so doesn't need ROOT. Returns dict of request_key(*spec) : (edges, sumw, sumw2).
+    """
+    store = hist_store.open_store(f_path)
+    if not store:
+        raise Exception("No up-to-date NumPy store for %s - run hist_store.py on it" % f_path)
+    jet_string = jet_string_fine if "fineJetMulti" in f_path else jet_string_old
+
+    out = {}
+    debug = log.isEnabledFor(logging.DEBUG)
+    with profiling.timed("store_read"):
+        for req in requests:
+            req = request_key(*req)
+            sele, h_title, njet, btag, ht_bins = req
+            edges, sumw, sumw2 = None, None, None
+            for d in get_dirs(htbins = ht_bins, sele = sele, btag = btag):
+                key = "%s/%s_%s" % (d, h_title, jet_string(njet))
+                if debug:
+                    log.debug(f_path)
+                    log.debug(key)
+                if key not in store:
+                    raise Exception("Cannot get plot %s" % key)
+                e, w, w2 = store.get(key)
+                profiling.count("keys_read")
+                factor = scale_factor(f_path, sele, d, njet)
+                if sumw is None:
+                    edges, sumw, sumw2 = e, w * factor, w2 * factor * factor
+                else:
+                    sumw = sumw + w * factor
+                    sumw2 = sumw2 + w2 * factor * factor
+            out[req] = (edges, sumw, sumw2)
+    return out
+
+
+def grab_many(f_path = "", requests = []):
+    """
+    Extract many plots from one file in one go.
+
+    requests is a list of (sele, h_title, njet, btag, ht_bins) specs, each one
+    what you'd pass to grab_plots. All the directories needed are collected
+    first so each one is only looked up once, however many requests use it.
+
+    Returns dict of request_key(*spec) : summed, scaled histogram.
+    """
+    if not f_path:
+        return {}
+
+    jet_string = jet_string_fine if "fineJetMulti" in f_path else jet_string_old
+    if use_stores and hist_store.open_store(f_path):
+        out = {}
+        for req, (edges, sumw, sumw2) in grab_arrays(f_path, requests).iteritems():
+            out[req] = arrays_to_th1("%s_%s" % (req[1], jet_string(req[2])), edges, sumw, sumw2)
+        return out
+
+    # figure out which hists we need from each directory
+    requests = [request_key(*req) for req in requests]
+    req_dirs = {}
+    dir_hists = OrderedDict()
+    for req in requests:
+        sele, h_title, njet, btag, ht_bins = req
+        req_dirs[req] = get_dirs(htbins = ht_bins, sele = sele, btag = btag)
+        for d in req_dirs[req]:
+            dir_hists.setdefault(d, set()).add("%s_%s" % (h_title, jet_string(njet)))
+
+    # anything we've already got scaled in the cache doesn't need reading
+    scaled = {}  # (d, name, sele, njet) : scaled hist
+    if scaled_cache:
+        for req in requests:
+            sele, h_title, njet, btag, ht_bins = req
+            name = "%s_%s" % (h_title, jet_string(njet))
+            for d in req_dirs[req]:
+                entry = scaled_cache.get(f_path, "%s/%s" % (d, name), sele, njet, scale_factor(f_path, sele, d, njet))
+                if entry:
+                    scaled[(d, name, sele, njet)] = arrays_to_th1(name, *entry)
+        for d in dir_hists.keys():
+            dir_hists[d] = set(name for name in dir_hists[d]
+                               if any((d, name, req[0], req[2]) not in scaled
+                                      for req in requests if d in req_dirs[req]))
+            if not dir_hists[d]:
+                del dir_hists[d]
+
+    # check they all exist before touching the file
+    if key_manifest is not None and key_manifest.knows(f_path):
+        for d, names in dir_hists.iteritems():
+            for name in names:
+                if not key_manifest.has_key(f_path, "%s/%s" % (d, name)):
+                    raise Exception("Cannot get plot %s/%s" % (d, name))
+
+    # walk each dir once, grabbing everything we need from it
+    hists = {}
+    if dir_hists:
+        f = file_pool.get(f_path)
+    debug = log.isEnabledFor(logging.DEBUG)
+    with profiling.timed("read_keys"):
+        for d, names in dir_hists.iteritems():
+            tdir = f.GetDirectory(d)
+            if tdir:
+                tdir.Get._creates = True  # as for the file, so python owns (& frees) what we read
+            for name in names:
+                if debug:
+                    log.debug(f_path)
+                    log.debug("%s/%s" % (d, name))
+                h_tmp = tdir.Get(name) if tdir else None
+                if not h_tmp:
+                    raise Exception("Cannot get plot %s/%s" % (d, name))
+                h = h_tmp.Clone()
+                h.SetDirectory(0)  # don't let it die when the pool closes the file
+                hists[(d, name)] = h
+        profiling.count("keys_read", len(hists))
+        profiling.count("hist_clones", len(hists))
+
+    # now sum & scale for each request
+    out = {}
+    with profiling.timed("sum_scale"):
+        for req in requests:
+            sele, h_title, njet, btag, ht_bins = req
+            name = "%s_%s" % (h_title, jet_string(njet))
+            h_total = None
+            for d in req_dirs[req]:
+                if (d, name, sele, njet) in scaled:
+                    h = scaled[(d, name, sele, njet)].Clone()
+                else:
+                    h = hists[(d, name)].Clone()
+                    scale_hist(h, f_path, sele, d, njet)
+                    if scaled_cache:
+                        arrs = th1_to_arrays(h)
+                        scaled_cache.put(f_path, "%s/%s" % (d, name), sele, njet, scale_factor(f_path, sele, d, njet), *arrs)
+                        h = arrays_to_th1(name, *arrs)  # so it's the same as next time
+                    scaled[(d, name, sele, njet)] = h
+                    h = h.Clone()
+                    profiling.count("hist_clones")
+                profiling.count("hist_clones")
+                h.SetDirectory(0)
+                if not h_total:
+                    h_total = h
+                else:
+                    h_total.Add(h)
+            out[req] = h_total
+
+    return out
+
+
+def grab_hists(f_path = "", requests = []):
+    """
+    Like grab_many, but gives you np_hist.Hists. Straight from the NumPy
+    store if there is one, so doesn't touch ROOT at all then.
+    """
+    if use_stores and hist_store.open_store(f_path):
+        jet_string = jet_string_fine if "fineJetMulti" in f_path else jet_string_old
+        out = {}
+        for req, (edges, sumw, sumw2) in grab_arrays(f_path, requests).iteritems():
+            out[req] = Hist(edges, sumw, sumw2, "%s_%s" % (req[1], jet_string(req[2])))
+        return out
+    return dict((req, Hist.from_th1(h)) for req, h in grab_many(f_path, requests).iteritems())
+
+
 def grab_plots(f_path = "", h_title = "", sele = "OneMuon", njet = "", btag = "", ht_bins = []):
     """main function to extract single plot from various cats"""
 
-    if f_path:
-        f = r.TFile.Open(f_path)
-        f.Get._creates = True  # not quite sure what this does. but it stops root from leaking memory and keeps it's ram usage MUCH smaller
-    else:
+    if not f_path:
         return
 
-    if not f or f.IsZombie():
-        raise Exception("Cannot open file", f_path)
-
-    h_total = None
-    for d in get_dirs(htbins = ht_bins, sele = sele, btag = btag):
-        if "fineJetMulti" in f_path:
-            jet_string = jet_string_fine
-            trig_eff = trig_eff_fine
-        else:
-            jet_string = jet_string_old
-            trig_eff = trig_eff_old
-        log.debug(f_path)
-        log.debug("%s/%s_%s" % (d, h_title, jet_string(njet)))
-        h_tmp = f.Get("%s/%s_%s" % (d, h_title, jet_string(njet)))
-        if not h_tmp:
-            raise Exception("Cannot get plot %s/%s_%s" % (d, h_title, jet_string(njet)) )
-        h = h_tmp.Clone()
-        if "Data" not in f_path:
-            # apply ht bin trig effs
-            h.Scale( trig_eff(sele = sele,
-                            ht = d.split("_")[-2] if "1075" != d[-4:] else d.split("_")[-1],
-                            njet = jet_string(njet)) )
-            log.debug("trig eff scaling: %f" % (trig_eff(sele = sele,
-                            ht = d.split("_")[-2] if "1075" != d[-4:] else d.split("_")[-1],
-                            njet = jet_string(njet))))
-            if "SMS" not in f_path.split("/")[-1]:
-                h.Scale( sb_corr(f_path.split("/")[-1].split("_")[1].split(".")[0]) )
-                log.debug("sideband corr: %f" % ( sb_corr(f_path.split("/")[-1].split("_")[1].split(".")[0]) ))
-            h.Scale( lumi(sele) )
-            log.debug("lumi scaling: %f" %(lumi(sele)))
-        if not h_total:
-            h_total = h.Clone()
-        else:
-            h_total.Add(h)
-    h_total_clone = deepcopy(h_total)
-    f.Close()
-
-    return h_total_clone
+    return grab_many(f_path, [(sele, h_title, njet, btag, ht_bins)]).values()[0]
 
 if __name__ == "__main__":
     print ">>> Running plot_grabber debugger."
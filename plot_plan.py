@@ -0,0 +1,92 @@
+"""
+What plots a sweep should make & what they're called - without ROOT, or
+drawing anything - so shape_plots.py --check & --plan are quick, even for
+tens of thousands of plots.
+
+The output dir gets listed once, into a set, rather than stat'ing every file:
+
+    plans = plan_plots(ROOTdir, out_dir, plot_vars, njet, btag, ht_plots, qcd)
+    existing = list_outputs(out_dir)
+    for p in plans:
+        print p.outname, missing_formats(p.outname, formats, existing), missing_deps(p.outname, existing)
+
+PredictionPlot uses plot_outname() as well, so the names always match.
+"""
+
+import os
+from collections import namedtuple
+from itertools import product
+import plot_grabber as grabr
+from prediction_engine import make_ht_string
+from plot_deps import deps_path
+
+
+OUT_STEM = "Prediction"  # used for folder & plot names
+
+# one plot: ht is the name used on the command line (e.g. 375_475, 375_upwards),
+# htbins the exclusive bins it sums over, outname the path without extension
+PlannedPlot = namedtuple("PlannedPlot", "var njet btag ht htbins outname")
+
+
+def plot_dir(out_dir, njet, btag, htbins):
+    """
+    Dir for all the plots of one njet/btag/HT
+    """
+    return "%s/%s_%s_%s" % (out_dir, njet, btag, make_ht_string(htbins))
+
+
+def plot_outname(root_dir, out_dir, var, njet, btag, htbins, qcd=False):
+    """
+    Output file dir+name (without extension) for a plot
+    """
+    njet_string = grabr.jet_string_fine(njet) if "fineJetMulti" in root_dir else grabr.jet_string_old(njet)
+    btag_string = grabr.btag_string(btag)  # e.g. eq0b -> btag_zero
+    return "%s/%s_%s_%s_%s%s%s%s" % (plot_dir(out_dir, njet, btag, htbins),
+                                     OUT_STEM,
+                                     var,
+                                     njet_string,
+                                     btag_string,
+                                     "_" if btag_string else "",
+                                     make_ht_string(htbins),
+                                     "_QCD" if qcd else "")
+
+
+def plan_plots(root_dir, out_dir, plot_vars, njet, btag, ht_plots, qcd=False):
+    """
+    PlannedPlot for every var/njet/btag & (name, htbins) in ht_plots.
+    The outnames are normalised, to match list_outputs().
+    """
+    out_dir = os.path.normpath(out_dir)
+    # only the var changes between most plots, so work out the rest of each name once
+    var_slot = "\0var\0"
+    stems = dict(((j, b, ht), plot_outname(root_dir, out_dir, var_slot, j, b, bins, qcd))
+                 for j, b in product(njet, btag) for ht, bins in ht_plots)
+    return [PlannedPlot(v, j, b, ht, bins, stems[(j, b, ht)].replace(var_slot, v))
+            for v, j, b in product(plot_vars, njet, btag) for ht, bins in ht_plots]
+
+
+def list_outputs(out_dir):
+    """
+    Set of (normalised) paths of all the files under out_dir
+    """
+    existing = set()
+    for dirpath, dirnames, filenames in os.walk(out_dir):
+        dirpath = os.path.normpath(dirpath)
+        existing.update(os.path.join(dirpath, f) for f in filenames)
+    return existing
+
+
+def missing_formats(outname, formats, existing):
+    """
+    Which of formats there isn't a file for. existing is from list_outputs(),
+    & outname should be normalised the same way (as from plan_plots()).
+    """
+    return [fmt for fmt in formats if "%s.%s" % (outname, fmt) not in existing]
+
+
+def missing_deps(outname, existing):
+    """
+    Whether there's no plot_deps sidecar for outname (e.g. it was made before
+    we had them), so --check_deps would remake it. Not the same as missing!
+    """
+    return deps_path(outname) not in existing
@@ -0,0 +1,668 @@
+"""
+The number crunching behind PredictionPlot: predict the BG in the signal
+region from data in control regions, data_control * MC_signal / MC_control,
+with stat + syst errors. No drawing in here - see Prediction_Plot.py for that.
+
+For inclusive HT, we do the prediction in each HT bin and sum together.
+PredictionEngine does each HT bin once per var/njet/btag, and keeps
+cumulative sums so any range of HT bins is cheap to get afterwards.
+
+The results can be saved to a file with save_results(), and loaded back
+with load_results(), so you can do the maths once (e.g. on the cluster)
+and then play with the plot styling without touching the inputs again.
+
+For big sweeps, add_to_graph() splits the prediction into task_dag nodes
+instead, so work that's shared between engines only gets done once.
+"""
+
+import os
+import json
+import zlib
+import logging
+import numpy as np
+import plot_grabber as grabr
+import profiling
+from np_hist import Hist, divide_arrays, multiply_arrays, rebin_map, rebin_last_axis
+from systematics import load_systematics, sb_corr_scales, tf_shift
+from file_utils import write_atomic
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+## FOR NORMAL HADRONIC PLOTS
+signal_proc = "Had"
+# # MC processes that go into transfer factors
+processes_mc_ctrl = ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']
+
+processes_mc_signal_le1b = {"OneMuon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'SingleTop'],
+                            "DiMuon": ['Zinv']}
+
+processes_mc_signal_ge2b = {"OneMuon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'SingleTop', 'Zinv'],
+                            "DiMuon": []}  # for >= 2btags dimu region not used
+
+# # Control regions to get data shapes (+ proper titles for legend etc)
+ctrl_regions = {"OneMuon": "Single #mu BG", "DiMuon": "#mu#mu BG", "QCD": "QCD BG (MC)"}
+
+## FOR DIMUON FROM PHOTON
+# signal_proc = "DiMuon"
+# # MC processes that go into transfer factors
+# processes_mc_ctrl = ['MC']
+
+# processes_mc_signal_le1b = {"Photon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']}
+
+# processes_mc_signal_ge2b = {"Photon": ['DY', 'DiBoson', 'TTbar', 'WJets', 'Zinv', 'SingleTop']}
+
+# # Control regions to get data shapes (+ proper titles for legend etc)
+# ctrl_regions = {"Photon": "#mu#mu BG from #gamma"}
+
+# Sytematics on TF are in systematics.json - see systematics.py
+
+def file_start(region):
+    """
+    Get the start of the input file name for a region, e.g. OneMuon -> Muon
+    """
+    if "Muon" in region:
+        return "Muon"
+    elif "Photon" in region:
+        return "Photon"
+    return "Had"
+
+
+def signal_processes(btag):
+    """
+    MC processes that go into the signal region for each control region
+    """
+    if "0" in btag or "1" in btag:
+        return processes_mc_signal_le1b
+    else:
+        return processes_mc_signal_ge2b
+
+
+def input_requests(ROOTdir, var, njet, btag, htbins, qcd=False):
+    """
+    Figure out every histogram a PredictionPlot needs to make its prediction.
+    Returns dict of file path : list of grab_plots-style requests
+    (sele, h_title, njet, btag, ht_bins), so that we can grab everything
+    from each file in one go.
+    """
+    requests = {}
+
+    def add(f_name, sele, ht_bins):
+        f_path = "%s/%s.root" % (ROOTdir, f_name)
+        requests.setdefault(f_path, []).append((sele, var, njet, btag, ht_bins))
+
+    sig_start = file_start(signal_proc)
+    processes = signal_processes(btag)
+    for ctrl in ctrl_regions:
+        if ctrl not in processes or not processes[ctrl]:
+            continue
+        ctrl_start = file_start(ctrl)
+        for ht in htbins:
+            add("%s_Data" % ctrl_start, ctrl, ht)
+            for p in processes[ctrl]:
+                add("%s_%s" % (sig_start, p), signal_proc, ht)
+            for p in processes_mc_ctrl:
+                add("%s_%s" % (ctrl_start, p), ctrl, ht)
+
+    if qcd:
+        for ht in htbins:
+            add("Had_QCD", signal_proc, ht)
+
+    for ht in htbins:
+        add("%s_Data" % sig_start, signal_proc, ht)
+    return requests
+
+
+def count_keys(requests):
+    """
+    Number of input histogram keys needed for requests (from input_requests())
+    """
+    return sum(len(grabr.request_keys(f_path, req)) for f_path, reqs in requests.iteritems() for req in reqs)
+
+
+def check_rebin(rebin, nbins):
+    """
+    Check a rebin factor divides nbins exactly. If not, warn & don't rebin.
+    A list of bin edges is always OK.
+    """
+    if hasattr(rebin, "__len__"):
+        return rebin
+    if (nbins % rebin != 0):
+        log.warning("WARNING: rebin factor not exact divisor of number of bins - not rebinning")
+        log.warning("Original: %d, Tried rebin factor: %d" % (nbins, rebin))
+        return 1
+    return rebin
+
+
+def rebin_hist(hist, rebin):
+    """
+    Rebin a histogram (TH1 or np_hist.Hist) either by combining rebin
+    bins together, or by asking for a specific binning (pass list as rebin arg)
+    """
+    is_np = isinstance(hist, Hist)
+    rebin = check_rebin(rebin, hist.nbins if is_np else hist.GetNbinsX())
+    if hasattr(rebin, "__len__"):
+        if is_np:
+            return hist.rebin(rebin)
+        return hist.Rebin(len(rebin)-1, hist.GetName(), rebin)
+    elif rebin != 1:
+        return hist.rebin(rebin) if is_np else hist.Rebin(int(rebin))
+    return hist
+
+
+def make_ht_string(htbins):
+    """
+    Make string out of HT bin(s)
+    """
+    # test if list or string
+    if hasattr(htbins, "__iter__"):
+        htstring = htbins[0].split("_")[0]
+        if (htbins[-1] != "1075"):
+            htstring += "_"+htbins[-1].split("_")[-1]
+        else:
+            # If doing inclusive, then want "_upwards"
+            # If just the 1075 - Inf bin, no "upwards"
+            if len(htbins) > 1:
+                htstring += "_upwards"
+    else:
+        htstring = htbins
+    return htstring
+
+
+class PredictionEngine():
+    """
+    Does the prediction for one var/njet/btag, for all control regions &
+    exclusive HT bins at once, as dense arrays. Any HT range (e.g.
+    375_upwards, or a single bin) is then just a sum over HT bins, done as
+    a cumulative sum from the top HT bin down, so inclusive & exclusive
+    plots can share one engine.
+
+    Arrays are shaped [2, control region, HT bin, (process,) x bin], where
+    the first axis is (sumw, sumw2), and x bins include under/overflow.
+    Control regions with fewer MC processes are padded with empty hists.
+    """
+
+    def __init__(self, ROOTdir, var, njet, btag, htbins, rebin, qcd=False, systematics=None, n_toys=0):
+        self.ROOTdir = ROOTdir
+        self.fineJetMulti = "fineJetMulti" in ROOTdir # whether fine Jet Multiplciity or not
+        self.var = var
+        self.njet = njet
+        self.btag = btag
+        self.htbins = list(htbins)  # exclusive HT bins, in ascending order
+        self.rebin = rebin
+        self.qcd = qcd  # whether to do QCD MC in signal region as well
+        self.systematics = systematics or load_systematics()  # see systematics.py
+        self.n_toys = n_toys  # if > 0, also get stat errors from this many toys
+        self.inputs = {}  # input hists, filled by fetch_inputs()
+        self.ctrls = []  # control regions we use, in order
+        self.regions = []  # regions we have predictions for, in order, QCD last
+        self.components = {}  # name : array [2, ctrl, HT bin, x bin], for component plots
+        # cumulative sums from the top HT bin down, arrays of [HT bin, x bin]
+        # region: (values, stat variances, stat+uncorrelated syst variances), & data: (values, variances)
+        self.cumulative = {}
+        # region: array [source, HT bin, x bin] of shifts from syst sources correlated across HT bins
+        self.cumulative_corr = {}
+        self.cumulative_data = None
+        # array [toy, region, HT bin, x bin] - per HT bin, not cumulative, as float32 differences
+        # of big cumulative sums would lose the small tail bins
+        self.toys = None
+        self.edges = None
+        self.computed = False
+        self.results_file = None  # set if loaded by load_results()
+
+    def fetch_inputs(self):
+        """
+        Grab all the input histograms (as np_hist.Hists), one pass per file
+        """
+        self.inputs = {}
+        requests = input_requests(self.ROOTdir, self.var, self.njet, self.btag, self.htbins, self.qcd)
+        for f_path, reqs in requests.iteritems():
+            for req, h in grabr.grab_hists(f_path, reqs).iteritems():
+                self.inputs[(f_path, req)] = h
+
+    def get_input(self, f_name, sele, ht_bins):
+        """
+        Get one of the histograms grabbed by fetch_inputs(), not rebinned
+        """
+        f_path = "%s/%s.root" % (self.ROOTdir, f_name)
+        req = grabr.request_key(sele, self.var, self.njet, self.btag, ht_bins)
+        return self.inputs[(f_path, req)]
+
+    def stack_inputs(self, shape, which):
+        """
+        Make a rebinned array [2, <shape>, x bin] of input hists.
+        which(index) gives (file name, selection, HT bin) for each index in
+        shape, or None to leave it empty. Raises ValueError if they're all
+        None, as then we don't even know the binning.
+        """
+        arr = None
+        for index in np.ndindex(*shape):
+            item = which(index)
+            if item is None:
+                continue
+            h = self.get_input(*item)
+            if arr is None:
+                edges = h.edges
+                arr = np.zeros((2,) + tuple(shape) + (len(h.values),))
+            arr[(0,) + index] = h.values
+            arr[(1,) + index] = h.variances
+        if arr is None:
+            raise ValueError("No input hists to stack for %s %s %s (shape %s) - nothing to predict from"
+                             % (self.var, self.njet, self.btag, tuple(shape)))
+        new_edges, idx = rebin_map(edges, check_rebin(self.rebin, len(edges) - 1))
+        return new_edges, rebin_last_axis(arr, idx, len(new_edges) + 1)
+
+    def control_regions(self):
+        """
+        Control regions that have MC processes to predict from, for this btag bin
+        """
+        processes = signal_processes(self.btag)
+        return [c for c in ctrl_regions if c in processes and processes[c]]
+
+    def compute(self):
+        """
+        Do the prediction for every control region & HT bin: get data in
+        control region, MC in signal & control regions (summed over SM processes),
+        then calculate transfer factor (MC_signal / MC_control), and scale
+        data_control by that factor. Then make the cumulative sums.
+        """
+        if self.computed:
+            return
+        with profiling.timed("fetch_inputs"):
+            self.fetch_inputs()
+        sig_start = file_start(signal_proc)
+        processes = signal_processes(self.btag)
+        # Check that there are actually processes to run over for each ctrl region...
+        self.ctrls = self.control_regions()
+        n_ctrl, n_ht = len(self.ctrls), len(self.htbins)
+        n_sig = max(len(processes[c]) for c in self.ctrls)
+
+        def data_control(i):
+            ctrl, ht = self.ctrls[i[0]], self.htbins[i[1]]
+            return "%s_Data" % file_start(ctrl), ctrl, ht
+
+        def mc_signal(i):
+            procs = processes[self.ctrls[i[0]]]
+            if i[2] >= len(procs):
+                return None
+            return "%s_%s" % (sig_start, procs[i[2]]), signal_proc, self.htbins[i[1]]
+
+        def mc_control(i):
+            ctrl = self.ctrls[i[0]]
+            return "%s_%s" % (file_start(ctrl), processes_mc_ctrl[i[2]]), ctrl, self.htbins[i[1]]
+
+        self.edges, data_ctrl = self.stack_inputs((n_ctrl, n_ht), data_control)
+        procs_mc_signal = self.stack_inputs((n_ctrl, n_ht, n_sig), mc_signal)[1]
+        procs_mc_control = self.stack_inputs((n_ctrl, n_ht, len(processes_mc_ctrl)), mc_control)[1]
+        hist_mc_signal, hist_mc_control = procs_mc_signal.sum(axis=3), procs_mc_control.sum(axis=3)
+        # sideband correction systs depend on the mix of processes, so need doing before we lose that
+        tf_shifts = {}
+        for source in self.systematics.sb_corr_sources():
+            scale_signal = np.ones((n_ctrl, 1, n_sig))
+            for i, ctrl in enumerate(self.ctrls):
+                scale_signal[i, 0, :len(processes[ctrl])] = sb_corr_scales(source.variation, processes[ctrl])
+            tf_shifts[source.name] = tf_shift(procs_mc_signal[0], procs_mc_control[0], scale_signal,
+                                              sb_corr_scales(source.variation, processes_mc_ctrl))
+        h_qcd = None
+        if self.qcd:
+            h_qcd = self.stack_inputs((n_ht,), lambda i: ("Had_QCD", signal_proc, self.htbins[i[0]]))[1]
+        data = self.stack_inputs((n_ht,), lambda i: ("%s_Data" % sig_start, signal_proc, self.htbins[i[0]]))[1]
+        self.inputs = {}  # done with these
+        with profiling.timed("predict"):
+            self.finish(data_ctrl, hist_mc_signal, hist_mc_control, h_qcd, data, tf_shifts=tf_shifts)
+
+    def finish(self, data_ctrl, hist_mc_signal, hist_mc_control, h_qcd, data, mc_ratio=None, scaled_data=None,
+               tf_shifts=None):
+        """
+        Rest of compute(), once we have the (rebinned) inputs as arrays
+        [2, ctrl, HT bin, x bin] (h_qcd & data: [2, HT bin, x bin]).
+        Does the transfer factors & scaling too, unless they're passed in.
+        tf_shifts: dict of sb_corr syst source name : array [ctrl, HT bin, x bin]
+        (see systematics.tf_shift())
+        """
+        if mc_ratio is None:
+            mc_ratio = np.array(divide_arrays(hist_mc_signal[0], hist_mc_signal[1],
+                                              hist_mc_control[0], hist_mc_control[1]))
+        if scaled_data is None:
+            scaled_data = np.array(multiply_arrays(data_ctrl[0], data_ctrl[1], mc_ratio[0], mc_ratio[1]))
+        if log.isEnabledFor(logging.DEBUG):
+            for i, ctrl in enumerate(self.ctrls):
+                log.debug("%s: data control %g, MC signal %g, MC control %g, estimate %g" %
+                          (ctrl, data_ctrl[0, i, :, 1:-1].sum(), hist_mc_signal[0, i, :, 1:-1].sum(),
+                           hist_mc_control[0, i, :, 1:-1].sum(), scaled_data[0, i, :, 1:-1].sum()))
+        self.components = {"data_control": data_ctrl,
+                           "hist_mc_signal": hist_mc_signal,
+                           "hist_mc_control": hist_mc_control,
+                           "mc_ratio": mc_ratio,
+                           "scaled_data": scaled_data}
+
+        # Add in QCD in signal region if desired
+        self.regions = self.ctrls[:]
+        prediction = scaled_data
+        if h_qcd is not None:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("QCD: %g" % h_qcd[0, :, 1:-1].sum())
+            prediction = np.concatenate([prediction, h_qcd[:, np.newaxis]], axis=1)
+            self.regions.append("QCD")
+
+        # systematics for each region & HT bin: uncorrelated ones go straight into the variances,
+        # correlated ones are kept as shifts, so they add up linearly when we sum HT bins
+        if tf_shifts:
+            tf_shifts = dict((name, shift[..., 1:-1]) for name, shift in tf_shifts.iteritems())
+        uncorr, corr = self.systematics.fractions(self.regions, self.njet, self.htbins, self.fineJetMulti, tf_shifts)
+        visible = prediction[0, ..., 1:-1]
+        var_syst = prediction[1].copy()
+        var_syst[..., 1:-1] += ((visible[np.newaxis] * uncorr) ** 2).sum(axis=0)
+        shifts = np.zeros((len(corr),) + prediction[0].shape)
+        shifts[..., 1:-1] = visible[np.newaxis] * corr
+
+        def suffix_sum(arr):
+            """sum of HT bins i onwards, for each i, with an extra row of 0s at the end"""
+            out = np.zeros(arr.shape[:-2] + (arr.shape[-2] + 1, arr.shape[-1]))
+            out[..., :-1, :] = np.cumsum(arr[..., ::-1, :], axis=-2)[..., ::-1, :]
+            return out
+
+        cum_values, cum_stat, cum_syst = suffix_sum(prediction[0]), suffix_sum(prediction[1]), suffix_sum(var_syst)
+        cum_corr = suffix_sum(shifts)
+        for i, region in enumerate(self.regions):
+            self.cumulative[region] = (cum_values[i], cum_stat[i], cum_syst[i])
+            self.cumulative_corr[region] = cum_corr[:, i]
+        self.cumulative_data = (suffix_sum(data[0]), suffix_sum(data[1]))
+        if self.n_toys:
+            self.toys = self.make_toys(data_ctrl, hist_mc_signal, hist_mc_control, h_qcd).astype(np.float32)
+        self.computed = True
+
+    def add_to_graph(self, graph):
+        """
+        Add the prediction to a task_dag.TaskGraph instead of doing compute():
+        fetch -> sum -> transfer factor -> prediction nodes for each control
+        region & HT bin, all feeding one node that gives a computed
+        PredictionEngine like this one. Returns that node's key.
+        Like fetch_inputs(), there's one fetch node per input file, grabbing
+        everything we need from it in one pass, which pick nodes split up.
+        Identical nodes (e.g. the same input for different plots) get shared.
+        """
+        sig_start = file_start(signal_proc)
+        processes = signal_processes(self.btag)
+        requests = input_requests(self.ROOTdir, self.var, self.njet, self.btag, self.htbins, self.qcd)
+        batches = dict((f_path, graph.add("fetch", fetch_file, [f_path, sorted(set(reqs))], main_thread=True))
+                       for f_path, reqs in requests.iteritems())
+
+        def fetch(f_name, sele, ht):
+            f_path = "%s/%s.root" % (self.ROOTdir, f_name)
+            return graph.add("pick", pick_input, [[sele, self.var, self.njet, self.btag, ht]], [batches[f_path]])
+
+        def summed(fetches):
+            return graph.add("sum", sum_inputs, [self.rebin], fetches)
+
+        sb_sources = self.systematics.sb_corr_sources()
+        parts = []
+        for ctrl in self.control_regions():
+            scales = [[sb_corr_scales(s.variation, processes[ctrl]) for s in sb_sources],
+                      [sb_corr_scales(s.variation, processes_mc_ctrl) for s in sb_sources]]
+            for ht in self.htbins:
+                sig_fetches = [fetch("%s_%s" % (sig_start, p), signal_proc, ht) for p in processes[ctrl]]
+                ctrl_fetches = [fetch("%s_%s" % (file_start(ctrl), p), ctrl, ht) for p in processes_mc_ctrl]
+                mc_sig, mc_ctrl = summed(sig_fetches), summed(ctrl_fetches)
+                data_ctrl = summed([fetch("%s_Data" % file_start(ctrl), ctrl, ht)])
+                tf = graph.add("transfer_factor", transfer_factor, [], [mc_sig, mc_ctrl])
+                parts += [data_ctrl, mc_sig, mc_ctrl, tf, graph.add("predict", predict, [], [data_ctrl, tf]),
+                          graph.add("sb_corr_shifts", sb_corr_shifts, [self.rebin, len(sig_fetches)] + scales,
+                                    sig_fetches + ctrl_fetches)]
+        if self.qcd:
+            parts += [summed([fetch("Had_QCD", signal_proc, ht)]) for ht in self.htbins]
+        parts += [summed([fetch("%s_Data" % sig_start, signal_proc, ht)]) for ht in self.htbins]
+        return graph.add("engine", engine_from_parts,
+                         [self.ROOTdir, self.var, self.njet, self.btag, self.htbins, self.rebin, self.qcd,
+                          self.n_toys, self.systematics.path, self.systematics.digest], parts)
+
+    def toy_seed(self):
+        """
+        Same random numbers every time for the same var/njet/btag
+        """
+        return zlib.crc32("%s|%s|%s" % (self.var, self.njet, self.btag)) & 0xffffffff
+
+    def make_toys(self, data_ctrl, mc_signal, mc_control, qcd=None):
+        """
+        Fluctuate the inputs n_toys times & redo the prediction for each, all in one go.
+        Data gets Poisson fluctuations, MC (weighted) gets Gaussian ones using
+        its sumw2, clipped at 0. Inputs are arrays [2, ctrl, HT bin, x bin]
+        (QCD: [2, HT bin, x bin]). Returns array [toy, region, HT bin, x bin].
+        """
+        rng = np.random.RandomState(self.toy_seed())
+
+        def gauss(arr):
+            toys = arr[0] + np.sqrt(arr[1]) * rng.standard_normal((self.n_toys,) + arr[0].shape)
+            return np.maximum(toys, 0.)
+
+        data_toys = rng.poisson(np.maximum(data_ctrl[0], 0.), (self.n_toys,) + data_ctrl[0].shape)
+        sig_toys, ctrl_toys = gauss(mc_signal), gauss(mc_control)
+        nonzero = ctrl_toys > 0
+        toys = data_toys * np.where(nonzero, sig_toys / np.where(nonzero, ctrl_toys, 1.), 0.)
+        if qcd is not None:
+            toys = np.concatenate([toys, gauss(qcd)[:, np.newaxis]], axis=1)
+        return toys
+
+    def toy_bands(self, htbins, cl=0.682689492):
+        """
+        Central interval containing cl of the toys, for the prediction summed
+        over htbins, cumulative over regions like the errors from results().
+        Returns list of (low, high) arrays, one per region.
+        """
+        self.compute()
+        if self.toys is None:
+            raise Exception("No toys - make the PredictionEngine with n_toys > 0")
+        lo, hi = self.ht_range(htbins)
+        toys = np.cumsum(self.toys[:, :, lo:hi].sum(axis=2, dtype=np.float64), axis=1)
+        q = 50. * (1. - cl)
+        low, high = np.percentile(toys, [q, 100. - q], axis=0)
+        return zip(low, high)
+
+    def intermediate_hists(self, htbins=None):
+        """
+        Yield ((ctrl, ht), dict of name : Hist) of the steps in the prediction
+        for each control region & HT bin (only those in htbins if set),
+        for component plots
+        """
+        self.compute()
+        for i, ctrl in enumerate(self.ctrls):
+            for j, ht in enumerate(self.htbins):
+                if htbins is not None and ht not in htbins:
+                    continue
+                yield (ctrl, ht), dict((name, Hist(self.edges, arr[0, i, j], arr[1, i, j], ctrl if name == "data_control" else name))
+                                       for name, arr in self.components.iteritems())
+
+    def ht_range(self, htbins):
+        """
+        Indices [lo, hi) in self.htbins for a list of contiguous HT bins
+        """
+        if isinstance(htbins, basestring):
+            htbins = [htbins]
+        lo = self.htbins.index(htbins[0])
+        hi = self.htbins.index(htbins[-1]) + 1
+        if self.htbins[lo:hi] != list(htbins):
+            raise ValueError("HT bins %s aren't a contiguous range of %s" % (htbins, self.htbins))
+        return lo, hi
+
+    def sum_range(self, cumulative, lo, hi):
+        """
+        Sum over HT bins [lo, hi) from cumulative sums (HT bins on 2nd last axis)
+        """
+        if hi == len(self.htbins):
+            return cumulative[..., lo, :]  # X_upwards, no subtraction needed
+        return cumulative[..., lo, :] - cumulative[..., hi, :]
+
+    def results(self, htbins):
+        """
+        Get the prediction summed over htbins. Returns:
+        - list of component Hists, one per region (QCD last)
+        - list of cumulative (over regions) stat error Hists
+        - list of cumulative (over regions) stat+syst error Hists
+        - Hist of data in signal region
+        """
+        self.compute()
+        lo, hi = self.ht_range(htbins)
+        components, errors_stat, errors_stat_syst = [], [], []
+        for region in self.regions:
+            values, var_stat, var_syst = [self.sum_range(c, lo, hi) for c in self.cumulative[region]]
+            var_syst = var_syst + (self.sum_range(self.cumulative_corr[region], lo, hi) ** 2).sum(axis=0)
+            components.append(Hist(self.edges, values, var_stat, region))
+            stat = Hist(self.edges, values, var_stat, region)
+            syst = Hist(self.edges, values, var_syst, region)
+            if errors_stat:
+                stat.add(errors_stat[-1])
+                syst.add(errors_stat_syst[-1])
+            errors_stat.append(stat)
+            errors_stat_syst.append(syst)
+        data = Hist(self.edges, *[self.sum_range(c, lo, hi) for c in self.cumulative_data], name="Data")
+        return components, errors_stat, errors_stat_syst, data
+
+
+def fetch_file(f_path, reqs):
+    """
+    DAG node: all the input Hists we need from one file, in one pass.
+    Returns dict of request_key : Hist
+    """
+    return grabr.grab_hists(f_path, [grabr.request_key(*req) for req in reqs])
+
+
+def pick_input(req, hists):
+    """
+    DAG node: one input Hist out of a fetch_file() node
+    """
+    return hists[grabr.request_key(*req)]
+
+
+def sum_inputs(rebin, *hists):
+    """
+    DAG node: sum of input Hists, rebinned. Returns (edges, array [2, x bin])
+    """
+    edges = hists[0].edges
+    arr = np.array([[h.values for h in hists], [h.variances for h in hists]]).sum(axis=1)
+    new_edges, idx = rebin_map(edges, check_rebin(rebin, len(edges) - 1))
+    return new_edges, rebin_last_axis(arr, idx, len(new_edges) + 1)
+
+
+def transfer_factor(mc_signal, mc_control):
+    """
+    DAG node: MC_signal / MC_control, from sum_inputs() nodes. Returns array [2, x bin]
+    """
+    (edges, sig), (_, ctrl) = mc_signal, mc_control
+    return np.array(divide_arrays(sig[0], sig[1], ctrl[0], ctrl[1]))
+
+
+def predict(data_control, tf):
+    """
+    DAG node: data in control region scaled by transfer factor. Returns array [2, x bin]
+    """
+    data = data_control[1]
+    return np.array(multiply_arrays(data[0], data[1], tf[0], tf[1]))
+
+
+def sb_corr_shifts(rebin, n_signal, scales_signal, scales_control, *hists):
+    """
+    DAG node: fractional change in the transfer factor for each sb_corr syst
+    source, from the MC signal (the first n_signal) & MC control input Hists.
+    scales_*: [source, process] from systematics.sb_corr_scales().
+    Returns array [source, x bin]
+    """
+    edges = hists[0].edges
+    new_edges, idx = rebin_map(edges, check_rebin(rebin, len(edges) - 1))
+    procs = rebin_last_axis(np.array([h.values for h in hists]), idx, len(new_edges) + 1)  # [process, x bin]
+    shifts = [tf_shift(procs[:n_signal], procs[n_signal:], np.array(sig), np.array(ctrl))
+              for sig, ctrl in zip(scales_signal, scales_control)]
+    return np.array(shifts).reshape((len(shifts), len(new_edges) + 1))
+
+
+def engine_from_parts(ROOTdir, var, njet, btag, htbins, rebin, qcd, n_toys, syst_config, syst_digest, *parts):
+    """
+    DAG node: a computed PredictionEngine, from the nodes made by PredictionEngine.add_to_graph()
+    """
+    engine = PredictionEngine(ROOTdir, var, njet, btag, htbins, rebin, qcd, load_systematics(syst_config), n_toys)
+    if engine.systematics.digest != syst_digest:
+        raise Exception("Systematics config has changed since the graph was made")
+    engine.ctrls = engine.control_regions()
+    n_ctrl, n_ht = len(engine.ctrls), len(htbins)
+    per_bin, rest = parts[:6 * n_ctrl * n_ht], parts[6 * n_ctrl * n_ht:]
+    engine.edges = per_bin[0][0]
+
+    def stack(i, has_edges=True):
+        """[2, ctrl, HT bin, x bin] array of the i-th part for each ctrl & HT bin"""
+        arrs = [p[1] if has_edges else p for p in per_bin[i::6]]
+        return np.array(arrs).reshape((n_ctrl, n_ht) + arrs[0].shape).transpose(2, 0, 1, 3)
+
+    def stack_ht(ps):
+        return np.array([p[1] for p in ps]).transpose(1, 0, 2)
+
+    h_qcd = stack_ht(rest[:n_ht]) if qcd else None
+    data = stack_ht(rest[-n_ht:])
+    # sb_corr shifts: [source, ctrl, HT bin, x bin]
+    shifts = stack(5, False)
+    tf_shifts = dict((s.name, shifts[i]) for i, s in enumerate(engine.systematics.sb_corr_sources()))
+    engine.finish(stack(0), stack(1), stack(2), h_qcd, data, mc_ratio=stack(3, False), scaled_data=stack(4, False),
+                  tf_shifts=tf_shifts)
+    return engine
+
+
+def save_results(f_path, engines):
+    """
+    Save the results of a bunch of PredictionEngines to one .npz file,
+    so we can make plots from them later without the input files - see load_results().
+    Computes them first if needed.
+    """
+    arrays = {}
+    meta = []
+    for engine in engines:
+        engine.compute()
+        prefix = "%s|%s|%s|" % (engine.var, engine.njet, engine.btag)
+        meta.append({"ROOTdir": engine.ROOTdir, "var": engine.var, "njet": engine.njet, "btag": engine.btag,
+                     "htbins": engine.htbins, "rebin": engine.rebin, "qcd": engine.qcd,
+                     "n_toys": engine.n_toys, "ctrls": engine.ctrls, "regions": engine.regions, "syst_version": engine.systematics.version})
+        arrays[prefix + "edges"] = engine.edges
+        for i, name in enumerate(["values", "stat", "syst"]):
+            arrays[prefix + "cumulative_" + name] = np.array([engine.cumulative[reg][i] for reg in engine.regions])
+        arrays[prefix + "cumulative_corr"] = np.array([engine.cumulative_corr[reg] for reg in engine.regions])
+        arrays[prefix + "cumulative_data"] = np.array(engine.cumulative_data)
+        if engine.toys is not None:
+            arrays[prefix + "toys"] = engine.toys
+        for name, arr in engine.components.iteritems():
+            arrays[prefix + "component_" + name] = arr
+    arrays["meta"] = np.array(json.dumps(meta, default=lambda o: o.tolist()))  # rebin can be an array of edges
+    # write to temp file & move into place, so no-one ever reads half a file
+    write_atomic(f_path, lambda f: np.savez_compressed(f, **arrays), "wb")
+    log.info("Saved results for %d var/njet/btag to %s" % (len(meta), f_path))
+
+
+def load_results(f_path):
+    """
+    Load results saved by save_results(). Returns dict of
+    (var, njet, btag) : PredictionEngine, ready to give results()
+    """
+    engines = {}
+    with open(f_path, "rb") as f:
+        arrs = np.load(f)
+        for m in json.loads(str(arrs["meta"])):
+            # json gives us unicode, ROOT wants str
+            engine = PredictionEngine(str(m["ROOTdir"]), str(m["var"]), str(m["njet"]), str(m["btag"]),
+                                      [str(h) for h in m["htbins"]], m["rebin"], m["qcd"], n_toys=m.get("n_toys", 0))
+            prefix = "%s|%s|%s|" % (engine.var, engine.njet, engine.btag)
+            engine.ctrls = [str(c) for c in m["ctrls"]]
+            engine.regions = [str(reg) for reg in m["regions"]]
+            engine.edges = arrs[prefix + "edges"]
+            cumulative = [arrs[prefix + "cumulative_" + name] for name in ["values", "stat", "syst"]]
+            cumulative_corr = arrs[prefix + "cumulative_corr"]
+            for i, region in enumerate(engine.regions):
+                engine.cumulative[region] = tuple(c[i] for c in cumulative)
+                engine.cumulative_corr[region] = cumulative_corr[i]
+            engine.cumulative_data = tuple(arrs[prefix + "cumulative_data"])
+            if engine.n_toys:
+                engine.toys = arrs[prefix + "toys"]
+            for key in arrs.files:
+                if key.startswith(prefix + "component_"):
+                    engine.components[key[len(prefix + "component_"):]] = arrs[key]
+            engine.computed = True
+            engine.results_file = f_path
+            engines[(engine.var, engine.njet, engine.btag)] = engine
+    return engines
@@ -0,0 +1,183 @@
+"""
+Opt-in timers & counters, to see where a sweep spends its time
+(opening files, reading keys, the maths, drawing, saving...).
+
+Off unless you run shape_plots.py --profile report.json (or call enable()).
+When off, timed() hands back the same do-nothing context manager & count()
+returns straight away, so leaving them in hot loops costs nothing measurable.
+
+    with profiling.timed("file_open"):
+        f = r.TFile.Open(f_path)
+    profiling.count("keys_read", len(names))
+
+Everything is added up per task (see start_task(), e.g. one var/njet/btag)
+& for the whole sweep. write_report() saves it all as JSON, print_summary()
+prints a table. Stats from other processes (e.g. task_pool workers) can be
+added in with add_task().
+"""
+
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+enabled = False
+
+_lock = threading.Lock()  # timers can run in task_dag threads
+_current = "(none)"  # name of the task we're in
+_tasks = {}  # task name : {"timers": {name : [calls, seconds]}, "counters": {name : total}}
+
+
+def new_stats():
+    return {"timers": defaultdict(lambda: [0, 0.]), "counters": defaultdict(int)}
+
+
+class _NoTimer():
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+class _Timer():
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        add_time(self.name, time.time() - self.start)
+
+
+def _task_stats(task):
+    if task not in _tasks:
+        _tasks[task] = new_stats()
+    return _tasks[task]
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    global _current
+    _tasks.clear()
+    _current = "(none)"
+
+
+def start_task(task):
+    """
+    Add everything from now on to task (string, or tuple of strings)
+    """
+    global _current
+    if enabled:
+        _current = task if isinstance(task, basestring) else " ".join(task)
+
+
+def timed(name):
+    """
+    Context manager to time a stage
+    """
+    if not enabled:
+        return _no_timer
+    return _Timer(name)
+
+
+def add_time(name, seconds):
+    """
+    Add a time you've measured yourself to timer name
+    """
+    if not enabled:
+        return
+    with _lock:
+        stats = _task_stats(_current)["timers"][name]
+        stats[0] += 1
+        stats[1] += seconds
+
+
+def count(name, n=1):
+    """
+    Add n to counter name
+    """
+    if not enabled:
+        return
+    with _lock:
+        _task_stats(_current)["counters"][name] += n
+
+
+def task_stats(task):
+    """
+    Stats for one task, as plain dicts (e.g. to send back from a worker process)
+    """
+    task = task if isinstance(task, basestring) else " ".join(task)
+    stats = _tasks.get(task, new_stats())
+    return {"timers": dict(stats["timers"]), "counters": dict(stats["counters"])}
+
+
+def add_task(task, stats):
+    """
+    Add in stats (from task_stats(), e.g. in another process) for task
+    """
+    task = task if isinstance(task, basestring) else " ".join(task)
+    with _lock:
+        mine = _task_stats(task)
+        for name, (calls, seconds) in stats["timers"].iteritems():
+            mine["timers"][name][0] += calls
+            mine["timers"][name][1] += seconds
+        for name, n in stats["counters"].iteritems():
+            mine["counters"][name] += n
+
+
+def totals():
+    """
+    Stats added up over all tasks
+    """
+    total = new_stats()
+    for stats in _tasks.itervalues():
+        for name, (calls, seconds) in stats["timers"].iteritems():
+            total["timers"][name][0] += calls
+            total["timers"][name][1] += seconds
+        for name, n in stats["counters"].iteritems():
+            total["counters"][name] += n
+    return total
+
+
+def report():
+    def plain(stats):
+        return {"timers": dict((k, {"calls": c, "seconds": s}) for k, (c, s) in stats["timers"].iteritems()),
+                "counters": dict(stats["counters"])}
+    return {"sweep": plain(totals()), "tasks": dict((t, plain(s)) for t, s in _tasks.iteritems())}
+
+
+def write_report(f_path):
+    with open(f_path, "w") as f:
+        json.dump(report(), f, indent=1, sort_keys=True)
+    print "Written profile to", f_path
+
+
+def print_summary(n_slowest=5):
+    """
+    Table of the timers (slowest first) & counters for the whole sweep,
+    and the slowest tasks
+    """
+    total = totals()
+    print "%-24s %8s %10s %10s" % ("stage", "calls", "total s", "ms/call")
+    for name, (calls, seconds) in sorted(total["timers"].iteritems(), key=lambda x: -x[1][1]):
+        print "%-24s %8d %10.2f %10.2f" % (name, calls, seconds, 1000. * seconds / max(calls, 1))
+    for name, n in sorted(total["counters"].iteritems()):
+        print "%-24s %8d" % (name, n)
+    # nested timers overlap, so take the biggest one as the time for a task
+    task_times = [(max([s for c, s in stats["timers"].itervalues()] or [0.]), t) for t, stats in _tasks.iteritems()]
+    if len(task_times) > 1:
+        print "Slowest tasks:"
+        for seconds, task in sorted(task_times, reverse=True)[:n_slowest]:
+            print "  %-40s %8.2f s" % (task, seconds)
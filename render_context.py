@@ -0,0 +1,127 @@
+"""
+Holds all the ROOT drawing objects for PredictionPlot: one canvas, its
+upper (main) & lower (ratio) pads, legend, text boxes and ratio line.
+
+Making a new TCanvas/TPads/etc for every plot is slow, and looking them
+up by name with gROOT.FindObject means different plots end up sharing
+(and deleting) each others' objects - which is where the segfaults come from.
+Instead, make one RenderContext per process (see default_context()) and
+reset() it between plots, so each object gets made exactly once.
+
+The exception is the THStack: it caches the binning of its frame histogram
+the first time it's drawn, so we make a new one in reset(). The old one
+goes away with the last plot that used it.
+"""
+
+import ROOT as r
+
+
+r.PyConfig.IgnoreCommandLineOptions = True
+r.gROOT.SetBatch(1)
+
+
+def make_legend():
+    """
+    Generate blank legend
+    """
+    leg = r.TLegend(0.7, 0.49, 0.88, 0.72)
+    # leg.SetFillColorAlpha(r.kWhite, 0.5)
+    leg.SetFillColor(0)
+    leg.SetFillStyle(0)
+    # leg.SetCornerRadius(0.5)
+    leg.SetLineColor(0)
+    leg.SetLineStyle(0)
+    leg.SetLineWidth(0)
+    # leg.SetLineColorAlpha(0, 0)
+    return leg
+
+
+def make_standard_text():
+    """
+    Generate standard boring text
+    """
+    t = r.TPaveText(0.66, 0.73, 0.87, 0.87, "NDC")
+    t.AddText("CMS 2012, #sqrt{s} = 8 TeV")
+    t.AddText("")
+    t.AddText("#int L dt = 18.493 fb^{-1}")
+    t.SetFillColor(0)
+    t.SetFillStyle(0)
+    t.SetLineColor(0)
+    t.SetLineStyle(0)
+    t.SetLineWidth(0)
+    return t
+
+
+def make_bin_text():
+    """
+    Generate blank box for label of which bin - fill it with set_bin_text()
+    """
+    t = r.TPaveText(0.1, 0.91, 0.9, 0.95, "NDC NB")
+    t.SetFillColor(0)
+    t.SetFillStyle(0)
+    t.SetLineColor(0)
+    t.SetLineStyle(0)
+    t.SetLineWidth(0)
+    return t
+
+
+class RenderContext():
+    """
+    Canvas, pads & style objects, reused for every plot
+    """
+
+    def __init__(self, width=1200, height=1000):
+        self.canvas = r.TCanvas("c", "", width, height)
+        self.canvas.cd()  # this seems important to avoid segfaults
+        self.up = r.TPad("u", "", 0.01, 0.25, 0.99, 0.99)
+        self.dp = r.TPad("d", "", 0.01, 0.01, 0.99, 0.25)
+        self.dp.SetBottomMargin(1.3 * self.dp.GetBottomMargin())
+        self.leg = make_legend()
+        self.stdtxt = make_standard_text()
+        self.cuttxt = make_bin_text()
+        self.line = r.TLine(0, 1, 1, 1)  # y = 1 line on ratio plot
+        self.line.SetLineWidth(2)
+        self.line.SetLineStyle(2)
+        self.stack = None
+        self.component_canvas = None  # for PredictionPlot.plot_component(), only made if needed
+
+    def reset(self, bin_text=""):
+        """
+        Get ready for a new plot: clear the canvas, pads & legend,
+        put bin_text in the bin label, and make a fresh THStack.
+        """
+        for pad in [self.up, self.dp]:
+            pad.Clear()
+            pad.SetLogy(0)
+        self.canvas.Clear()
+        self.canvas.cd()
+        self.leg.Clear()
+        self.set_bin_text(bin_text)
+        self.stack = r.THStack("shape_stack", "")
+
+    def set_bin_text(self, text):
+        self.cuttxt.Clear()
+        tt = self.cuttxt.AddText(text)
+        tt.SetTextAlign(12)
+
+    def get_component_canvas(self):
+        """
+        Separate canvas for single hists
+        """
+        if not self.component_canvas:
+            self.component_canvas = r.TCanvas("cc", "")
+        self.component_canvas.Clear()
+        return self.component_canvas
+
+
+_default_context = None
+
+
+def default_context():
+    """
+    The RenderContext for this process - made the first time you ask
+    """
+    global _default_context
+    if not _default_context:
+        _default_context = RenderContext()
+    return _default_context
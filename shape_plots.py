@@ -9,7 +9,7 @@ By default, it runs over all variables, btag bins, njet bins, for inclusive HT
 
 To setup for a new set of plots:
 
-1) make sure n_j/n_j_fine, n_b include the bins you want
+1) make sure n_j/n_j_fine, n_b (in analysis_bins.py) include the bins you want
 2) setup ROOTdir, out_dir, HTbins, title, plot_vars, rebin values.
 For each set of plots, we add another list (with those vars) to the Big List.
 Make sure you select the correct entry.
@@ -19,6 +19,29 @@ Make sure you select the correct entry.
 Note that you can optionally run over inclusive or exclusive HT bins,
 over specfic vars and specfic bins, using the command-line options.
 
+To do the (slow) predictions once and restyle the plots afterwards:
+
+python shape_plots.py --compute-only results.npz
+python shape_plots.py --render-from results.npz
+
+(use the same var/njet/btag/HT options for both)
+
+Plots only get remade if their inputs or settings have changed since last
+time (see plot_deps.py) - use --force to remake them anyway. --check lists
+the ones that are missing (quickly, without ROOT - see plot_plan.py), and
+--check_deps the ones that need remaking & why. --plan lists every plot a
+sweep would make.
+
+Each finished plot is recorded in <out_dir>/.sweep (see sweep_manifest.py),
+so if a sweep gets interrupted, rerun it with --resume to carry on.
+
+--dag THREADS plans everything as one graph of fetch -> sum -> transfer
+factor -> prediction -> render steps (see task_dag.py), so steps shared by
+several plots only get done once.
+
+--profile report.json times each stage (opening files, reading keys, the
+maths, drawing, saving) per var/njet/btag, & prints a summary (see profiling.py).
+
 TODO: better structure for holding vars, rebin factors, log status etc,
 stop with the global vars,
 
@@ -27,35 +50,37 @@ Robin Aggleton
 """
 
 import argparse
-import ROOT as r
+import json
+import socket
+import time
 import plot_grabber as grabr
 from itertools import product, izip
 import math
 import numpy as np
 import os
 import array
-from Prediction_Plot import PredictionPlot
+from prediction_engine import (save_results, load_results, count_keys, make_ht_string,
+                               input_requests, PredictionEngine)
+import plot_export
+import systematics
 import sys
 import make_component_pres as pres
+import key_manifest
+import hist_cache
+import plot_deps
+import task_pool
+import task_dag
+import sweep_manifest
+import plot_plan
+import profiling
+from file_utils import check_dir_exists
 
-r.PyConfig.IgnoreCommandLineOptions = True
-r.TH1.SetDefaultSumw2(r.kFALSE)
-r.gStyle.SetOptStat(0)
-r.gROOT.SetBatch(1)
-r.gStyle.SetOptFit(1111)
-# r.TH1.AddDirectory(r.kFALSE)
+# ROOT & the drawing code get imported the first time we make a plot - see setup_root()
+# (so --check & --plan, or just doing predictions from NumPy stores, don't need ROOT)
+PredictionPlot = None
 
-###############################################
-# Define region bins - inclusive and exclusive
-###############################################
-allHTbins = ["200_275", "275_325", "325_375", "375_475", "475_575",
-          "575_675", "675_775", "775_875", "875_975", "975_1075", "1075"]# "200_upwards", "375_upwards"][:]
-
-n_j = ["le3j", "ge4j", "ge2j"][:]
-n_j_fine = ["eq2j", "eq3j", "eq4j", "ge5j"][:] # fine jet binning
-# n_b = ["eq0b", "eq1b", "eq2b", "eq3b", "ge0b", "ge1b", "ge2b", "ge3b", "ge4b"][:]
-# n_b = ["eq0b", "eq1b", "eq2b", "eq3b", "ge0b", "ge1b", "ge2b", "ge4b"][:]
-n_b = ["eq0b", "eq1b", "eq2b", "ge1b", "ge2b", "ge0b"][:]
+# region bins - inclusive and exclusive (in their own module, so closure_tests.py etc. can share them)
+from analysis_bins import allHTbins, n_j, n_j_fine, n_b
 
 
 ###############################################
@@ -93,6 +118,13 @@ rebin_default = {"Number_Btags": 1, "JetMultiplicity": 1, "MHTovMET": 1,
 
 log_these = ["AlphaT", "ComMinBiasDPhi_acceptedJets", "ComMinBiasDPhi","HT", "LeadJetPt", "SecondJetPt", "EffectiveMass"]
 
+# sweep_manifest.SweepManifest of finished plots, set in main() - see --resume
+sweep = None
+# if set (e.g. by plot_daemon.py): dict to keep PredictionEngines in between runs,
+# & list to add the outname of every plot made/checked to
+engine_cache = None
+made_outputs = None
+
 
 ###############################################
 # input files, output directories, which HTbins to run over,
@@ -162,45 +194,147 @@ ROOTdir, out_dir, HTbins, title, plot_vars, rebin_d = [
 ][-1] # SELECT YOUR SAMPLE
 
 
-def do_a_plot_HT_incl(root_dir, out_dir, var="ComMinBiasDPhi_acceptedJets", njet="eq3j", btag="eq0b", check=False, custom_title="#alpha_{T} > 0.55", qcd=False):
-    """Inclusive HT plot"""
+def setup_root():
+    """Import ROOT & PredictionPlot, & set the global styles, if we haven't already"""
+    global PredictionPlot
+    if PredictionPlot is None:
+        r = grabr.need_root()
+        r.TH1.SetDefaultSumw2(r.kFALSE)
+        r.gStyle.SetOptStat(0)
+        r.gROOT.SetBatch(1)
+        r.gStyle.SetOptFit(1111)
+        # r.TH1.AddDirectory(r.kFALSE)
+        from Prediction_Plot import PredictionPlot as plot_class
+        PredictionPlot = plot_class
+
+
+def plot_status(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine, components=False):
+    """Figure out whether a plot needs making (see plot_deps), without drawing anything.
+    Returns (outname, deps, reason it needs making or None if up to date)"""
+    if not engine:
+        engine = PredictionEngine(root_dir, var, njet, btag, htbins, rebin, qcd)
+    outname = plot_plan.plot_outname(root_dir, out_dir, var, njet, btag, htbins, qcd)
+    if not engine.results_file and grabr.key_manifest is None:
+        grabr.key_manifest = key_manifest.build_manifest(root_dir)
+    deps = plot_deps.plot_deps(engine, htbins, {"log": log, "title": custom_title, "components": components},
+                               grabr.key_manifest)
+    return outname, deps, plot_deps.why_stale(outname, deps, plot_export.default_exporter().formats)
+
+
+def record_timing(timings_dir, task, seconds, n_keys, n_plots):
+    """Append how long a var/njet/btag took (& how much memory we're using)
+    to a file in timings_dir, for condor_planner.py. One file per host &
+    process, so that jobs running at the same time don't trip over each other."""
+    check_dir_exists(timings_dir)
+    f_path = os.path.join(timings_dir, "%s_%d.jsonl" % (socket.gethostname(), os.getpid()))
+    with open(f_path, "a") as f:
+        f.write(json.dumps({"task": list(task), "seconds": seconds, "rss_mb": task_pool.current_rss_mb(),
+                            "keys": n_keys, "plots": n_plots}) + "\n")
+
+
+def get_rebin(var):
+    """Rebin value for a variable"""
+    return rebin_d[var] if var in rebin_d else (rebin_default[var] if var in rebin_default else 2)
+
+
+def already_done(var, njet, btag, htbins):
+    """Whether this plot got finished in an earlier go at this sweep (with --resume)"""
+    return sweep is not None and sweep.is_done((var, njet, btag, make_ht_string(htbins)))
+
+
+def plot_finished(var, njet, btag, htbins, outname):
+    """Note a plot that's been saved, or was up to date already, for --resume
+    & made_outputs. Only call it once all the files really exist."""
+    if sweep is not None:
+        sweep.record((var, njet, btag, make_ht_string(htbins)), outname)
+    if made_outputs is not None:
+        made_outputs.append(outname)
+
+
+def make_plot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine, components=False, force=False):
+    """Make & save one PredictionPlot, unless it's up to date (& not force),
+    or done already (with --resume). Returns whether it got made."""
+    if already_done(var, njet, btag, htbins):
+        print "Done already:", var, njet, btag, make_ht_string(htbins)
+        return False
+    outname, deps, reason = plot_status(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine, components)
+    made = bool(reason or force)
+    if made:
+        print "Making %s (%s)" % (outname, reason or "forced")
+        setup_root()
+        plot = PredictionPlot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine)
+        plot.plot_components = components
+        plot.make_plots()
+
+        # only once the PNG etc. are really there, or a crash part-way
+        # would leave a plot that looks up to date / done
+        def saved():
+            plot_deps.write_deps(outname, deps)
+            plot_finished(var, njet, btag, htbins, outname)
+
+        plot.save(on_done=saved)
+    else:
+        print "Up to date:", outname
+        plot_finished(var, njet, btag, htbins, outname)
+    return made
 
-    rebin = rebin_d[var] if var in rebin_d else (rebin_default[var] if var in rebin_default else 2)
-    log = True if var in log_these else False
-    htbins_incl = ["200_upwards", "375_upwards", "775_upwards"][:]
-    for ht in htbins_incl:
+
+def render_plot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, components, engine):
+    """make_plot() for a task_dag render node, which gets the engine last.
+    We've already checked it needs making."""
+    make_plot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine, components, force=True)
+
+
+def incl_ht_plots():
+    """(name, list of HT bins) for each inclusive HT plot"""
+    plots = []
+    for ht in ["200_upwards", "375_upwards", "775_upwards"]:
         # hack - assume we don't have 200_upwards or similar
         # in that case we just pass a list of ht bins that are equivalent
         lower = ht.split("_")[0]
         # Only do this inclusive bin if the user had the range in their HTbins list
         if sum([x.startswith(lower) for x in HTbins]):
-            print ht
-            htbins = [h for h in HTbins if int(h.split("_")[0]) >= int(lower)]
-            plot = PredictionPlot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd)
-            if check:
-                if not os.path.isfile(plot.outname+".png"):
-                    print "python shape_plots.py -v %s -j %s -b %s" % (var, njet, btag)
-            else:
-                plot.make_plots()
-                plot.save()
-
-
-def do_a_plot_HT_excl(root_dir, out_dir, var="AlphaT", njet="le3j", btag="eq0b", htbins=HTbins, check=False, custom_title="#alpha_{T} > 0.55", qcd=False):
-    """exclusive HT bins - do one by one"""
-
-    htbins = [h for h in htbins if "upwards" not in h] # filter out inclusive ones
-    for ht in htbins:
-        rebin = rebin_d[var] if var in rebin_d else (rebin_default[var] if var in rebin_default else 2)
-        log = True if var in log_these else False
-        plot = PredictionPlot(root_dir, out_dir, var, njet, btag, [ht], rebin, log, custom_title, qcd)
+            plots.append((ht, [h for h in HTbins if int(h.split("_")[0]) >= int(lower)]))
+    return plots
+
+
+def excl_ht_plots(htbins):
+    """(name, list of HT bins) for each exclusive HT plot"""
+    return [(ht, [ht]) for ht in htbins if "upwards" not in ht] # filter out inclusive ones
+
+
+def do_a_plot_HT_incl(root_dir, out_dir, var="ComMinBiasDPhi_acceptedJets", njet="eq3j", btag="eq0b", check=False, custom_title="#alpha_{T} > 0.55", qcd=False, engine=None, force=False):
+    """Inclusive HT plot. Pass in a PredictionEngine to share the per-HT bin predictions with other plots.
+    Plots that are up to date don't get remade, unless force."""
+
+    rebin = get_rebin(var)
+    log = True if var in log_these else False
+    for ht, htbins in incl_ht_plots():
+        print ht
+        if check:
+            outname, deps, reason = plot_status(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine)
+            if reason:
+                print "python shape_plots.py -v %s -j %s -b %s  # %s" % (var, njet, btag, reason)
+        else:
+            make_plot(root_dir, out_dir, var, njet, btag, htbins, rebin, log, custom_title, qcd, engine, force=force)
+
+
+def do_a_plot_HT_excl(root_dir, out_dir, var="AlphaT", njet="le3j", btag="eq0b", htbins=HTbins, check=False, custom_title="#alpha_{T} > 0.55", qcd=False, engine=None, components=False, force=False):
+    """exclusive HT bins - do one by one. Pass in a PredictionEngine to share the per-HT bin predictions with other plots.
+    components: also plot all the steps of the prediction
+    Plots that are up to date don't get remade, unless force."""
+
+    rebin = get_rebin(var)
+    log = True if var in log_these else False
+    for ht, bins in excl_ht_plots(htbins):
         if check:
-            if not os.path.isfile(plot.outname+".png"):
-                print "python shape_plots.py -v %s -j %s -b %s --ht %s" % (var, njet, btag, ht)
+            outname, deps, reason = plot_status(root_dir, out_dir, var, njet, btag, bins, rebin, log, custom_title, qcd, engine, components)
+            if reason:
+                print "python shape_plots.py -v %s -j %s -b %s --ht %s  # %s" % (var, njet, btag, ht, reason)
         else:
-            plot.plot_components = True
-            plot.make_plots()
-            plot.save()
+            make_plot(root_dir, out_dir, var, njet, btag, bins, rebin, log, custom_title, qcd, engine, components, force)
     # optionally can do component presentation as well for this var
+    # (use the results_file arg to make any component plots that aren't there)
     # lo = HTbins[0].split("_")[0]
     # hi = HTbins[-1].split("_")[1] if "_" in HTbins[-1] else "Inf"
     # print "Make component pres"
@@ -217,13 +351,51 @@ def main(in_args=sys.argv[1:]):
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--exclusive_HT", help="if you want plots done in for all HT bins indivudally rather than for inclusive HT", action='store_true', default=False)
+    parser.add_argument("--all_HT", help="do both exclusive and inclusive HT plots, in one go", action='store_true', default=False)
     parser.add_argument("-v", "--var", help="variable to plot (if undefined, runs over all)", nargs="+")
     parser.add_argument("-j", "--njet", help="number of jets (if undefined, runs over all)", nargs="+")
     parser.add_argument("-b", "--btag", help="number of btags (if undefined, runs over all)", nargs="+")
     parser.add_argument("--ht", help="specify HT bin(s) (if undefined, runs over all inclusive)", nargs="+")
-    parser.add_argument("-c", "--check", help="don't make plots, just check they exist. prints list of those that don't so you can run them again.", action='store_true', default=False)
+    parser.add_argument("-c", "--check", help="don't make plots, just check they exist (quick, doesn't need ROOT). prints list of those that don't so you can run them again.", action='store_true', default=False)
+    parser.add_argument("--check_deps", help="like --check, but also check the plots are up to date with their inputs & settings (slower)", action='store_true', default=False)
+    parser.add_argument("--plan", help="don't make plots, just list all the plots this would make & whether they exist", action='store_true', default=False)
+    parser.add_argument("--force", help="remake plots even if they're up to date", action='store_true', default=False)
+    parser.add_argument("--resume", help="skip plots already finished by an earlier (interrupted) go at the same sweep", action='store_true', default=False)
+    parser.add_argument("--components", help="for exclusive HT bins, also plot all the steps of the prediction (data control, MC signal/control, ratio, scaled data)", action='store_true', default=False)
+    parser.add_argument("--toys", help="get stat error bands from this many toys, rather than error propagation", type=int, default=0)
     parser.add_argument("--qcd", help="Add in QCD to main plot, but ignore in ratio plot.", action='store_true', default=False)
+    parser.add_argument("--no_preflight", help="don't check all the input histograms exist before starting", action='store_true', default=False)
+    parser.add_argument("--cache_dir", help="where to keep scaled input hists between runs", default=".hist_cache")
+    parser.add_argument("--no_cache", help="don't use the cache of scaled input hists", action='store_true', default=False)
+    parser.add_argument("--compute-only", help="don't make plots, just do the predictions & save them to this file", metavar="RESULTS_FILE")
+    parser.add_argument("--render-from", help="make plots from predictions saved with --compute-only, instead of the input files", metavar="RESULTS_FILE")
+    parser.add_argument("--formats", help="output formats for plots", nargs="+", default=plot_export.DEFAULT_FORMATS)
+    parser.add_argument("--export_workers", help="number of background threads for making PNGs", type=int, default=2)
+    parser.add_argument("--syst_config", help="systematics config file (default: %(default)s)", default=systematics.DEFAULT_CONFIG)
+    parser.add_argument("--jobs", help="make plots in this many worker processes", type=int, default=1)
+    parser.add_argument("--dag", help="plan all the work as one graph, so shared steps only get done once, & run it with this many threads", type=int, metavar="THREADS")
+    parser.add_argument("--max_plots_per_worker", help="with --jobs, start a fresh worker process after this many plots", type=int, default=50)
+    parser.add_argument("--max_worker_mb", help="with --jobs, start a fresh worker process once one uses this much memory (MB)", type=float)
+    parser.add_argument("--retries", help="with --jobs, how many times to retry a plot whose worker crashed", type=int, default=1)
+    parser.add_argument("--timings", help="record how long each var/njet/btag takes in this dir, for condor_planner.py")
+    parser.add_argument("--profile", help="time each stage (file opens, reading, maths, drawing, saving...) & save a report to this JSON file", metavar="REPORT")
+    parser.add_argument("--max_open_files", help="max number of input ROOT files to keep open at once", type=int, default=grabr.MAX_OPEN_FILES)
     args = parser.parse_args(in_args)
+    if args.compute_only and args.render_from:
+        parser.error("Can't use --compute-only and --render-from together")
+    if args.dag and args.render_from:
+        parser.error("--dag doesn't do anything with --render-from")
+
+    # set every module global we use from args, every time, so nothing sticks
+    # from one run to the next in the same process (e.g. plot_daemon.py)
+    global sweep
+    sweep = None  # set below for modes that make plots
+    grabr.file_pool.set_max_open(args.max_open_files)
+    grabr.key_manifest = None  # made by preflight() or plot_status() if needed
+    grabr.scaled_cache = None  # set below, unless --no_cache
+    profiling.enable(bool(args.profile))
+    if args.profile:
+        profiling.reset()
 
     # Figure out which vars/njet/btags options to run over
     # Do the set intersection to validate input (silently tho, tut tut)
@@ -248,7 +420,9 @@ def main(in_args=sys.argv[1:]):
     print "njet:", run_njet
     print "btag:", run_btag
     print "ht:", run_ht
-    if args.exclusive_HT:
+    if args.all_HT:
+        print "Doing exclusive HT bins and inclusive HT"
+    elif args.exclusive_HT:
         print "Doing exclusive HT bins"
     else:
         print "Doing inclusive HT"
@@ -257,26 +431,338 @@ def main(in_args=sys.argv[1:]):
     if not run_vars or not run_njet or not run_btag or not run_ht:
         raise RuntimeError("One of var/njet/btag/ht lists is empty - check your spelling!")
 
-    if args.check:
-        print "Not making plots, checking they exist..."
+    if args.check or args.plan:
+        # quick, so don't bother setting up anything else
+        check_plans(ROOTdir, out_dir, run_vars, run_njet, run_btag, run_ht, exclusive_HT=args.exclusive_HT or args.all_HT,
+                    inclusive_HT=True if args.all_HT else None, qcd=args.qcd, formats=args.formats, list_all=args.plan)
+        return
+
+    exporter = plot_export.configure(formats=args.formats, n_workers=args.export_workers)
+    if not args.no_cache:
+        grabr.scaled_cache = hist_cache.HistCache(args.cache_dir, version=grabr.SCALE_VERSION)
+    if not args.check_deps and not args.compute_only:
+        # nothing that depends on where we are, as condor jobs restart in a new dir,
+        # & everything that changes how every plot looks, so --resume doesn't keep stale ones
+        settings = {"inputs": os.path.basename(os.path.normpath(ROOTdir)), "title": title, "qcd": args.qcd,
+                    "toys": args.toys, "components": args.components, "formats": args.formats,
+                    "render_from": os.path.basename(args.render_from) if args.render_from else None,
+                    "systematics": systematics.load_systematics(args.syst_config).digest,
+                    "rebin": [rebin_d, rebin_default], "log": sorted(log_these), "deps_version": plot_deps.DEPS_VERSION}
+        sweep = sweep_manifest.SweepManifest(os.path.join(out_dir, ".sweep"), settings, resume=args.resume)
+
+    if args.check_deps:
+        print "Not making plots, checking they exist & are up to date..."
         print "Please re-run using the following commands:"
         print "(If there's no commands, you're good to go!)"
+    elif args.render_from:
+        print "Making lots of data VS bg plots from", args.render_from
     else:
-        print "Making lots of data VS bg plots from", ROOTdir
+        if args.compute_only:
+            print "Doing predictions from", ROOTdir, "and saving to", args.compute_only
+        else:
+            print "Making lots of data VS bg plots from", ROOTdir
+        if not args.no_preflight:
+            preflight(root_dir=ROOTdir, plot_vars=run_vars, njet=run_njet, btag=run_btag, htbins=run_ht, qcd=args.qcd)
 
     # actually do something
-    run_over(root_dir=ROOTdir, out_dir=out_dir, plot_vars=run_vars, njet=run_njet, btag=run_btag, htbins=run_ht, exclusive_HT=args.exclusive_HT, check=args.check, custom_title=title, qcd=args.qcd)
+    opts = dict(root_dir=ROOTdir, out_dir=out_dir, plot_vars=run_vars, njet=run_njet, btag=run_btag, htbins=run_ht,
+                exclusive_HT=args.exclusive_HT or args.all_HT, check=args.check_deps, custom_title=title, qcd=args.qcd,
+                inclusive_HT=True if args.all_HT else None, compute_only=args.compute_only, render_from=args.render_from,
+                components=args.components, n_toys=args.toys, force=args.force, syst_config=args.syst_config)
+    if args.dag and not args.check_deps:
+        dag_opts = dict((k, w) for k, w in opts.iteritems() if k not in ["check", "render_from"])
+        failed = run_dag(args.dag, **dag_opts)
+        if failed:
+            raise RuntimeError("%d tasks failed - see above" % len(failed))
+    elif args.jobs > 1 and not args.check_deps:
+        failed = run_parallel(args.jobs, args.formats, args.export_workers, max_plots_per_worker=args.max_plots_per_worker,
+                              max_worker_mb=args.max_worker_mb, retries=args.retries, **opts)
+        if failed:
+            raise RuntimeError("%d tasks failed - see above" % len(failed))
+    else:
+        run_over(timings=args.timings, **opts)
+    saved_ok = not exporter.close()
+    if args.profile:
+        profiling.print_summary()
+        profiling.write_report(args.profile)
+        profiling.enable(False)
+    if not saved_ok:
+        raise RuntimeError("Some plots didn't get saved properly - see above")
+
+
+def check_plans(root_dir, out_dir, plot_vars, njet, btag, htbins, exclusive_HT=False, inclusive_HT=None, qcd=False,
+                formats=plot_export.DEFAULT_FORMATS, list_all=False):
+    """
+    Quick --check: work out every plot that'd get made (see plot_plan), & list
+    out_dir once to see which are missing, without ROOT or reading any inputs.
+    Prints commands to make the missing ones, or if list_all (--plan), every
+    plot & whether it's there. Plots without a .deps file aren't missing,
+    but get counted separately, as --check_deps would remake them.
+    Returns the number missing.
+    """
+    if inclusive_HT is None:
+        inclusive_HT = not exclusive_HT
+    ht_plots = excl_ht_plots(htbins) if exclusive_HT else []
+    if inclusive_HT:
+        ht_plots += incl_ht_plots()
+    plans = plot_plan.plan_plots(root_dir, out_dir, plot_vars, njet, btag, ht_plots, qcd)
+    existing = plot_plan.list_outputs(out_dir)
+    if not list_all:
+        print "Not making plots, checking they exist..."
+        print "Please re-run using the following commands:"
+        print "(If there's no commands, you're good to go!)"
+    n_missing, n_no_deps = 0, 0
+    for p in plans:
+        missing = plot_plan.missing_formats(p.outname, formats, existing)
+        no_deps = not missing and plot_plan.missing_deps(p.outname, existing)
+        if missing:
+            n_missing += 1
+        if no_deps:
+            n_no_deps += 1
+        if list_all:
+            print "%-8s %s" % ("missing" if missing else ("no deps" if no_deps else "ok"), p.outname)
+        elif missing:
+            ht_opt = "" if "upwards" in p.ht else " --ht %s" % p.ht
+            print "python shape_plots.py -v %s -j %s -b %s%s  # no %s" % (p.var, p.njet, p.btag, ht_opt, ", ".join(missing))
+    print "%d plots, %d missing" % (len(plans), n_missing)
+    if n_no_deps:
+        print "%d of the rest have no .deps file, so --check_deps would remake them" % n_no_deps
+    return n_missing
+
+
+def preflight(root_dir, plot_vars, njet, btag, htbins, qcd=False):
+    """
+    Check that every input histogram needed for all the var/njet/btag/HT combinations
+    exists, before making any plots. Also makes plot_grabber use the manifest for lookups.
+    """
+    manifest = key_manifest.build_manifest(root_dir)
+    grabr.key_manifest = manifest
+    missing = set()
+    for v, j, b in product(plot_vars, njet, btag):
+        missing.update(manifest.missing(input_requests(root_dir, v, j, b, htbins, qcd)))
+    if missing:
+        for f_path, key in sorted(missing)[:20]:
+            print "Missing:", f_path, key if key else "(whole file)"
+        raise RuntimeError("%d input histograms missing - not making any plots" % len(missing))
+    print "All inputs present & correct"
 
 
-def run_over(root_dir, out_dir, plot_vars=plot_vars, njet=n_j, btag=n_b, htbins=allHTbins, exclusive_HT=False, check=False, custom_title="#alpha_{T} > 0.55", qcd=False):
+def get_engine(root_dir, v, j, b, htbins, exclusive_HT, inclusive_HT, qcd=False, n_toys=0, results=None, render_from=None,
+               syst_config=None):
+    """
+    PredictionEngine for one var/njet/btag, either to do the prediction for
+    all the HT bins needed (with the systematics from syst_config, default
+    systematics.DEFAULT_CONFIG), or from results loaded from the render_from file
+    """
+    if results is not None:
+        if (v, j, b) not in results:
+            raise RuntimeError("No results for %s %s %s in %s" % (v, j, b, render_from))
+        engine = results[(v, j, b)]
+        if engine.qcd != qcd:
+            raise RuntimeError("%s was made with%s --qcd" % (render_from, "" if engine.qcd else "out"))
+        return engine
+    # engine needs all the bins the exclusive plots use, plus all of HTbins for inclusive
+    engine_bins = [h for h in HTbins if h in htbins] if exclusive_HT else []
+    if inclusive_HT:
+        engine_bins = HTbins[:]
+    systs = systematics.load_systematics(syst_config)
+    if engine_cache is None:
+        return PredictionEngine(root_dir, v, j, b, engine_bins, get_rebin(v), qcd, systs, n_toys)
+    key = (os.path.abspath(root_dir), v, j, b, tuple(engine_bins), repr(get_rebin(v)), qcd, n_toys, systs.digest)
+    if key not in engine_cache:
+        engine_cache[key] = PredictionEngine(root_dir, v, j, b, engine_bins, get_rebin(v), qcd, systs, n_toys)
+    return engine_cache[key]
+
+
+def run_over(root_dir, out_dir, plot_vars=plot_vars, njet=n_j, btag=n_b, htbins=allHTbins, exclusive_HT=False, check=False, custom_title="#alpha_{T} > 0.55", qcd=False, inclusive_HT=None, compute_only=None, render_from=None, components=False, n_toys=0, force=False, timings=None, syst_config=None):
     """
     Method to run over all vars/njet/btag/HT bins
+
+    One PredictionEngine per var/njet/btag does the prediction for each
+    exclusive HT bin once, then all the plots (exclusive & inclusive) use it.
+    By default you get inclusive HT plots, or exclusive if exclusive_HT.
+    Set inclusive_HT as well to get both.
+
+    compute_only: don't make plots, just save the predictions to this file.
+    render_from: make plots using predictions from this file, instead of the inputs.
+    components: plot all the steps of the prediction as well, for exclusive HT bins.
+    n_toys: if > 0, get the stat error bands from this many toys.
+    force: remake plots even if they're up to date (see plot_deps).
+    timings: dir to record how long each var/njet/btag took, for condor_planner.py
+    syst_config: systematics config file (default: systematics.DEFAULT_CONFIG)
+    """
+    if inclusive_HT is None:
+        inclusive_HT = not exclusive_HT
+    results = load_results(render_from) if render_from else None
+    engines = {}
+    for v, j, b in product(plot_vars, njet, btag):
+        start = time.time()
+        profiling.start_task((v, j, b))
+        engine = get_engine(root_dir, v, j, b, htbins, exclusive_HT, inclusive_HT, qcd, n_toys, results, render_from,
+                            syst_config)
+        if compute_only:
+            if not check:
+                engine.compute()
+                engines[(v, j, b)] = engine
+        else:
+            if exclusive_HT:
+                do_a_plot_HT_excl(root_dir=root_dir, out_dir=out_dir, var=v, njet=j, btag=b, htbins=htbins, check=check, custom_title=title, qcd=qcd, engine=engine, components=components, force=force)
+            if inclusive_HT:
+                do_a_plot_HT_incl(root_dir=root_dir, out_dir=out_dir, var=v, njet=j, btag=b, check=check, custom_title=title, qcd=qcd, engine=engine, force=force)
+        if timings and not check:
+            n_plots = (len(excl_ht_plots(htbins)) if exclusive_HT else 0) + (len(incl_ht_plots()) if inclusive_HT else 0)
+            n_keys = count_keys(input_requests(root_dir, v, j, b, engine.htbins, qcd))
+            record_timing(timings, (v, j, b), time.time() - start, n_keys, n_plots)
+        profiling.add_time("task", time.time() - start)
+    if compute_only and not check:
+        save_results(compute_only, engines.values())
+
+
+def run_parallel(n_jobs, formats, export_workers, root_dir, out_dir, plot_vars=plot_vars, njet=n_j, btag=n_b, htbins=allHTbins,
+                 exclusive_HT=False, check=False, custom_title="#alpha_{T} > 0.55", qcd=False, inclusive_HT=None,
+                 compute_only=None, render_from=None, components=False, n_toys=0, force=False, syst_config=None,
+                 max_plots_per_worker=50, max_worker_mb=None, retries=1):
+    """
+    Like run_over, but the plots get made by n_jobs long-lived worker processes
+    (see task_pool), so each has its own ROOT & a segfault only loses that worker.
+    Each var/njet/btag/HT plot is a task - crashed ones get retried in a fresh
+    worker, & workers get replaced after max_plots_per_worker plots or when
+    using more than max_worker_mb of memory.
+
+    Workers keep the PredictionEngine for their last var/njet/btag, & get
+    given plots for the same one where possible, so the prediction is
+    (mostly) only done once.
+
+    Prints whether each task worked, & returns a list of (task, reason)
+    for the ones that didn't. For compute_only, each task is a var/njet/btag
+    & saves its own results file, which get merged at the end.
     """
+    if inclusive_HT is None:
+        inclusive_HT = not exclusive_HT
+    cache = {}  # per worker: results file & last engine
+
+    def get_cached_engine(v, j, b):
+        if render_from and "results" not in cache:
+            cache["results"] = load_results(render_from)
+        if cache.get("key") != (v, j, b):
+            cache["engine"] = get_engine(root_dir, v, j, b, htbins, exclusive_HT, inclusive_HT, qcd, n_toys,
+                                         cache.get("results"), render_from, syst_config)
+            cache["key"] = (v, j, b)
+        return cache["engine"]
+
+    def start_worker():
+        # the parent's exporter threads don't exist in here, so need our own
+        plot_export.configure(formats=formats, n_workers=export_workers, close_old=False)
+
+    def work(v, j, b, ht, bins, part_file):
+        # send this task's profile back with the result (just None if we're not profiling)
+        task = (v, j, b) if part_file else (v, j, b, ht)
+        profiling.reset()
+        profiling.start_task(task)
+        start = time.time()
+        engine = get_cached_engine(v, j, b)
+        if part_file:
+            save_results(part_file, [engine])
+        else:
+            exporter = plot_export.default_exporter()
+            n_failed = len(exporter.failed)
+            make_plot(root_dir, out_dir, v, j, b, bins, get_rebin(v), v in log_these, custom_title, qcd, engine,
+                      components and ht in htbins, force)
+            exporter.wait()
+            if len(exporter.failed) > n_failed:
+                raise RuntimeError("Failed to save %s" % "; ".join("%s (%s)" % f for f in exporter.failed[n_failed:]))
+        profiling.add_time("task", time.time() - start)
+        return profiling.task_stats(task) if profiling.enabled else None
+
+    tasks = []
     for v, j, b in product(plot_vars, njet, btag):
-        if exclusive_HT:
-            do_a_plot_HT_excl(root_dir=root_dir, out_dir=out_dir, var=v, njet=j, btag=b, htbins=htbins, check=check, custom_title=title, qcd=qcd)
+        if compute_only:
+            part_file = "%s.%s_%s_%s.part" % (compute_only, v, j, b)
+            tasks.append(((v, j, b), (v, j, b, None, None, part_file)))
+            continue
+        plots = excl_ht_plots(htbins) if exclusive_HT else []
+        if inclusive_HT:
+            plots += incl_ht_plots()
+        for ht, bins in plots:
+            tasks.append(((v, j, b, ht), (v, j, b, ht, bins, None)))
+
+    print "Running %d tasks in %d processes" % (len(tasks), n_jobs)
+    supervisor = task_pool.Supervisor(work, n_jobs, initializer=start_worker, max_tasks=max_plots_per_worker,
+                                      max_rss_mb=max_worker_mb, max_retries=retries, group=lambda key: key[:3])
+    n_ok = 0
+    failed = []
+    for task, ok, result in supervisor.run(tasks):
+        if ok:
+            print "OK:", " ".join(task)
+            n_ok += 1
+            if result:
+                profiling.add_task(task, result)
         else:
-            do_a_plot_HT_incl(root_dir=root_dir, out_dir=out_dir, var=v, njet=j, btag=b, check=check, custom_title=title, qcd=qcd)
+            print "FAILED: %s: %s" % (" ".join(task), result.strip().splitlines()[-1])
+            failed.append((task, result))
+    for task, error in failed:
+        print "\n*** %s:\n%s" % (" ".join(task), error)
+    print "%d tasks OK, %d failed, used %d worker processes" % (n_ok, len(failed), supervisor.n_started)
+
+    if compute_only:
+        engines = []
+        for key, args in tasks:
+            part_file = args[-1]
+            if os.path.exists(part_file):
+                engines.extend(load_results(part_file).values())
+                os.remove(part_file)
+        save_results(compute_only, engines)
+    return failed
+
+def run_dag(n_threads, root_dir, out_dir, plot_vars=plot_vars, njet=n_j, btag=n_b, htbins=allHTbins, exclusive_HT=False,
+            custom_title="#alpha_{T} > 0.55", qcd=False, inclusive_HT=None, compute_only=None, components=False,
+            n_toys=0, force=False, syst_config=None):
+    """
+    Like run_over, but all the work goes into one task_dag.TaskGraph first
+    (fetch -> sum -> transfer factor -> prediction -> render), so anything
+    shared between plots only gets done once, & independent steps run
+    in n_threads threads (reading inputs & drawing stay in this thread).
+    Only predictions needed for plots that aren't up to date get done.
+    Returns list of (task, reason) for plots that failed.
+    """
+    if inclusive_HT is None:
+        inclusive_HT = not exclusive_HT
+    profiling.start_task("dag")  # steps for different plots are all mixed up
+    graph = task_dag.TaskGraph()
+    engines, renders = {}, {}
+    for v, j, b in product(plot_vars, njet, btag):
+        engine = get_engine(root_dir, v, j, b, htbins, exclusive_HT, inclusive_HT, qcd, n_toys, syst_config=syst_config)
+        if compute_only:
+            engines[(v, j, b)] = engine.add_to_graph(graph)
+            continue
+        plots = excl_ht_plots(htbins) if exclusive_HT else []
+        if inclusive_HT:
+            plots += incl_ht_plots()
+        for ht, bins in plots:
+            comps = components and ht in htbins
+            if already_done(v, j, b, bins):
+                print "Done already:", v, j, b, ht
+                continue
+            outname, deps, reason = plot_status(root_dir, out_dir, v, j, b, bins, get_rebin(v), v in log_these, custom_title, qcd, engine, comps)
+            if not reason and not force:
+                print "Up to date:", outname
+                plot_finished(v, j, b, bins, outname)
+                continue
+            renders[(v, j, b, ht)] = graph.add("render", render_plot,
+                                               [root_dir, out_dir, v, j, b, bins, get_rebin(v), v in log_these,
+                                                custom_title, qcd, comps],
+                                               [engine.add_to_graph(graph)], main_thread=True)
+
+    targets = engines.values() + renders.values()
+    results = graph.run(targets, n_threads=n_threads, keep_going=True)
+    print graph.summary()
+    failed = [(task, graph.failed[key]) for task, key in renders.iteritems() if key in graph.failed]
+    failed += [(task, graph.failed[key]) for task, key in engines.iteritems() if key in graph.failed]
+    for task, error in failed:
+        print "\n*** %s:\n%s" % (" ".join(task), error)
+    if compute_only:
+        save_results(compute_only, [results[key] for key in engines.itervalues() if key in results])
+    return failed
 
 
 if __name__ == "__main__":
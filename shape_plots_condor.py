@@ -11,12 +11,24 @@ shape_plots.py locally, e.g. --qcd --exclusive_HT
 
 This script essentially just maps a number into a variable, and sets the correct ROOTdir
 and out_dir in shape_plots.
+
+Or, with shards from condor_planner.py (see shape_plots_shards.condor):
+
+--shards shards.json $(shard) <myrootfiles> <myoutdir> --other_args_here
+
+runs all the var/njet/btag in that shard, and records how long each took
+in <myoutdir>/timings, for planning next time. It resumes from where it
+got to if the job was evicted (see sweep_manifest.py).
 """
 
+import os
 import argparse
+import traceback
 import shape_plots as plotr
+import condor_planner
 
 parser = argparse.ArgumentParser()
+parser.add_argument("--shards", help="shards file from condor_planner.py - if set, varID is the shard number")
 parser.add_argument("varID", type=int, help="ID number to specify variable")
 parser.add_argument("input", help="dir for intput root files")
 parser.add_argument("output", help="output dir")
@@ -26,8 +38,22 @@ print args
 
 plotr.ROOTdir = args.input
 plotr.out_dir = args.output
-var = plotr.plot_vars[args.varID:args.varID + 1]  # add the varaible to the args passes to shape_plots
-args.other.append("-v")
-args.other.append(var[0])
-print args.other
-plotr.main(args.other)
\ No newline at end of file
+if args.shards:
+    failed = []
+    # if we got evicted, carry on from where we were
+    extra = ["--timings", os.path.join(args.output, "timings"), "--resume"]
+    for v, j, b in condor_planner.load_shard(args.shards, args.varID):
+        print "Doing", v, j, b
+        try:
+            plotr.main(args.other + extra + ["-v", v, "-j", j, "-b", b])
+        except Exception:
+            traceback.print_exc()
+            failed.append((v, j, b))
+    if failed:
+        raise RuntimeError("Failed: %s" % failed)
+else:
+    var = plotr.plot_vars[args.varID:args.varID + 1]  # add the varaible to the args passes to shape_plots
+    args.other.append("-v")
+    args.other.append(var[0])
+    print args.other
+    plotr.main(args.other)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Record of which plots in a sweep are finished, so an interrupted sweep
+(crash, Ctrl-C, evicted condor job) can carry on where it left off with
+shape_plots.py --resume, rather than starting again.
+
+Each process appends one JSON line per finished plot to its own file in
+<out_dir>/.sweep/ (named by host & pid, so parallel workers & condor jobs
+never write to the same file). Each line is written with a single
+O_APPEND write & fsync'd, so a crash can only ever lose the line being
+written, never corrupt earlier ones.
+
+Entries are tagged with a sweep id - a hash of the settings that affect
+every plot (input dir name, binning, title, QCD, ...) - and only entries
+for the current sweep id count as done. The settings mustn't depend on
+where the sweep runs (e.g. no absolute paths), or an evicted condor job
+restarting in a new dir, or merged shards, won't match up.
+
+To combine the records from several shards/jobs into one manifest.jsonl:
+
+python sweep_manifest.py merge <out_dir>/.sweep [other_shard_out_dir/.sweep ...]
+
+(the first dir is where the merged manifest goes)
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import hashlib
+import logging
+import argparse
+from file_utils import check_dir_exists, write_atomic
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MERGED_NAME = "manifest.jsonl"
+
+
+def sweep_id(settings):
+    """
+    Hash of the settings for a sweep (dict)
+    """
+    # numpy arrays (e.g. rebin edges) go in as lists
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=lambda o: o.tolist())).hexdigest()[:16]
+
+
+def read_entries(manifest_dir):
+    """
+    All the entries in all the files in manifest_dir
+    """
+    entries = []
+    for f_path in sorted(glob.glob(os.path.join(manifest_dir, "*.jsonl"))):
+        with open(f_path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:  # the line being written when we crashed
+                    log.warning("Ignoring bad line in %s" % f_path)
+    return entries
+
+
+class SweepManifest():
+    """
+    Which tasks (tuples of strings) are done for one sweep, stored in manifest_dir.
+    If resume, is_done() says whether a task is already done,
+    otherwise it's always False (so everything gets redone).
+    """
+
+    def __init__(self, manifest_dir, settings, resume=False):
+        self.manifest_dir = manifest_dir
+        self.sweep_id = sweep_id(settings)
+        self.resume = resume
+        self.done = set()
+        if os.path.isdir(manifest_dir):
+            self.done = set(tuple(e["task"]) for e in read_entries(manifest_dir) if e["sweep"] == self.sweep_id)
+        if resume:
+            log.info("%d tasks already done in %s" % (len(self.done), manifest_dir))
+
+    def is_done(self, task):
+        return self.resume and tuple(task) in self.done
+
+    def record(self, task, output=""):
+        """
+        Mark task as done, with the output it made
+        """
+        check_dir_exists(self.manifest_dir)
+        # per process, so forked workers get their own
+        f_path = os.path.join(self.manifest_dir, "%s_%d.jsonl" % (socket.gethostname(), os.getpid()))
+        line = json.dumps({"sweep": self.sweep_id, "task": list(task), "output": output, "time": time.time()}) + "\n"
+        fd = os.open(f_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.done.add(tuple(task))
+
+
+def merge(manifest_dirs):
+    """
+    Combine all the entries in manifest_dirs into one manifest.jsonl in the
+    first one (latest entry for each sweep & task), & remove the per-process files
+    """
+    latest = {}
+    for d in manifest_dirs:
+        for e in read_entries(d):
+            key = (e["sweep"], tuple(e["task"]))
+            if key not in latest or e["time"] > latest[key]["time"]:
+                latest[key] = e
+    merged_path = os.path.join(manifest_dirs[0], MERGED_NAME)
+    write_atomic(merged_path, lambda f: f.writelines(json.dumps(latest[key]) + "\n" for key in sorted(latest)))
+    # now it's safe to remove the ones that went in
+    for d in manifest_dirs:
+        for f_path in glob.glob(os.path.join(d, "*.jsonl")):
+            if os.path.abspath(f_path) != os.path.abspath(merged_path):
+                os.remove(f_path)
+    print "Merged %d entries into %s" % (len(latest), merged_path)
+    return merged_path
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["merge", "list"])
+    parser.add_argument("dirs", nargs="+", help="manifest dirs (<out_dir>/.sweep)")
+    args = parser.parse_args(in_args)
+    if args.mode == "merge":
+        merge(args.dirs)
+    else:
+        for d in args.dirs:
+            for e in read_entries(d):
+                print e["sweep"], " ".join(e["task"]), e["output"]
+
+
+if __name__ == "__main__":
+    main()
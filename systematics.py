@@ -0,0 +1,206 @@
+"""
+Systematic uncertainties on the prediction, from a config file
+(systematics.json by default).
+
+Each named source gives a fractional uncertainty (in %) on the prediction
+for each njet & HT bin. For each source you can say:
+
+- correlated_ht: if true, the uncertainty is fully correlated across HT bins,
+  so when summing HT bins the shifts add linearly rather than in quadrature
+- fine_jet: whether it applies for fine jet multiplicity as well
+  (the closure test systs don't)
+- regions: which regions it applies to (e.g. ["OneMuon"]), default all
+- default: % to use for any njet/HT bin not in values
+- enabled: set to false to keep a source in the config but not use it
+
+Instead of values, a source can be derived from the scale factors that
+plot_grabber applies to the MC, by varying each one's correction
+(its difference from 1) up by the fraction "variation":
+
+- "derived": "trig_eff": trigger efficiencies. The TF goes as
+  eff(Had) / eff(control region), & the two triggers are independent,
+  so their variations get added in quadrature. Per region, njet & HT bin.
+- "derived": "sb_corr": sideband corrections, all processes varied
+  together. How much that changes MC_signal / MC_control depends on the
+  mix of processes, so this one is per x bin, & the PredictionEngine
+  works it out from the MC (see tf_shift()) & passes it in as tf_shifts.
+
+These two are in systematics.json, but disabled - set "variation" to what
+the analysis decides & "enabled" to true to use them.
+
+Different sources are always added in quadrature. The config has a version
+number - bump CONFIG_VERSION & the file if you change the format.
+
+    systs = load_systematics()
+    uncorr, corr = systs.fractions(["OneMuon", "DiMuon"], "le3j", htbins)
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import plot_grabber as grabr
+
+
+CONFIG_VERSION = 2
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "systematics.json")
+
+
+class SystSource():
+    """
+    One named source of systematic uncertainty
+    """
+
+    def __init__(self, name, cfg):
+        self.name = name
+        self.values = cfg.get("values", {})  # njet : {HT bin : %}
+        self.default = cfg.get("default", 0)
+        self.correlated_ht = cfg.get("correlated_ht", False)
+        self.fine_jet = cfg.get("fine_jet", False)
+        self.regions = cfg.get("regions", None)
+        self.description = cfg.get("description", "")
+        self.derived = cfg.get("derived", None)  # None (use values), "trig_eff" or "sb_corr"
+        self.variation = cfg.get("variation")  # for derived ones
+        self.enabled = cfg.get("enabled", True)
+        if self.derived not in [None, "trig_eff", "sb_corr"]:
+            raise Exception("Don't know how to derive systematic %s from %s" % (name, self.derived))
+        if self.derived and self.enabled and self.variation is None:
+            raise Exception("Systematic %s is derived from %s, so needs a variation" % (name, self.derived))
+
+    def fractions(self, regions, njet, htbins, fine_jet=False, tf_shifts=None):
+        """
+        Array [region, HT bin, x bin] of fractional uncertainties
+        (x bin is just 1 long, except for sb_corr ones)
+        """
+        if fine_jet and not self.fine_jet:
+            return np.zeros((len(regions), len(htbins), 1))
+        if self.derived == "trig_eff":
+            fracs = trig_eff_fractions(self.variation, regions, njet, htbins, fine_jet)
+        elif self.derived == "sb_corr":
+            # from the engine, for the control regions (QCD is last & doesn't have a TF)
+            shifts = (tf_shifts or {}).get(self.name)
+            if shifts is None:
+                return np.zeros((len(regions), len(htbins), 1))
+            fracs = np.zeros((len(regions),) + shifts.shape[1:])
+            fracs[:len(shifts)] = shifts
+            return fracs * self.applies(regions)[:, np.newaxis, np.newaxis]
+        else:
+            table = self.values.get(njet, {})
+            per_ht = np.array([table.get(ht, self.default) for ht in htbins], dtype=np.float64) / 100.
+            fracs = np.tile(per_ht, (len(regions), 1))
+        return (fracs * self.applies(regions)[:, np.newaxis])[..., np.newaxis]
+
+    def applies(self, regions):
+        return np.array([self.regions is None or reg in self.regions for reg in regions], dtype=np.float64)
+
+
+class Systematics():
+    """
+    All the sources from a config
+    """
+
+    def __init__(self, config):
+        if config.get("version") != CONFIG_VERSION:
+            raise Exception("Systematics config version %s, but I only understand version %d" %
+                            (config.get("version"), CONFIG_VERSION))
+        self.version = config["version"]
+        self.path = None  # file it came from, set by load_systematics()
+        self.digest = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()  # to tell if it's changed
+        sources = [SystSource(name, cfg) for name, cfg in sorted(config["sources"].iteritems())]
+        self.sources = [s for s in sources if s.enabled]
+
+    def fractions(self, regions, njet, htbins, fine_jet=False, tf_shifts=None):
+        """
+        Get fractional uncertainties for each region & HT bin, as
+        (uncorrelated, correlated) arrays [source, region, HT bin, x bin].
+        The x bin axis is 1 long unless there are sb_corr sources, in which
+        case tf_shifts is the dict of name : array [control region, HT bin, x bin]
+        from tf_shift(), for each of them (see sb_corr_sources()).
+        """
+        fracs = [s.fractions(regions, njet, htbins, fine_jet, tf_shifts) for s in self.sources]
+        if fracs:
+            fracs = np.broadcast_arrays(*fracs)
+        uncorr = [f for f, s in zip(fracs, self.sources) if not s.correlated_ht]
+        corr = [f for f, s in zip(fracs, self.sources) if s.correlated_ht]
+        shape = (0, len(regions), len(htbins), 1)
+        return (np.array(uncorr) if uncorr else np.zeros(shape),
+                np.array(corr) if corr else np.zeros(shape))
+
+    def sb_corr_sources(self):
+        """
+        Sources the engine needs to give fractions() tf_shifts for
+        """
+        return [s for s in self.sources if s.derived == "sb_corr"]
+
+
+def trig_eff_fractions(variation, regions, njet, htbins, fine_jet=False):
+    """
+    Array [region, HT bin] of the fractional change in the prediction from
+    varying the trigger inefficiencies (1 - eff) by variation, for the signal
+    region (Had) & each control region independently. QCD is MC in the signal
+    region, so just gets the Had part.
+    """
+    trig_eff = grabr.trig_eff_fine if fine_jet else grabr.trig_eff_old
+    jet = (grabr.jet_string_fine if fine_jet else grabr.jet_string_old)(njet)
+
+    def rel_change(sele):
+        effs = np.array([trig_eff(sele=sele, ht=ht.split("_")[0], njet=jet) for ht in htbins], dtype=np.float64)
+        return variation * (1. - effs) / effs
+
+    had = rel_change("Had")
+    return np.array([np.sqrt(had ** 2 + (0. if reg == "QCD" else rel_change(reg)) ** 2) for reg in regions])
+
+
+def sb_corr_scales(variation, processes):
+    """
+    What to scale the MC (already sideband corrected) for each process by
+    to vary its sideband correction (its difference from 1) up by variation
+    """
+    corrs = np.array([grabr.sb_corr(p) for p in processes], dtype=np.float64)
+    return (1. + (corrs - 1.) * (1. + variation)) / corrs
+
+
+def tf_shift(mc_signal, mc_control, scale_signal, scale_control):
+    """
+    Fractional change in the transfer factor MC_signal / MC_control if each MC
+    process gets scaled (e.g. by sb_corr_scales()). mc_*: sumw arrays
+    [..., process, x bin], scale_*: broadcastable to [..., process].
+    Returns array [..., x bin], 0 where the TF is 0.
+    """
+    def ratio(num, den):
+        return np.where(den != 0, num / np.where(den != 0, den, 1.), 0.)
+
+    nominal = ratio(mc_signal.sum(axis=-2), mc_control.sum(axis=-2))
+    varied = ratio((mc_signal * scale_signal[..., np.newaxis]).sum(axis=-2),
+                   (mc_control * scale_control[..., np.newaxis]).sum(axis=-2))
+    return np.where(nominal != 0, ratio(varied, nominal) - 1., 0.)
+
+
+_loaded = {}
+
+
+def load_systematics(config_path=None):
+    """
+    Load (& remember) the systematics config (default: DEFAULT_CONFIG)
+    """
+    config_path = os.path.abspath(config_path or DEFAULT_CONFIG)
+    if config_path not in _loaded:
+        with open(config_path) as f:
+            _loaded[config_path] = Systematics(json.load(f))
+        _loaded[config_path].path = config_path
+    return _loaded[config_path]
+
+
+def loaded_paths():
+    """
+    Every config file we've loaded (& not forgotten)
+    """
+    return sorted(_loaded)
+
+
+def clear_cache():
+    """
+    Forget loaded configs, so they get re-read (e.g. if they've been edited)
+    """
+    _loaded.clear()
@@ -0,0 +1,196 @@
+"""
+Run a bunch of interdependent computations as a DAG, doing each distinct
+one only once.
+
+Each node is identified by a hash of what it does (op name & params) and
+the keys of its inputs, so adding the same computation twice just gives
+you back the same node - e.g. if two plots need the same input histogram,
+it only gets read once.
+
+    graph = TaskGraph()
+    a = graph.add("fetch", fetch_file, [f_path, reqs], main_thread=True)
+    b = graph.add("double", double, [], deps=[a])
+    results = graph.run([b], n_threads=4)
+
+fn gets called as fn(*(params + results of deps)). params must be JSON-able.
+
+Nodes run as soon as their inputs are ready, up to n_threads at once.
+ROOT isn't thread safe, so anything touching it (reading files, drawing)
+must be main_thread=True: those only ever get run by the thread that
+called run(). Results are dropped once nothing else needs them.
+"""
+
+import json
+import hashlib
+import logging
+import threading
+import traceback
+from Queue import Queue
+from collections import deque
+from multiprocessing import cpu_count
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def node_key(op, params, deps):
+    """
+    Content address of a node
+    """
+    # numpy arrays (e.g. bin edges) go in as lists
+    return hashlib.sha1(json.dumps([op, params, list(deps)], sort_keys=True,
+                                   default=lambda o: o.tolist())).hexdigest()
+
+
+class Node():
+
+    def __init__(self, op, fn, params, deps, main_thread):
+        self.op = op
+        self.fn = fn
+        self.params = list(params)
+        self.deps = list(deps)
+        self.main_thread = main_thread
+
+    def __call__(self, dep_results):
+        return self.fn(*(self.params + dep_results))
+
+    def describe(self):
+        return "%s%s" % (self.op, tuple(self.params))
+
+
+class TaskGraph():
+    """
+    DAG of computations, deduplicated by content. See module docstring.
+    """
+
+    def __init__(self):
+        self.nodes = {}  # key : Node
+        self.n_added = 0  # number of add() calls, to see how much we saved
+        self.n_run = 0
+        self.failed = {}  # key : reason, from the last run()
+
+    def add(self, op, fn, params=(), deps=(), main_thread=False):
+        """
+        Add a node (if we don't have it already). Returns its key.
+        """
+        self.n_added += 1
+        key = node_key(op, params, deps)
+        if key not in self.nodes:
+            for d in deps:
+                if d not in self.nodes:
+                    raise KeyError("Input %s of %s not in graph" % (d, op))
+            self.nodes[key] = Node(op, fn, params, deps, main_thread)
+        return key
+
+    def needed(self, targets):
+        """
+        All the nodes needed to make targets
+        """
+        needed = set()
+        stack = list(targets)
+        while stack:
+            key = stack.pop()
+            if key not in needed:
+                needed.add(key)
+                stack.extend(self.nodes[key].deps)
+        return needed
+
+    def run(self, targets=None, n_threads=None, keep_going=False):
+        """
+        Compute targets (default: everything), & return dict of key : result.
+        If a node fails, raises RuntimeError, or if keep_going, carries on
+        with everything that doesn't depend on it - see self.failed for
+        what didn't work (targets that failed aren't in the results).
+        """
+        targets = set(targets if targets is not None else self.nodes)
+        needed = self.needed(targets)
+        n_waiting = dict((k, len(set(self.nodes[k].deps))) for k in needed)
+        users = dict((k, set()) for k in needed)
+        for k in needed:
+            for d in set(self.nodes[k].deps):
+                users[d].add(k)
+        n_users = dict((k, len(u)) for k, u in users.iteritems())
+        results = {}
+        self.failed = {}
+        n_left = [len(needed)]
+
+        ready_main = deque()
+        to_threads = Queue()
+        finished = Queue()  # (key, ok, result) from the threads
+
+        def work():
+            while True:
+                key = to_threads.get()
+                if key is None:
+                    return
+                finished.put(run_node(key))
+
+        def run_node(key):
+            node = self.nodes[key]
+            try:
+                return key, True, node([results[d] for d in node.deps])
+            except Exception:
+                return key, False, traceback.format_exc()
+
+        def schedule(key):
+            if self.nodes[key].main_thread:
+                ready_main.append(key)
+            else:
+                to_threads.put(key)
+
+        def fail(key, reason):
+            """mark key & everything downstream of it as failed"""
+            stack = [(key, reason)]
+            while stack:
+                k, why = stack.pop()
+                if k in self.failed:
+                    continue
+                self.failed[k] = why
+                n_left[0] -= 1
+                stack.extend((u, "input %s failed" % self.nodes[k].describe()) for u in users[k])
+
+        def done(key, ok, result):
+            if not ok:
+                if not keep_going:
+                    raise RuntimeError("%s failed:\n%s" % (self.nodes[key].describe(), result))
+                log.error("%s failed:\n%s" % (self.nodes[key].describe(), result))
+                fail(key, result)
+                return
+            self.n_run += 1
+            results[key] = result
+            n_left[0] -= 1
+            for u in users[key]:
+                n_waiting[u] -= 1
+                if n_waiting[u] == 0 and u not in self.failed:
+                    schedule(u)
+            for d in set(self.nodes[key].deps):
+                n_users[d] -= 1
+                if n_users[d] == 0 and d not in targets:
+                    del results[d]
+
+        n_threads = n_threads or cpu_count()
+        threads = [threading.Thread(target=work, name="dag%d" % i) for i in xrange(n_threads)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            for k in needed:
+                if n_waiting[k] == 0:
+                    schedule(k)
+            while n_left[0] > 0:
+                if ready_main:
+                    done(*run_node(ready_main.popleft()))
+                    while not finished.empty():
+                        done(*finished.get())
+                else:
+                    done(*finished.get())
+        finally:
+            for t in threads:
+                to_threads.put(None)
+            for t in threads:
+                t.join()
+        return dict((k, results[k]) for k in targets if k in results)
+
+    def summary(self):
+        return "%d nodes requested, %d distinct, %d run" % (self.n_added, len(self.nodes), self.n_run)
@@ -0,0 +1,246 @@
+"""
+Run tasks in parallel in worker processes, so that each gets its own
+ROOT state & a segfault only takes out the one worker.
+
+Workers are long-lived, so we don't pay for starting up (& setting up
+ROOT) on every task, but if one dies (segfault or other abnormal exit)
+its task is retried in a fresh worker (if it dies in between tasks, the
+next one just goes to a fresh worker). Workers are also recycled after
+max_tasks tasks, or once they use more than max_rss_mb of memory, since
+ROOT has a habit of leaking.
+
+    sup = Supervisor(fn, n_workers=8, max_tasks=20, max_rss_mb=2000)
+    for key, ok, result in sup.run([(key, args), ...]):
+        ...
+
+ok is True if fn(*args) returned (result is its return value), False if it
+raised (result is the traceback) or kept crashing the worker (result says how).
+Results come back in the order tasks finish.
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import resource
+import traceback
+from multiprocessing import Process, Pipe, cpu_count
+
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def current_rss_mb():
+    """
+    Memory used by this process, in MB
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024. ** 2
+    except (IOError, ValueError, IndexError):
+        # no /proc (e.g. Mac), so use the peak instead
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024. ** 2 if sys.platform == "darwin" else peak / 1024.
+
+
+def _worker(conn, fn, initializer):
+    """
+    Runs in the worker process: do tasks from conn until we get None
+    """
+    if initializer:
+        initializer()
+    while True:
+        args = conn.recv()
+        if args is None:  # from Worker.stop()
+            break
+        try:
+            ok, result = True, fn(*args)
+        except Exception:
+            ok, result = False, traceback.format_exc()
+        conn.send((ok, result, current_rss_mb()))
+    conn.close()
+
+
+def describe_exit(exitcode):
+    """
+    Make an exit code human readable
+    """
+    if exitcode < 0:
+        names = dict((getattr(signal, s), s) for s in dir(signal) if s.startswith("SIG") and "_" not in s)
+        return "worker killed by %s" % names.get(-exitcode, "signal %d" % -exitcode)
+    return "worker exited with code %d without a result" % exitcode
+
+
+class Worker():
+    """
+    Parent's handle on one worker process
+    """
+
+    def __init__(self, fn, initializer):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=_worker, args=(child_conn, fn, initializer))
+        self.process.start()
+        child_conn.close()  # so we get EOF if the child dies
+        self.n_done = 0
+        self.task = None  # (key, args, attempt) it's working on
+        self.group = None  # group of the last task, see Supervisor
+
+    def start(self, task):
+        """
+        Send task to the worker. Returns False if it's died (e.g. the OOM
+        killer took it while it was idle)
+        """
+        try:
+            self.conn.send(task[1])
+        except (IOError, OSError):
+            return False
+        self.task = task
+        return True
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):  # already dead
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class Supervisor():
+    """
+    Runs fn(*args) for a bunch of tasks in n_workers worker processes.
+
+    initializer: called at the start of each worker
+    max_tasks: recycle a worker after this many tasks (None = never)
+    max_rss_mb: recycle a worker once it's using more memory than this (None = never)
+    max_retries: how many times to retry a task that crashed its worker
+    group: fn(key) -> anything. Workers prefer tasks in the same group as
+        their last one, e.g. so they can reuse things they've cached.
+    """
+
+    def __init__(self, fn, n_workers=None, initializer=None, max_tasks=None, max_rss_mb=None,
+                 max_retries=1, group=None, poll_interval=0.05):
+        self.fn = fn
+        self.n_workers = n_workers or cpu_count()
+        self.initializer = initializer
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.max_retries = max_retries
+        self.group = group or (lambda key: None)
+        self.poll_interval = poll_interval
+        self.n_started = 0  # number of worker processes over the whole run, for info
+
+    def next_task(self, pending, worker):
+        """Take the next task for worker from pending, preferring ones in its group"""
+        if worker.group is not None:
+            for i, task in enumerate(pending):
+                if self.group(task[0]) == worker.group:
+                    return pending.pop(i)
+        return pending.pop(0)
+
+    def assign(self, worker, task, pending, workers, finished):
+        """
+        Give task to worker. If it's died, drop it & put the task back for
+        another worker. That only counts as a try if the worker never did
+        anything, so one that can't even start doesn't go round forever.
+        """
+        if worker.start(task):
+            return
+        workers.remove(worker)
+        worker.process.join()
+        reason = describe_exit(worker.process.exitcode)
+        worker.conn.close()
+        key, args, attempt = task
+        if worker.n_done:
+            log.warning("%s: idle worker died (%s), giving the task to a new one" % (key, reason))
+            pending.insert(0, task)
+        elif attempt < self.max_retries:
+            log.warning("%s: %s, retrying in a new worker" % (key, reason))
+            pending.insert(0, (key, args, attempt + 1))
+        else:
+            finished.append((key, False, reason))
+
+    def needs_recycling(self, worker, rss):
+        if self.max_tasks and worker.n_done >= self.max_tasks:
+            return True
+        if self.max_rss_mb and rss > self.max_rss_mb:
+            log.debug("Recycling worker %d, using %.0f MB" % (worker.process.pid, rss))
+            return True
+        return False
+
+    def run(self, tasks):
+        """
+        Do all the (key, args) tasks. Yields (key, ok, result) as they finish.
+        """
+        pending = [(key, args, 0) for key, args in tasks]
+        workers = []
+        try:
+            while pending or any(w.task for w in workers):
+                finished = []
+                # give out tasks, starting new workers if needed
+                for w in [w for w in workers if not w.task]:
+                    if not pending:
+                        break
+                    self.assign(w, self.next_task(pending, w), pending, workers, finished)
+                while pending and len(workers) < self.n_workers:
+                    w = Worker(self.fn, self.initializer)
+                    self.n_started += 1
+                    workers.append(w)
+                    self.assign(w, self.next_task(pending, w), pending, workers, finished)
+
+                for w in [w for w in workers if w.task]:
+                    key, args, attempt = w.task
+                    ok = None
+                    try:
+                        has_result = w.conn.poll()
+                    except (IOError, OSError):  # died before reading its task
+                        has_result = True
+                    if has_result:
+                        try:
+                            ok, result, rss = w.conn.recv()
+                        except (EOFError, IOError, OSError):
+                            pass
+                    elif w.process.is_alive():
+                        continue
+
+                    if ok is None:
+                        # worker died on us
+                        w.process.join()
+                        reason = describe_exit(w.process.exitcode)
+                        workers.remove(w)
+                        w.conn.close()
+                        if attempt < self.max_retries:
+                            log.warning("%s: %s, retrying in a new worker" % (key, reason))
+                            pending.insert(0, (key, args, attempt + 1))
+                        else:
+                            finished.append((key, False, reason))
+                        continue
+
+                    w.task = None
+                    w.n_done += 1
+                    w.group = self.group(key)
+                    finished.append((key, ok, result))
+                    if self.needs_recycling(w, rss):
+                        workers.remove(w)
+                        w.stop()
+
+                for item in finished:
+                    yield item
+                if not finished:
+                    time.sleep(self.poll_interval)
+        finally:
+            for w in workers:
+                if w.task:  # only if we're bailing out early
+                    w.process.terminate()
+                w.stop()
+
+
+def run_tasks(fn, tasks, n_jobs=None, **kwargs):
+    """
+    Run fn(*args) for each (key, args) in tasks, at most n_jobs at once
+    (default: number of cores). Yields (key, ok, result) as they finish.
+    Other kwargs are passed to Supervisor.
+    """
+    return Supervisor(fn, n_jobs, **kwargs).run(tasks)
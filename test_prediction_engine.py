@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Regression tests for PredictionEngine, on fake NumPy store inputs from
+make_fake_inputs.py, so they don't need ROOT or the real input files:
+
+python -m unittest -v test_prediction_engine
+
+- results() must match the old make_hists(): a per-HT bin loop that
+  rebins each input first, does data_control * MC_signal / MC_control
+  with TH1::Divide/Multiply errors, adds the closure test syst (the old
+  tf_systs table, none for fine jet multiplicity) for each HT bin, &
+  sums it all up. For exclusive & inclusive HT, stat & stat+syst bands.
+- the task_dag version (add_to_graph()) must match compute().
+"""
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import plot_grabber as grabr
+import make_fake_inputs
+import prediction_engine as pe
+from prediction_engine import PredictionEngine
+
+
+HTBINS = ["200_275", "275_325", "325_375", "375_475"]
+VAR, REBIN = "AlphaT", 2
+
+# the old Prediction_Plot.tf_systs, (as a %)
+OLD_TF_SYSTS = {
+    "le3j": {"200_275": 4, "275_325": 6, "325_375": 6, "375_475": 8, "475_575": 8, "575_675": 12, "675_775": 12, "775_875": 17, "875_975": 17, "975_1075": 19, "1075": 19},
+    "ge4j": {"200_275": 6, "275_325": 6, "325_375": 11, "375_475": 11, "475_575": 11, "575_675": 18, "675_775": 18, "775_875": 20, "875_975": 20, "975_1075": 26, "1075": 26}
+}
+
+
+def grab(root_dir, f_name, sele, njet, btag, ht):
+    """One input hist, rebinned"""
+    f_path = "%s/%s.root" % (root_dir, f_name)
+    return grabr.grab_hists(f_path, [(sele, VAR, njet, btag, ht)]).values()[0].rebin(REBIN)
+
+
+def old_prediction(root_dir, njet, btag, htbins, qcd):
+    """
+    What the old make_hists() did, HT bin by HT bin. Returns list of
+    (values, stat variances, stat+syst variances) per region (cumulative
+    over regions, QCD last), & (values, variances) of data in the signal region
+    """
+    fine_jet = "fineJetMulti" in root_dir
+    sig_start = pe.file_start(pe.signal_proc)
+    processes = pe.signal_processes(btag)
+
+    def syst_var(values, ht):
+        frac = 0. if fine_jet else OLD_TF_SYSTS.get(njet, {}).get(ht, 0) / 100.
+        out = np.zeros_like(values)
+        out[1:-1] = (values[1:-1] * frac) ** 2  # not under/overflow
+        return out
+
+    regions = []
+    for ctrl in pe.ctrl_regions:
+        if not processes.get(ctrl):
+            continue
+        ctrl_start = pe.file_start(ctrl)
+        total = None
+        for ht in htbins:
+            data_ctrl = grab(root_dir, "%s_Data" % ctrl_start, ctrl, njet, btag, ht)
+            mc_sig = grab(root_dir, "%s_%s" % (sig_start, processes[ctrl][0]), pe.signal_proc, njet, btag, ht)
+            for p in processes[ctrl][1:]:
+                mc_sig = mc_sig + grab(root_dir, "%s_%s" % (sig_start, p), pe.signal_proc, njet, btag, ht)
+            mc_ctrl = grab(root_dir, "%s_%s" % (ctrl_start, pe.processes_mc_ctrl[0]), ctrl, njet, btag, ht)
+            for p in pe.processes_mc_ctrl[1:]:
+                mc_ctrl = mc_ctrl + grab(root_dir, "%s_%s" % (ctrl_start, p), ctrl, njet, btag, ht)
+            # TH1::Divide, then TH1::Multiply
+            a, va, b, vb = mc_sig.values, mc_sig.variances, mc_ctrl.values, mc_ctrl.variances
+            b_safe = np.where(b != 0, b, 1.)
+            tf = np.where(b != 0, a / b_safe, 0.)
+            var_tf = np.where(b != 0, (va * b * b + vb * a * a) / b_safe ** 4, 0.)
+            pred = data_ctrl.values * tf
+            var_pred = data_ctrl.variances * tf * tf + var_tf * data_ctrl.values ** 2
+            this = np.array([pred, var_pred, var_pred + syst_var(pred, ht)])
+            total = this if total is None else total + this
+        regions.append(total)
+    if qcd:
+        total = None
+        for ht in htbins:
+            h = grab(root_dir, "Had_QCD", pe.signal_proc, njet, btag, ht)
+            this = np.array([h.values, h.variances, h.variances + syst_var(h.values, ht)])
+            total = this if total is None else total + this
+        regions.append(total)
+    stacked = [regions[0]]
+    for r in regions[1:]:
+        stacked.append(stacked[-1] + r)
+    data = None
+    for ht in htbins:
+        h = grab(root_dir, "%s_Data" % sig_start, pe.signal_proc, njet, btag, ht)
+        data = np.array([h.values, h.variances]) if data is None else data + np.array([h.values, h.variances])
+    return regions, stacked, data
+
+
+class PredictionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp(prefix="test_prediction_engine_")
+        cls.inputs = cls.tmp_dir + "/inputs"
+        cls.inputs_fine = cls.tmp_dir + "/inputs_fineJetMulti"
+        make_fake_inputs.make_fake_inputs(cls.inputs, [VAR], ["le3j"], ["eq0b"], HTBINS, 40, "store")
+        make_fake_inputs.make_fake_inputs(cls.inputs_fine, [VAR], ["eq3j"], ["eq0b"], HTBINS, 40, "store")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def check_against_old(self, root_dir, njet, qcd):
+        engine = PredictionEngine(root_dir, VAR, njet, "eq0b", HTBINS, REBIN, qcd)
+        # each exclusive HT bin, & inclusive from each one up
+        for htbins in [[ht] for ht in HTBINS] + [HTBINS[i:] for i in xrange(len(HTBINS))]:
+            components, errors_stat, errors_stat_syst, data = engine.results(htbins)
+            regions, stacked, old_data = old_prediction(root_dir, njet, "eq0b", htbins, qcd)
+            self.assertEqual(len(components), len(regions))
+            for comp, stat, syst, old, old_stacked in zip(components, errors_stat, errors_stat_syst, regions, stacked):
+                np.testing.assert_allclose(comp.values, old[0], rtol=1e-10)
+                np.testing.assert_allclose(comp.variances, old[1], rtol=1e-10)
+                np.testing.assert_allclose(stat.values, old_stacked[0], rtol=1e-10)
+                np.testing.assert_allclose(stat.variances, old_stacked[1], rtol=1e-10)
+                np.testing.assert_allclose(syst.variances, old_stacked[2], rtol=1e-10)
+            np.testing.assert_allclose(data.values, old_data[0], rtol=1e-10)
+            np.testing.assert_allclose(data.variances, old_data[1], rtol=1e-10)
+
+    def test_matches_old(self):
+        self.check_against_old(self.inputs, "le3j", False)
+
+    def test_matches_old_qcd(self):
+        self.check_against_old(self.inputs, "le3j", True)
+
+    def test_matches_old_fine_jet(self):
+        self.check_against_old(self.inputs_fine, "eq3j", False)
+
+    def test_dag_matches_compute(self):
+        import task_dag
+        for qcd in [False, True]:
+            engine = PredictionEngine(self.inputs, VAR, "le3j", "eq0b", HTBINS, REBIN, qcd)
+            graph = task_dag.TaskGraph()
+            key = engine.add_to_graph(graph)
+            from_dag = graph.run([key], n_threads=2)[key]
+            engine.compute()
+            self.assertEqual(engine.regions, from_dag.regions)
+            for region in engine.regions:
+                for a, b in zip(engine.cumulative[region], from_dag.cumulative[region]):
+                    np.testing.assert_allclose(a, b, rtol=1e-12)
+                np.testing.assert_allclose(engine.cumulative_corr[region], from_dag.cumulative_corr[region], rtol=1e-12)
+            for a, b in zip(engine.cumulative_data, from_dag.cumulative_data):
+                np.testing.assert_allclose(a, b, rtol=1e-12)
+
+
+if __name__ == "__main__":
+    unittest.main()